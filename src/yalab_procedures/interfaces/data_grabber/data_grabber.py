@@ -1,16 +1,55 @@
+import copy
 import json
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 from nipype.interfaces import io as nio
+from nipype.interfaces.base import Directory, isdefined, traits
+
+from yalab_procedures.interfaces.data_grabber.layout_cache import get_layout
 
 DEFAULT_OUTPUT_QUERY = Path(__file__).parent / "default_bids_query.json"
 
 
+@lru_cache(maxsize=None)
+def _read_output_query(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_output_query(path: Path = DEFAULT_OUTPUT_QUERY) -> dict:
+    """
+    The output query of a JSON file, read once per process.
+    """
+    return copy.deepcopy(_read_output_query(str(path)))
+
+
+class YALabBidsQueryInputSpec(nio.BIDSDataGrabberInputSpec):
+    bids_database_dir = Directory(
+        exists=False,
+        mandatory=False,
+        desc="Directory containing SQLite database indices for the input BIDS dataset (by default $YALAB_BIDS_DATABASE_DIR or ~/.cache/yalab_procedures/bids_layouts).",  # noqa: E501
+    )
+    use_layout_cache = traits.Bool(
+        True,
+        usedefault=True,
+        desc="Whether to query the persistent layout index rather than indexing the dataset on every run.",  # noqa: E501
+    )
+
+
 class YALabBidsQuery(nio.BIDSDataGrabber):
     """
     A simple wrapper around the BIDSDataGrabber interface that sets the output query to the default query.
+
+    Unless ``load_layout`` is given, the dataset is queried through a
+    persistent, shared layout index (see
+    :func:`~yalab_procedures.interfaces.data_grabber.layout_cache.get_layout`).
+    See :func:`query_sessions` to query many subjects/sessions at once.
     """
 
+    input_spec = YALabBidsQueryInputSpec
+
     def __init__(self, *args, **kwargs):
         super(YALabBidsQuery, self).__init__(*args, **kwargs)
         self._update_output_query()
@@ -19,6 +58,100 @@ class YALabBidsQuery(nio.BIDSDataGrabber):
         """
         Update the output query with the default query.
         """
-        with open(DEFAULT_OUTPUT_QUERY, "r") as f:
-            output_query = json.load(f)
-        self.inputs.output_query.update(output_query)
+        self.inputs.output_query.update(load_output_query())
+
+    def _list_outputs(self):
+        # extra derivatives would be added to the shared layout
+        if (
+            isdefined(self.inputs.load_layout)
+            or isdefined(self.inputs.extra_derivatives)
+            or not self.inputs.use_layout_cache
+        ):
+            return super(YALabBidsQuery, self)._list_outputs()
+        layout = get_layout(
+            self.inputs.base_dir,
+            directory=(
+                self.inputs.bids_database_dir
+                if isdefined(self.inputs.bids_database_dir)
+                else None
+            ),
+            derivatives=self.inputs.index_derivatives,
+        )
+        # infields without a value do not filter
+        filters = {}
+        for key in self._infields:
+            value = getattr(self.inputs, key)
+            if isdefined(value):
+                filters[key] = value
+
+        outputs = {}
+        for key, query in self.inputs.output_query.items():
+            args = query.copy()
+            args.update(filters)
+            filelist = layout.get(return_type="file", **args)
+            if len(filelist) == 0:
+                msg = f"Output key: {key} returned no files"
+                if self.inputs.raise_on_empty:
+                    raise OSError(msg)
+                nio.iflogger.warning(msg)
+                filelist = nio.Undefined
+            outputs[key] = filelist
+        return outputs
+
+
+def query_sessions(
+    base_dir: Union[str, Path],
+    sessions: Iterable[Tuple[str, Optional[str]]],
+    output_query: Optional[dict] = None,
+    bids_database_dir: Optional[Union[str, Path]] = None,
+    index_derivatives: bool = False,
+) -> Dict[Tuple[str, str], Dict[str, List[str]]]:
+    """
+    Resolve an output query for many subjects/sessions at once.
+
+    Every key of the query is a single query of the layout index (see
+    :func:`~yalab_procedures.interfaces.data_grabber.layout_cache.get_layout`)
+    covering all the subjects, whose files are then split by session,
+    instead of one query per subject, session and key.
+
+    Parameters
+    ----------
+    base_dir : Union[str, Path]
+        The BIDS dataset.
+    sessions : Iterable[Tuple[str, Optional[str]]]
+        The (subject, session) pairs; a session of None (or "") selects all
+        the files of the subject.
+    output_query : Optional[dict], optional
+        The output query, by default the default query of
+        :class:`YALabBidsQuery`.
+    bids_database_dir : Optional[Union[str, Path]], optional
+        The directory of the layout databases.
+    index_derivatives : bool, optional
+        Whether to index the dataset's derivatives, by default False.
+
+    Returns
+    -------
+    Dict[Tuple[str, str], Dict[str, List[str]]]
+        The files of every key of the query (possibly empty), by (subject,
+        session), with "" for sessions not given.
+    """
+    output_query = load_output_query() if output_query is None else output_query
+    sessions = [(subject, session or "") for subject, session in sessions]
+    subjects = sorted({subject for subject, _ in sessions})
+    table = {pair: {key: [] for key in output_query} for pair in sessions}
+    if not subjects:
+        return table
+    layout = get_layout(
+        base_dir, directory=bids_database_dir, derivatives=index_derivatives
+    )
+    for key, query in output_query.items():
+        for bids_file in layout.get(subject=subjects, **query):
+            entities = bids_file.entities
+            subject = entities.get("subject")
+            for pair in {(subject, entities.get("session", "")), (subject, "")}:
+                if pair in table:
+                    table[pair][key].append(bids_file.path)
+    for files in table.values():
+        for paths in files.values():
+            paths.sort()
+    return table
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple, Union
+
+DATABASE_DIR_ENVIRONMENT_VARIABLE = "YALAB_BIDS_DATABASE_DIR"
+DEFAULT_DATABASE_DIR = Path.home() / ".cache" / "yalab_procedures" / "bids_layouts"
+# top-level directories pybids does not index (besides hidden ones)
+IGNORED_DIRECTORIES = {"code", "sourcedata", "stimuli", "models", "derivatives"}
+# number of versions of a dataset's index kept, so processes still reading the
+# previous one are not disturbed by a rebuild
+KEPT_VERSIONS = 2
+
+# layouts loaded in this process: (root, derivatives) -> (version, layout)
+_LAYOUTS: Dict[Tuple[str, bool], tuple] = {}
+_LAYOUTS_LOCK = Lock()
+
+
+def database_dir(directory: Optional[Union[str, Path]] = None) -> Path:
+    """
+    The directory of the layout databases: ``directory`` if given, else
+    ``$YALAB_BIDS_DATABASE_DIR``, else ``~/.cache/yalab_procedures/bids_layouts``.
+    """
+    if directory:
+        return Path(directory)
+    return Path(
+        os.environ.get(DATABASE_DIR_ENVIRONMENT_VARIABLE) or DEFAULT_DATABASE_DIR
+    )
+
+
+def _directory_mtimes(root: str, derivatives: bool = False) -> Dict[str, int]:
+    """
+    The mtime of every directory of a dataset that pybids indexes.
+
+    A directory's mtime changes whenever an entry is added to, removed from
+    or renamed in it, so these detect every new, deleted or replaced file.
+    """
+    mtimes = {}
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        try:
+            mtimes[os.path.relpath(path, root)] = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            if path == root and entry.name in IGNORED_DIRECTORIES:
+                if not (derivatives and entry.name == "derivatives"):
+                    continue
+            pending.append(entry.path)
+    return mtimes
+
+
+def layout_version(root: Union[str, Path], derivatives: bool = False) -> str:
+    """
+    A fingerprint of the directories of a dataset, which changes whenever
+    its layout (the files pybids indexes) does.
+    """
+    mtimes = _directory_mtimes(str(root), derivatives)
+    digest = hashlib.sha1()
+    for path in sorted(mtimes):
+        digest.update(f"{path}\0{mtimes[path]}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def _dataset_key(root: str, derivatives: bool) -> str:
+    digest = hashlib.sha1(f"{root}\0{derivatives}".encode()).hexdigest()[:12]
+    return f"{Path(root).name}-{digest}"
+
+
+def _build(root: str, dataset_dir: Path, version: str, derivatives: bool) -> Path:
+    """
+    Index a dataset into a new version of its database, published with an
+    atomic rename so readers never see a partial index.
+    """
+    from bids import BIDSLayout
+
+    target = dataset_dir / version
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{version}.", dir=dataset_dir))
+    try:
+        BIDSLayout(root, derivatives=derivatives, database_path=str(staging / "layout"))
+        os.rename(staging, target)
+    except OSError:
+        # another process published this version first
+        if not target.exists():
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    versions = sorted(
+        (p for p in dataset_dir.iterdir() if not p.name.startswith(".")),
+        key=lambda p: p.stat().st_mtime_ns,
+        reverse=True,
+    )
+    for old in versions[KEPT_VERSIONS:]:
+        if old != target:
+            shutil.rmtree(old, ignore_errors=True)
+    return target
+
+
+def get_layout(
+    root: Union[str, Path],
+    directory: Optional[Union[str, Path]] = None,
+    derivatives: bool = False,
+):
+    """
+    The pybids layout of a dataset, from a persistent SQLite index.
+
+    The index of a dataset lives in ``<directory>/<dataset>-<hash of root>/
+    <version>``, where the version fingerprints the mtimes of the dataset's
+    directories: a layout is only re-indexed when files were added, removed
+    or renamed since the last index. Published versions are never modified,
+    so many processes can read them concurrently. Files edited in place
+    (e.g. a JSON sidecar rewritten without renaming) are not detected.
+
+    Layouts are also kept in memory, so repeated queries of an unchanged
+    dataset in a process only cost the mtime check.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The BIDS dataset.
+    directory : Optional[Union[str, Path]], optional
+        The directory of the databases (see :func:`database_dir`).
+    derivatives : bool, optional
+        Whether to index the dataset's derivatives, by default False.
+
+    Returns
+    -------
+    BIDSLayout
+        The layout.
+    """
+    from bids import BIDSLayout
+
+    root = os.path.realpath(root)
+    version = layout_version(root, derivatives)
+    with _LAYOUTS_LOCK:
+        cached = _LAYOUTS.get((root, derivatives))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        dataset_dir = database_dir(directory) / _dataset_key(root, derivatives)
+        target = dataset_dir / version
+        if not target.exists():
+            target = _build(root, dataset_dir, version, derivatives)
+        layout = BIDSLayout(database_path=str(target / "layout"))
+        _LAYOUTS[(root, derivatives)] = (version, layout)
+        return layout
@@ -0,0 +1 @@
+from yalab_procedures.procedures.base.cohort import CohortRunner  # noqa: F401
@@ -1,7 +1,6 @@
 # src/yalab_procedures/procedures/axsi/axsi.py
 
 from pathlib import Path
-from subprocess import CalledProcessError, run
 
 from nipype.interfaces.base import (
     CommandLine,
@@ -17,6 +16,7 @@ from yalab_procedures.procedures.base.procedure import (
     ProcedureInputSpec,
     ProcedureOutputSpec,
 )
+from yalab_procedures.procedures.base.runner import run_command
 
 
 class IDNotFoundError(Exception):
@@ -244,19 +244,8 @@ class AxsiProcedure(Procedure, CommandLine):
             command = self.cmdline
 
         # Run the axsi command
-        result = run(
-            command,
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        self.logger.info(result.stdout)
-        if result.stderr:
-            self.logger.error(result.stderr)
-            raise CalledProcessError(
-                result.returncode, command, output=result.stdout, stderr=result.stderr
-            )
+        with self._timed_stage("execution"):
+            run_command(command, self.logger)
         self.logger.info("Finished running AxsiProcedure")
 
     def build_commandline(self) -> str:
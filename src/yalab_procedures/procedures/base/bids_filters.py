@@ -0,0 +1,256 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+BIDS_DATATYPES = {
+    "anat",
+    "beh",
+    "dwi",
+    "eeg",
+    "fmap",
+    "func",
+    "ieeg",
+    "meg",
+    "micr",
+    "motion",
+    "nirs",
+    "perf",
+    "pet",
+}
+
+# filename keys of the entities used in BIDS filter files
+ENTITY_KEYS = {
+    "sub": "subject",
+    "ses": "session",
+    "task": "task",
+    "acq": "acquisition",
+    "ce": "ceagent",
+    "rec": "reconstruction",
+    "dir": "direction",
+    "run": "run",
+    "echo": "echo",
+    "flip": "flip",
+    "inv": "inv",
+    "mt": "mt",
+    "part": "part",
+    "space": "space",
+}
+
+# the queries of qsiprep/smriprep a BIDS filter file refines (by query name)
+DEFAULT_QUERIES = {
+    "t1w": {"datatype": "anat", "suffix": "T1w"},
+    "t2w": {"datatype": "anat", "suffix": "T2w"},
+    "flair": {"datatype": "anat", "suffix": "FLAIR"},
+    "roi": {"datatype": "anat", "suffix": "roi"},
+    "dwi": {"datatype": "dwi", "suffix": "dwi"},
+    "fmap": {"datatype": "fmap"},
+    "bold": {"datatype": "func", "suffix": "bold"},
+    "sbref": {"datatype": "func", "suffix": "sbref"},
+}
+
+
+def parse_bids_filename(name: str) -> Dict[str, str]:
+    """
+    Parse the entities, suffix and extension of a BIDS file name.
+
+    Parameters
+    ----------
+    name : str
+        The file name (e.g. "sub-01_ses-01_dir-AP_dwi.nii.gz").
+
+    Returns
+    -------
+    Dict[str, str]
+        The entities keyed by their long names (as used in BIDS filter files),
+        plus "suffix" and "extension".
+    """
+    stem, dot, extension = name.partition(".")
+    parts = stem.split("_")
+    entities = {
+        "suffix": parts[-1] if len(parts) > 1 else "",
+        "extension": dot + extension,
+    }
+    for part in parts[:-1]:
+        key, _, value = part.partition("-")
+        entities[ENTITY_KEYS.get(key, key)] = value
+    return entities
+
+
+def _value_matches(value: Optional[str], expected: Any) -> bool:
+    """
+    Whether an entity value matches the value of a filter.
+
+    A null filter value requires the entity to be absent, and a list
+    accepts any of its values. Numbers match regardless of zero-padding.
+    """
+    if expected is None:
+        return value is None
+    if isinstance(expected, (list, tuple)):
+        return any(_value_matches(value, item) for item in expected)
+    if value is None:
+        return False
+    if str(value).isdigit() and str(expected).isdigit():
+        return int(value) == int(expected)
+    return str(value) == str(expected)
+
+
+class BidsFilter:
+    """
+    Selects the files of a participant's BIDS tree a procedure actually reads.
+
+    A file is kept if its datatype is one of ``datatypes`` and, when queries of
+    the BIDS filter file target its datatype and suffix, it matches at least
+    one of them. Queries refine the tools' default queries of the same name
+    (e.g. ``{"t1w": {"session": "01"}}`` only selects among T1w images), and
+    files no query targets are kept. The extension is not compared, so the
+    sidecars of a selected image (.json, .bval, .bvec, ...) are selected with
+    it. Files outside of datatype directories (e.g. ``*_scans.tsv``) are always
+    kept, but :meth:`rewrite` drops the rows of scans tables and the
+    ``IntendedFor`` entries of fieldmap sidecars that point at filtered files.
+
+    Parameters
+    ----------
+    datatypes : Optional[Iterable[str]], optional
+        The datatypes the procedure reads, by default None (all of them).
+    queries : Optional[Dict[str, Dict[str, Any]]], optional
+        The queries of a BIDS filter file, keyed by query name
+        (e.g. ``{"dwi": {"datatype": "dwi", "acquisition": "AP"}}``).
+    """
+
+    def __init__(
+        self,
+        datatypes: Optional[Iterable[str]] = None,
+        queries: Optional[Dict[str, Dict[str, Any]]] = None,
+    ):
+        self.datatypes = sorted(datatypes) if datatypes is not None else None
+        self.queries = {
+            name: {**DEFAULT_QUERIES.get(name, {}), **query}
+            for name, query in (queries or {}).items()
+        }
+
+    @classmethod
+    def from_file(
+        cls,
+        filter_file: Optional[Union[str, Path]],
+        datatypes: Optional[Iterable[str]] = None,
+    ) -> "BidsFilter":
+        """
+        Build a filter from a BIDS filter file (as passed to --bids-filter-file).
+        """
+        queries = json.loads(Path(filter_file).read_text()) if filter_file else {}
+        return cls(datatypes, queries)
+
+    @property
+    def key(self) -> str:
+        """
+        A deterministic description of the filter, e.g. for cache keys.
+        """
+        return json.dumps(
+            {"datatypes": self.datatypes, "queries": self.queries}, sort_keys=True
+        )
+
+    def is_trivial(self) -> bool:
+        """
+        Whether the filter keeps every file.
+        """
+        return self.datatypes is None and not self.queries
+
+    def _queries_for(self, datatype: str, suffix: str) -> list:
+        return [
+            query
+            for query in self.queries.values()
+            if _value_matches(datatype, query.get("datatype", datatype))
+            and _value_matches(suffix, query.get("suffix", suffix))
+        ]
+
+    def __call__(self, path: Union[str, Path]) -> bool:
+        """
+        Whether a file (or directory) of a participant's tree should be staged.
+        """
+        path = Path(path)
+        if path.is_dir():
+            return (
+                path.name not in BIDS_DATATYPES
+                or self.datatypes is None
+                or path.name in self.datatypes
+            )
+        datatype = path.parent.name
+        if datatype not in BIDS_DATATYPES:
+            return True
+        if self.datatypes is not None and datatype not in self.datatypes:
+            return False
+        entities = parse_bids_filename(path.name)
+        queries = self._queries_for(datatype, entities["suffix"])
+        if not queries:
+            return True
+        return any(
+            all(
+                _value_matches(entities.get(name), expected)
+                for name, expected in query.items()
+                if name not in ("datatype", "extension")
+            )
+            for query in queries
+        )
+
+    def rewrite(self, path: Union[str, Path]) -> Optional[str]:
+        """
+        The content a file should be staged with, if it references files the
+        filter drops: the rows of a ``*_scans.tsv`` table and the
+        ``IntendedFor`` entries of a fieldmap sidecar pointing at them are
+        removed. None if the file can be staged as is.
+        """
+        path = Path(path)
+        if self.is_trivial():
+            return None
+        if path.name.endswith("_scans.tsv"):
+            return self._rewrite_scans(path)
+        if path.parent.name == "fmap" and path.name.endswith(".json"):
+            return self._rewrite_intended_for(path)
+        return None
+
+    def _rewrite_scans(self, path: Path) -> Optional[str]:
+        lines = path.read_text().splitlines(keepends=True)
+        if not lines:
+            return None
+        kept = [
+            line
+            for line in lines[1:]
+            if not line.strip() or self(path.parent / line.split("\t", 1)[0])
+        ]
+        if len(kept) == len(lines) - 1:
+            return None
+        return "".join(lines[:1] + kept)
+
+    def _rewrite_intended_for(self, path: Path) -> Optional[str]:
+        subject_dir = next(
+            (parent for parent in path.parents if parent.name.startswith("sub-")),
+            None,
+        )
+        if subject_dir is None:
+            return None
+        try:
+            sidecar = json.loads(path.read_text())
+        except ValueError:
+            return None
+        intended_for = sidecar.get("IntendedFor") if isinstance(sidecar, dict) else None
+        if not intended_for:
+            return None
+        entries: List[str] = (
+            [intended_for] if isinstance(intended_for, str) else list(intended_for)
+        )
+        kept = [
+            entry
+            for entry in entries
+            if self(
+                subject_dir.parent / entry[len("bids::") :]
+                if entry.startswith("bids::")
+                else subject_dir / entry
+            )
+        ]
+        if len(kept) == len(entries):
+            return None
+        if kept:
+            sidecar["IntendedFor"] = kept
+        else:
+            sidecar.pop("IntendedFor")
+        return json.dumps(sidecar, indent=2) + "\n"
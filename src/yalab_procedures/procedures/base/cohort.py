@@ -0,0 +1,581 @@
+import csv
+import hashlib
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+
+from nipype.interfaces.base import traits
+from traits.api import TraitError
+
+from yalab_procedures.procedures.base.procedure import Procedure
+from yalab_procedures.procedures.base.resources import (
+    ResourceScheduler,
+    total_memory_gb,
+)
+
+Participant = Tuple[str, Optional[str]]
+InputsFactory = Callable[[str, Optional[str]], Dict[str, Any]]
+
+SUMMARY_FIELDS = ["subject", "session", "status", "duration", "log_file", "error"]
+# stands for an input the inputs_factory does not give a participant
+_MISSING = object()
+
+
+@dataclass
+class CohortJobResult:
+    """
+    The outcome of running a procedure for a single subject/session.
+    """
+
+    subject: str
+    session: Optional[str]
+    status: str
+    duration: float = 0.0
+    log_file: Optional[str] = None
+    error: Optional[str] = None
+
+
+def discover_participants(
+    bids_root: Union[str, Path], sessions: bool = True
+) -> List[Participant]:
+    """
+    Discover the (subject, session) pairs of a BIDS dataset.
+
+    Parameters
+    ----------
+    bids_root : Union[str, Path]
+        The root of the BIDS dataset.
+    sessions : bool, optional
+        Whether to list every session of every subject, by default True.
+        If False (or a subject has no sessions), the session is None.
+
+    Returns
+    -------
+    List[Participant]
+        The (subject, session) pairs, sorted.
+    """
+    participants: List[Participant] = []
+    for subject_dir in sorted(Path(bids_root).glob("sub-*")):
+        if not subject_dir.is_dir():
+            continue
+        subject = subject_dir.name.split("-", 1)[-1]
+        session_dirs = (
+            sorted(d for d in subject_dir.glob("ses-*") if d.is_dir())
+            if sessions
+            else []
+        )
+        if not session_dirs:
+            participants.append((subject, None))
+        for session_dir in session_dirs:
+            participants.append((subject, session_dir.name.split("-", 1)[-1]))
+    return participants
+
+
+def default_job_inputs(
+    procedure_class: Type[Procedure], subject: str, session: Optional[str]
+) -> Dict[str, Any]:
+    """
+    Map a (subject, session) pair onto the inputs of a procedure.
+
+    Procedures with a ``subject_id`` input (e.g. DicomToBidsProcedure) receive
+    ``subject_id``/``session_id``; procedures with a ``participant_label`` input
+    receive the subject as a label (or a one-item list, depending on the trait).
+
+    Parameters
+    ----------
+    procedure_class : Type[Procedure]
+        The procedure to run.
+    subject : str
+        The subject label (without the "sub-" prefix).
+    session : Optional[str]
+        The session label (without the "ses-" prefix).
+
+    Returns
+    -------
+    Dict[str, Any]
+        The job-specific inputs.
+    """
+    spec = procedure_class.input_spec()
+    names = spec.trait_names()
+    if "subject_id" in names:
+        inputs: Dict[str, Any] = {"subject_id": subject}
+        if session is not None and "session_id" in names:
+            inputs["session_id"] = session
+        return inputs
+    if "participant_label" in names:
+        trait_type = spec.trait("participant_label").trait_type
+        if isinstance(trait_type, traits.List):
+            return {"participant_label": [subject]}
+        return {"participant_label": subject}
+    raise ValueError(
+        f"Cannot map subject/session onto the inputs of {procedure_class.__name__}. "
+        "Please provide an inputs_factory."
+    )
+
+
+def processes_whole_subjects(procedure_class: Type[Procedure]) -> bool:
+    """
+    Whether a procedure processes all the sessions of a subject in one run
+    (it takes a ``participant_label`` but no ``subject_id``/``session_id``).
+    """
+    names = procedure_class.input_spec().trait_names()
+    return "participant_label" in names and "subject_id" not in names
+
+
+def collapse_sessions(participants: List[Participant]) -> List[Participant]:
+    """
+    Collapse (subject, session) pairs to one (subject, None) pair per subject,
+    in order.
+    """
+    return list(dict.fromkeys((subject, None) for subject, _ in participants))
+
+
+def batch_participants(
+    participants: List[Participant], batch_size: int
+) -> List[List[Participant]]:
+    """
+    Group (subject, session) pairs into batches of ``batch_size`` subjects.
+    All sessions of a subject end up in the same batch.
+    """
+    subjects: Dict[str, List[Participant]] = {}
+    for subject, session in participants:
+        subjects.setdefault(subject, []).append((subject, session))
+    groups = list(subjects.values())
+    return [
+        [participant for group in groups[i : i + batch_size] for participant in group]
+        for i in range(0, len(groups), max(1, batch_size))
+    ]
+
+
+def default_batch_inputs(
+    procedure_class: Type[Procedure], subjects: List[str]
+) -> Dict[str, Any]:
+    """
+    Map several subjects onto the inputs of one run of a procedure.
+
+    Raises
+    ------
+    ValueError
+        If the procedure cannot process several participants in one run.
+    """
+    spec = procedure_class.input_spec()
+    if "participant_label" in spec.trait_names():
+        try:
+            spec.participant_label = list(subjects)
+            return {"participant_label": list(subjects)}
+        except TraitError:
+            pass
+    raise ValueError(
+        f"{procedure_class.__name__} cannot process several participants in one run."  # noqa: E501
+    )
+
+
+def _run_job(procedure_class: Type[Procedure], inputs: Dict[str, Any]) -> dict:
+    """
+    Run a single procedure in a worker process.
+    """
+    start = time.monotonic()
+    procedure = None
+    try:
+        procedure = procedure_class(**inputs)
+        procedure.run()
+        status = "skipped" if procedure._skipped else "finished"
+        error = None
+        # a run that returned without its participant's outputs (e.g. on the
+        # shared outputs of another participant) must not be recorded as done
+        if status == "finished" and len(procedure._participant_labels()) <= 1:
+            if procedure._participant_succeeded() is False:
+                procedure._finished_file_path().unlink(missing_ok=True)
+                status = "failed"
+                error = "The run finished without the participant's outputs"
+    except Exception as e:
+        status = "failed"
+        error = f"{type(e).__name__}: {e}"
+    log_file = getattr(procedure, "log_file_path", None)
+    return {
+        "status": status,
+        "duration": time.monotonic() - start,
+        "log_file": str(log_file) if log_file else None,
+        "error": error,
+    }
+
+
+class CohortRunner:
+    """
+    Run a procedure across many subjects/sessions with a process pool.
+
+    Every job gets its own logging directory
+    (``<logging_root>/sub-<subject>[/ses-<session>]``), so done-files and logs of
+    different participants never collide. Jobs whose done-file fingerprint
+    matches the current configuration are skipped without being dispatched.
+    Jobs that finish without their participant's outputs (for procedures that
+    can tell, see ``Procedure._participant_succeeded``) are reported as failed
+    and get no done-file.
+    Procedures that process whole subjects (see
+    :func:`processes_whole_subjects`) get one job per subject, unless an
+    ``inputs_factory`` maps the sessions onto their inputs.
+
+    With ``batch_size``, several subjects are processed by one run of the
+    procedure (one container, sharing its start-up, BIDS indexing and work
+    directory), for procedures accepting several participant labels. The
+    batch is logged under ``<logging_root>/batch-<name>``, and its results are
+    split back per participant: every participant whose outputs are complete
+    gets its own done-file, so it is skipped by later (batched or not) runs.
+    ``batch_size="auto"`` spreads the subjects over the workers, with no more
+    subjects per batch than fit in the memory of a run
+    (``participant_memory_gb`` each).
+
+    Examples
+    --------
+    >>> from yalab_procedures.procedures.axsi import AxsiProcedure
+    >>> runner = CohortRunner(
+    ...     AxsiProcedure,
+    ...     base_inputs={"output_directory": "/path/to/axsi"},
+    ...     participants=discover_participants("/path/to/bids"),
+    ...     logging_root="/path/to/logs",
+    ...     inputs_factory=lambda subject, session: {...},
+    ...     max_workers=32,
+    ... )
+    >>> results = runner.run() # doctest: +SKIP
+    """
+
+    def __init__(
+        self,
+        procedure_class: Type[Procedure],
+        base_inputs: Dict[str, Any],
+        participants: List[Participant],
+        logging_root: Union[str, Path],
+        inputs_factory: Optional[InputsFactory] = None,
+        max_workers: Optional[int] = None,
+        batch_size: Union[int, str, None] = None,
+        participant_memory_gb: Optional[float] = None,
+    ):
+        self.procedure_class = procedure_class
+        self.base_inputs = dict(base_inputs)
+        self.participants = list(participants)
+        self.logging_root = Path(logging_root)
+        self.inputs_factory = inputs_factory
+        self.max_workers = max_workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.participant_memory_gb = participant_memory_gb
+        self.logger = logging.getLogger(self.__class__.__name__)
+        # sessions cannot be passed to the procedure: one job per subject,
+        # rather than identical jobs racing on the same outputs
+        if inputs_factory is None and processes_whole_subjects(procedure_class):
+            subjects = collapse_sessions(self.participants)
+            if len(subjects) < len(self.participants):
+                self.logger.info(
+                    f"{procedure_class.__name__} processes whole subjects: running {len(subjects)} subjects instead of {len(self.participants)} sessions."  # noqa: E501
+                )
+            self.participants = subjects
+
+    @classmethod
+    def from_bids(
+        cls,
+        procedure_class: Type[Procedure],
+        base_inputs: Dict[str, Any],
+        bids_root: Union[str, Path],
+        logging_root: Union[str, Path],
+        sessions: bool = True,
+        **kwargs,
+    ) -> "CohortRunner":
+        """
+        Build a runner for every subject (and session) found in a BIDS dataset.
+        """
+        participants = discover_participants(bids_root, sessions=sessions)
+        return cls(procedure_class, base_inputs, participants, logging_root, **kwargs)
+
+    def job_logging_directory(self, subject: str, session: Optional[str]) -> Path:
+        """
+        The isolated logging directory of a single job.
+        """
+        directory = self.logging_root / f"sub-{subject}"
+        if session is not None:
+            directory = directory / f"ses-{session}"
+        return directory
+
+    def job_inputs(self, subject: str, session: Optional[str]) -> Dict[str, Any]:
+        """
+        The full inputs of a single job.
+        """
+        inputs = dict(self.base_inputs)
+        if self.inputs_factory is not None:
+            inputs.update(self.inputs_factory(subject, session))
+        else:
+            inputs.update(default_job_inputs(self.procedure_class, subject, session))
+        inputs["logging_directory"] = str(self.job_logging_directory(subject, session))
+        return inputs
+
+    def batch_inputs(self, batch: List[Participant]) -> Dict[str, Any]:
+        """
+        The full inputs of a batched run.
+
+        Raises
+        ------
+        ValueError
+            If the ``inputs_factory`` gives the participants of the batch
+            different inputs, which one run cannot honour.
+        """
+        subjects = list(dict.fromkeys(subject for subject, _ in batch))
+        inputs = dict(self.base_inputs)
+        participants_inputs = default_batch_inputs(self.procedure_class, subjects)
+        if self.inputs_factory is not None:
+            factory_inputs = [
+                self.inputs_factory(subject, session) for subject, session in batch
+            ]
+            keys = dict.fromkeys(key for item in factory_inputs for key in item)
+            for key in keys:
+                # the participants' labels are the batch's own
+                if key in participants_inputs:
+                    continue
+                values = [item.get(key, _MISSING) for item in factory_inputs]
+                if any(value != values[0] for value in values[1:]):
+                    shown = ", ".join(
+                        "<unset>" if value is _MISSING else repr(value)
+                        for value in values
+                    )
+                    raise ValueError(
+                        f"The inputs_factory gives the participants of a batch different values of {key!r} ({shown}). Please run them without batching."  # noqa: E501
+                    )
+                inputs[key] = values[0]
+        inputs.update(participants_inputs)
+        name = "_".join(subjects)
+        if len(subjects) > 3:
+            name = hashlib.sha256(name.encode()).hexdigest()[:12]
+        inputs["logging_directory"] = str(self.logging_root / f"batch-{name}")
+        return inputs
+
+    def _memory_per_run_gb(self) -> float:
+        """
+        The memory a single run may use: its ``mem_gb``, or an equal share
+        of the node's budget.
+        """
+        if self.base_inputs.get("mem_gb"):
+            return float(self.base_inputs["mem_gb"])
+        if self.base_inputs.get("resource_directory"):
+            budget = ResourceScheduler(self.base_inputs["resource_directory"]).budget
+            memory_gb = budget["memory_gb"]
+        else:
+            memory_gb = total_memory_gb()
+        return memory_gb / max(1, self.max_workers)
+
+    def resolve_batch_size(self, n_subjects: int) -> int:
+        """
+        The number of subjects per batch.
+        """
+        if self.batch_size != "auto":
+            return max(1, int(self.batch_size or 1))
+        size = math.ceil(n_subjects / max(1, self.max_workers))
+        if self.participant_memory_gb:
+            fits = int(self._memory_per_run_gb() // self.participant_memory_gb)
+            size = min(size, max(1, fits))
+        return max(1, size)
+
+    def _is_up_to_date(self, inputs: Dict[str, Any]) -> bool:
+        """
+        Check a job's done-file without dispatching it.
+        """
+        try:
+            return self.procedure_class(**inputs)._is_up_to_date()
+        except Exception:
+            # let the worker surface configuration errors in the summary
+            return False
+
+    def ensure_images(self, inputs: Dict[str, Any]) -> list:
+        """
+        Pull the procedure's images once, before dispatching the jobs, so the
+        workers never pull them concurrently in the middle of the batch.
+        """
+        try:
+            images = self.procedure_class(**inputs).ensure_images()
+        except Exception as e:
+            # the jobs will report the error if the images are really missing
+            self.logger.warning(f"Failed to warm up the container images: {e}")
+            return []
+        for image in images:
+            self.logger.info(f"Using {image.image} ({image.digest})")
+        return images
+
+    def run(self) -> List[CohortJobResult]:
+        """
+        Run the procedure for every participant and write a summary table.
+
+        Returns
+        -------
+        List[CohortJobResult]
+            One result per participant, in the order they were given.
+        """
+        results: Dict[Participant, CohortJobResult] = {}
+        pending: Dict[Participant, Dict[str, Any]] = {}
+        for subject, session in self.participants:
+            inputs = self.job_inputs(subject, session)
+            if self._is_up_to_date(inputs):
+                results[(subject, session)] = CohortJobResult(
+                    subject, session, "skipped"
+                )
+            else:
+                pending[(subject, session)] = inputs
+        if pending:
+            self.ensure_images(next(iter(pending.values())))
+        self.logger.info(
+            f"Running {self.procedure_class.__name__} for {len(pending)} participants "
+            f"({len(results)} already up to date) with {self.max_workers} workers."
+        )
+        if self.batch_size not in (None, 1) and pending:
+            results.update(self._run_batches(list(pending)))
+        else:
+            results.update(self._run_jobs(pending))
+        ordered = [results[key] for key in self.participants]
+        self.write_summary(ordered)
+        return ordered
+
+    def _run_jobs(
+        self, pending: Dict[Participant, Dict[str, Any]]
+    ) -> Dict[Participant, CohortJobResult]:
+        """
+        Run one job per participant.
+        """
+        results = {}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(_run_job, self.procedure_class, inputs): key
+                for key, inputs in pending.items()
+            }
+            for future in as_completed(futures):
+                subject, session = futures[future]
+                outcome = future.result()
+                results[(subject, session)] = CohortJobResult(
+                    subject, session, **outcome
+                )
+                self.logger.info(
+                    f"sub-{subject} ses-{session}: {outcome['status']} "
+                    f"({outcome['duration']:.1f}s)"
+                )
+        return results
+
+    def _run_batches(
+        self, pending: List[Participant]
+    ) -> Dict[Participant, CohortJobResult]:
+        """
+        Run the participants in batches and split the results per participant.
+        """
+        n_subjects = len({subject for subject, _ in pending})
+        batches = batch_participants(pending, self.resolve_batch_size(n_subjects))
+        self.logger.info(
+            f"Processing {n_subjects} subjects in {len(batches)} batches "
+            f"of up to {self.resolve_batch_size(n_subjects)} subjects."
+        )
+        # outputs already there cannot tell whether a failed batch wrote them
+        existing = {
+            (subject, session)
+            for subject, session in pending
+            if self._participant_succeeded(subject, session)
+        }
+        batch_inputs = [self.batch_inputs(batch) for batch in batches]
+        results = {}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(_run_job, self.procedure_class, inputs): (
+                    batch,
+                    inputs,
+                )
+                for batch, inputs in zip(batches, batch_inputs)
+            }
+            for future in as_completed(futures):
+                batch, inputs = futures[future]
+                outcome = future.result()
+                self.logger.info(
+                    f"Batch of {len(batch)} participants: {outcome['status']} "
+                    f"({outcome['duration']:.1f}s)"
+                )
+                for subject, session in batch:
+                    results[(subject, session)] = self._split_batch_result(
+                        subject,
+                        session,
+                        inputs,
+                        outcome,
+                        existed=(subject, session) in existing,
+                    )
+        return results
+
+    def _participant_succeeded(self, subject: str, session: Optional[str]) -> bool:
+        """
+        Whether the outputs of a participant are complete (False if the
+        procedure cannot tell).
+        """
+        try:
+            procedure = self.procedure_class(**self.job_inputs(subject, session))
+            return bool(procedure._participant_succeeded())
+        except Exception:
+            return False
+
+    def _split_batch_result(
+        self,
+        subject: str,
+        session: Optional[str],
+        batch_inputs: Dict[str, Any],
+        outcome: dict,
+        existed: bool = False,
+    ) -> CohortJobResult:
+        """
+        The result of a participant of a batch, recording its done-file if its
+        outputs are complete. Participants of a failed batch are only
+        recorded if the batch wrote their outputs (``existed`` is whether
+        they were complete before it ran).
+        """
+        batch_succeeded = outcome["status"] in ("finished", "skipped")
+        try:
+            procedure = self.procedure_class(**self.job_inputs(subject, session))
+            succeeded = procedure._participant_succeeded()
+            if succeeded is None:
+                succeeded = batch_succeeded
+            elif existed and not batch_succeeded:
+                succeeded = False
+            if succeeded:
+                batch_procedure = self.procedure_class(**batch_inputs)
+                procedure._write_batch_finished_file(
+                    batch_procedure._finished_file_path()
+                )
+        except Exception as e:
+            return CohortJobResult(
+                subject,
+                session,
+                "failed",
+                outcome["duration"],
+                outcome["log_file"],
+                f"{type(e).__name__}: {e}",
+            )
+        return CohortJobResult(
+            subject,
+            session,
+            "finished" if succeeded else "failed",
+            outcome["duration"],
+            outcome["log_file"],
+            None if succeeded else outcome["error"] or "Outputs are incomplete",
+        )
+
+    def write_summary(self, results: List[CohortJobResult]) -> Path:
+        """
+        Write the aggregated results as a TSV file under the logging root.
+        """
+        self.logging_root.mkdir(parents=True, exist_ok=True)
+        summary_file = (
+            self.logging_root / f"{self.procedure_class.__name__}_cohort_summary.tsv"
+        )
+        with open(summary_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, delimiter="\t")
+            writer.writeheader()
+            for result in results:
+                writer.writerow(
+                    {field: getattr(result, field) for field in SUMMARY_FIELDS}
+                )
+        counts: Dict[str, int] = {}
+        for result in results:
+            counts[result.status] = counts.get(result.status, 0) + 1
+        self.logger.info(f"Cohort summary written to {summary_file}: {counts}")
+        return summary_file
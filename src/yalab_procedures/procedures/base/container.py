@@ -0,0 +1,280 @@
+import os
+import shlex
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from yalab_procedures.procedures.base.resources import container_resource_flags
+
+
+@dataclass
+class Mount:
+    """
+    A host path made available inside the container.
+    """
+
+    source: str
+    destination: str
+    read_only: bool = False
+
+    @classmethod
+    def from_argstr(cls, argstr: str) -> "Mount":
+        """
+        Parse a docker-style mount argument (``"-v <source>:<destination>[:ro]"``),
+        as used by the ``argstr`` of the mounted inputs.
+        """
+        spec = argstr.split(None, 1)[-1]
+        read_only = spec.endswith(":ro")
+        if read_only:
+            spec = spec[: -len(":ro")]
+        source, _, destination = spec.rpartition(":")
+        return cls(source, destination, read_only)
+
+
+def _mount_spec(mount: Mount) -> str:
+    spec = f"{mount.source}:{mount.destination}" + (":ro" if mount.read_only else "")
+    return shlex.quote(spec)
+
+
+def host_user() -> str:
+    """
+    The ``uid:gid`` of the current user, to run containers as.
+    """
+    return f"{os.getuid()}:{os.getgid()}"
+
+
+class ContainerRuntime:
+    """
+    Builds the command that runs a tool packaged as a container image.
+
+    Mounts, user mapping, resource limits and environment variables are
+    given in one (runtime-independent) form, and every runtime translates
+    them into its own flags.
+
+    Parameters
+    ----------
+    executable : Optional[str], optional
+        Only used by the local runtime, see :class:`LocalRuntime`.
+    """
+
+    name = None
+    # whether containers can be named (and their stats sampled by name)
+    supports_names = False
+
+    def __init__(self, executable: Optional[str] = None):
+        self.executable = executable
+
+    def command(
+        self,
+        image: str,
+        args: Iterable[str] = (),
+        mounts: Iterable[Mount] = (),
+        entrypoint: Optional[str] = None,
+        environment: Optional[Dict[str, str]] = None,
+        user: Optional[str] = None,
+        cpus=None,
+        memory_gb=None,
+        container_name: Optional[str] = None,
+    ) -> str:
+        """
+        Build the command line running ``image``.
+
+        Parameters
+        ----------
+        image : str
+            The container image (e.g. "pennlinc/qsiprep:1.0.0").
+        args : Iterable[str], optional
+            Arguments passed to the image's entrypoint.
+        mounts : Iterable[Mount], optional
+            Host paths to mount into the container.
+        entrypoint : Optional[str], optional
+            Program to run instead of the image's entrypoint.
+        environment : Optional[Dict[str, str]], optional
+            Environment variables to set inside the container.
+        user : Optional[str], optional
+            ``uid:gid`` to run the container as, by default None (the image's).
+        cpus : Optional[int], optional
+            Number of CPUs the container may use.
+        memory_gb : Optional[float], optional
+            Memory the container may use, in GB.
+        container_name : Optional[str], optional
+            Name of the container, where the runtime supports it.
+
+        Returns
+        -------
+        str
+            The command line.
+        """
+        raise NotImplementedError
+
+
+class DockerRuntime(ContainerRuntime):
+    """
+    Runs images with ``docker run``.
+    """
+
+    name = "docker"
+    supports_names = True
+
+    def command(
+        self,
+        image: str,
+        args: Iterable[str] = (),
+        mounts: Iterable[Mount] = (),
+        entrypoint: Optional[str] = None,
+        environment: Optional[Dict[str, str]] = None,
+        user: Optional[str] = None,
+        cpus=None,
+        memory_gb=None,
+        container_name: Optional[str] = None,
+    ) -> str:
+        parts = ["docker run --rm"]
+        if container_name:
+            parts.append(f"--name {container_name}")
+        if user:
+            parts.append(f"--user {user}")
+        parts += container_resource_flags(cpus, memory_gb)
+        parts += [f"-v {_mount_spec(mount)}" for mount in mounts]
+        parts += [
+            f"-e {key}={shlex.quote(str(value))}"
+            for key, value in (environment or {}).items()
+        ]
+        if entrypoint:
+            parts.append(f"--entrypoint {entrypoint}")
+        return " ".join(parts + [image] + list(args))
+
+
+class ApptainerRuntime(ContainerRuntime):
+    """
+    Runs images with Apptainer, e.g. on HPC nodes without a Docker daemon.
+
+    Images are run from SIF files when ``image`` is the path of one, and
+    pulled from Docker Hub (``docker://``) otherwise. Apptainer already runs
+    containers as the calling user, and resource limits are left to the batch
+    scheduler (the tools are still told how many CPUs and how much memory to
+    use through their own arguments).
+    """
+
+    name = "apptainer"
+    binary = "apptainer"
+
+    def image_reference(self, image: str) -> str:
+        """
+        The image as Apptainer expects it.
+        """
+        if image.endswith(".sif") or Path(image).is_file():
+            return image
+        if "://" in image:
+            return image
+        return f"docker://{image}"
+
+    def command(
+        self,
+        image: str,
+        args: Iterable[str] = (),
+        mounts: Iterable[Mount] = (),
+        entrypoint: Optional[str] = None,
+        environment: Optional[Dict[str, str]] = None,
+        user: Optional[str] = None,
+        cpus=None,
+        memory_gb=None,
+        container_name: Optional[str] = None,
+    ) -> str:
+        parts = [f"{self.binary} {'exec' if entrypoint else 'run'} --cleanenv"]
+        parts += [f"-B {_mount_spec(mount)}" for mount in mounts]
+        parts += [
+            f"--env {key}={shlex.quote(str(value))}"
+            for key, value in (environment or {}).items()
+        ]
+        parts.append(self.image_reference(image))
+        if entrypoint:
+            parts.append(entrypoint)
+        return " ".join(parts + list(args))
+
+
+class SingularityRuntime(ApptainerRuntime):
+    """
+    Runs images with SingularityCE (Apptainer's predecessor).
+    """
+
+    name = "singularity"
+    binary = "singularity"
+
+
+class LocalRuntime(ContainerRuntime):
+    """
+    Runs a stand-in executable directly instead of the container.
+
+    The container paths of the mounts are translated back into their host
+    paths in the arguments and environment, so the tool sees the same files
+    it would inside the container. Useful to test and benchmark the
+    procedures without a container runtime.
+
+    Parameters
+    ----------
+    executable : Optional[str], optional
+        The program run in place of the image's entrypoint, by default the
+        image's name (e.g. "qsiprep" for "pennlinc/qsiprep:1.0.0").
+    """
+
+    name = "local"
+
+    def _host_path(self, token: str, mounts: List[Mount]) -> str:
+        # longest destinations first, so nested mounts win
+        for mount in sorted(mounts, key=lambda m: len(m.destination), reverse=True):
+            if token == mount.destination:
+                return mount.source
+            if token.startswith(mount.destination.rstrip("/") + "/"):
+                return mount.source + token[len(mount.destination.rstrip("/")) :]
+        return token
+
+    def command(
+        self,
+        image: str,
+        args: Iterable[str] = (),
+        mounts: Iterable[Mount] = (),
+        entrypoint: Optional[str] = None,
+        environment: Optional[Dict[str, str]] = None,
+        user: Optional[str] = None,
+        cpus=None,
+        memory_gb=None,
+        container_name: Optional[str] = None,
+    ) -> str:
+        mounts = list(mounts)
+        program = entrypoint or self.executable or image.split(":")[0].split("/")[-1]
+        tokens = [
+            self._host_path(token, mounts) for token in shlex.split(" ".join(args))
+        ]
+        parts = []
+        if environment:
+            parts.append("env")
+            parts += [
+                f"{key}={shlex.quote(self._host_path(str(value), mounts))}"
+                for key, value in environment.items()
+            ]
+        return " ".join(parts + [program] + [shlex.quote(token) for token in tokens])
+
+
+CONTAINER_RUNTIMES = {
+    runtime.name: runtime
+    for runtime in (DockerRuntime, ApptainerRuntime, SingularityRuntime, LocalRuntime)
+}
+
+
+def get_container_runtime(
+    name: str = "docker", executable: Optional[str] = None
+) -> ContainerRuntime:
+    """
+    Get a container runtime by name ("docker", "apptainer", "singularity" or
+    "local").
+
+    Raises
+    ------
+    ValueError
+        If the runtime is unknown.
+    """
+    if name not in CONTAINER_RUNTIMES:
+        raise ValueError(
+            f"Unknown container runtime {name!r}, expected one of {sorted(CONTAINER_RUNTIMES)}"  # noqa: E501
+        )
+    return CONTAINER_RUNTIMES[name](executable)
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Union
+
+from nipype.interfaces.base import isdefined
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def normalize_value(value: Any) -> Any:
+    """
+    Normalize an input value so it can be serialized deterministically.
+
+    Parameters
+    ----------
+    value : Any
+        The value to normalize.
+
+    Returns
+    -------
+    Any
+        A JSON-serializable representation of the value.
+    """
+    if isinstance(value, Path):
+        return str(value)
+    if not isdefined(value):
+        return None
+    if isinstance(value, dict):
+        return {str(k): normalize_value(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [normalize_value(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def normalize_inputs(
+    inputs: Dict[str, Any], exclude: Iterable[str] = ()
+) -> Dict[str, Any]:
+    """
+    Normalize a procedure's inputs, dropping keys that do not affect the results.
+
+    Parameters
+    ----------
+    inputs : Dict[str, Any]
+        The inputs of the procedure (as returned by ``self.inputs.get()``).
+    exclude : Iterable[str], optional
+        Input names to leave out of the normalized inputs.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The normalized inputs, sorted by key.
+    """
+    exclude = set(exclude)
+    return {
+        key: normalize_value(value)
+        for key, value in sorted(inputs.items())
+        if key not in exclude
+    }
+
+
+def _file_content_hash(path: Union[str, Path]) -> str:
+    """
+    Compute the SHA-256 of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _iter_tree(root: Path):
+    """
+    Yield ``(relative path, os.stat_result)`` for every file under root,
+    following symbolic links the same way the procedures do when staging inputs.
+    """
+    visited = set()
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            st = directory.stat()
+        except OSError:
+            continue
+        if (st.st_dev, st.st_ino) in visited:
+            continue
+        visited.add((st.st_dev, st.st_ino))
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    stack.append(Path(entry.path))
+                else:
+                    yield Path(entry.path).relative_to(root), entry.stat()
+            except OSError:
+                continue
+
+
+def path_signature(path: Union[str, Path], hash_contents: bool = False) -> str:
+    """
+    Compute a cheap signature of a file or a directory tree.
+
+    The signature is based on file sizes and modification times.
+    When ``hash_contents`` is True, file contents are hashed as well.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The file or directory to sign.
+    hash_contents : bool, optional
+        Whether to include the content hash of every file, by default False.
+
+    Returns
+    -------
+    str
+        The hex digest of the signature.
+    """
+    path = Path(path)
+    digest = hashlib.sha256()
+    if path.is_dir():
+        for relative, st in _iter_tree(path):
+            digest.update(f"{relative}\0{st.st_size}\0{st.st_mtime_ns}\0".encode())
+            if hash_contents:
+                digest.update(_file_content_hash(path / relative).encode())
+    elif path.exists():
+        st = path.stat()
+        digest.update(f"{st.st_size}\0{st.st_mtime_ns}\0".encode())
+        if hash_contents:
+            digest.update(_file_content_hash(path).encode())
+    else:
+        digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def compute_fingerprint(
+    inputs: Dict[str, Any],
+    version: str,
+    paths: Dict[str, Union[str, Path]],
+    image: Optional[str] = None,
+    hash_contents: bool = False,
+) -> Dict[str, Any]:
+    """
+    Compute the fingerprint of a procedure run.
+
+    Parameters
+    ----------
+    inputs : Dict[str, Any]
+        The normalized inputs of the procedure.
+    version : str
+        The version of the procedure.
+    paths : Dict[str, Union[str, Path]]
+        Input files and directories whose state should be part of the fingerprint,
+        keyed by a descriptive name.
+    image : Optional[str], optional
+        The container image (tag or digest) used by the procedure, by default None.
+    hash_contents : bool, optional
+        Whether to hash file contents in addition to their size and mtime.
+
+    Returns
+    -------
+    Dict[str, Any]
+        A dictionary with the overall ``fingerprint`` and its ``components``.
+    """
+    components = {
+        "inputs": hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode()
+        ).hexdigest(),
+        "version": str(version),
+        "image": image,
+    }
+    for name, path in sorted(paths.items()):
+        components[f"path:{name}"] = path_signature(path, hash_contents)
+    fingerprint = hashlib.sha256(
+        json.dumps(components, sort_keys=True).encode()
+    ).hexdigest()
+    return {"fingerprint": fingerprint, "components": components}
+
+
+def changed_components(old: Dict[str, Any], new: Dict[str, Any]) -> list:
+    """
+    List the fingerprint components that differ between two fingerprints.
+
+    Parameters
+    ----------
+    old : Dict[str, Any]
+        The components of the previous fingerprint.
+    new : Dict[str, Any]
+        The components of the current fingerprint.
+
+    Returns
+    -------
+    list
+        The names of the components that changed.
+    """
+    keys = set(old) | set(new)
+    return sorted(key for key in keys if old.get(key) != new.get(key))
@@ -0,0 +1,245 @@
+import fcntl
+import json
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+from yalab_procedures.procedures.base.manifest import file_digest
+from yalab_procedures.procedures.base.runner import run_command
+
+INDEX_FILE = "images.json"
+LOCK_DIRECTORY = "locks"
+
+
+@dataclass
+class CachedImage:
+    """
+    A container image resolved (and pulled) by the image cache.
+
+    Attributes
+    ----------
+    image : str
+        The image as requested (e.g. "pennlinc/qsiprep:latest").
+    digest : str
+        The content digest the image was resolved to.
+    reference : str
+        What the runtime runs: the digest-pinned image for Docker
+        (e.g. "pennlinc/qsiprep@sha256:..."), the SIF file for Apptainer.
+    resolved : float
+        When the image was resolved.
+    """
+
+    image: str
+    digest: str
+    reference: str
+    resolved: float
+
+
+def _repository(image: str) -> str:
+    """
+    The repository of an image, without its tag or digest.
+    """
+    image = image.split("@")[0]
+    name, _, tag = image.rpartition(":")
+    return name if name and "/" not in tag else image
+
+
+def _sif_name(image: str) -> str:
+    return image.replace("/", "_").replace(":", "_").replace("@", "_") + ".sif"
+
+
+class ImageCache:
+    """
+    Resolves container image tags to digests once and keeps the images on the
+    node, so runs are reproducible and never pull in the middle of a batch.
+
+    The first resolution of a tag pulls the image (Docker) or converts it to a
+    SIF file in the cache directory (Apptainer/Singularity) and records its
+    digest in an index. Later runs use the recorded digest until the image is
+    refreshed, even if the tag moved in the registry. Concurrent processes
+    resolving the same image wait for each other instead of pulling it twice.
+
+    Parameters
+    ----------
+    cache_directory : Union[str, Path]
+        Directory holding the index (and SIF files). Created if missing.
+        Should be on local disk of the node.
+    runtime : str, optional
+        The container runtime ("docker", "apptainer" or "singularity"),
+        by default "docker".
+    """
+
+    def __init__(self, cache_directory: Union[str, Path], runtime: str = "docker"):
+        self.cache_directory = Path(cache_directory)
+        (self.cache_directory / LOCK_DIRECTORY).mkdir(parents=True, exist_ok=True)
+        self.runtime = runtime
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @property
+    def index_path(self) -> Path:
+        return self.cache_directory / f"{self.runtime}-{INDEX_FILE}"
+
+    @contextmanager
+    def _locked(self, name: str):
+        with open(self.cache_directory / LOCK_DIRECTORY / f"{name}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self) -> dict:
+        try:
+            return json.loads(self.index_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, image: str) -> Optional[CachedImage]:
+        """
+        The recorded resolution of an image, without pulling anything.
+        """
+        record = self._read_index().get(image)
+        if record is None:
+            return None
+        cached = CachedImage(**record)
+        if self.runtime != "docker" and not Path(cached.reference).is_file():
+            return None
+        return cached
+
+    def ensure(self, image: str, refresh: bool = False) -> CachedImage:
+        """
+        Resolve an image, pulling it first if it is not cached yet.
+
+        Parameters
+        ----------
+        image : str
+            The image (e.g. "pennlinc/qsiprep:latest").
+        refresh : bool, optional
+            Whether to resolve the tag again even if it is cached,
+            by default False.
+
+        Returns
+        -------
+        CachedImage
+            The resolved image.
+        """
+        if Path(image).is_file():
+            # already a local SIF file, identified by its content
+            return CachedImage(image, file_digest(image), image, time.time())
+        cached = None if refresh else self.lookup(image)
+        if cached is not None:
+            return cached
+        with self._locked(_sif_name(image)[: -len(".sif")]):
+            # another process may have pulled it while we waited
+            cached = None if refresh else self.lookup(image)
+            if cached is not None:
+                return cached
+            start = time.monotonic()
+            if self.runtime == "docker":
+                cached = self._pull_docker(image)
+            else:
+                cached = self._pull_sif(image)
+            self.logger.info(
+                f"Resolved {image} to {cached.digest} in {time.monotonic() - start:.1f}s"  # noqa: E501
+            )
+            with self._locked("index"):
+                index = self._read_index()
+                index[image] = asdict(cached)
+                tmp = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(index, indent=2))
+                os.replace(tmp, self.index_path)
+        return cached
+
+    def _pull_docker(self, image: str) -> CachedImage:
+        """
+        Pull an image with Docker and pin it to its repository digest.
+        """
+        run_command(f"docker pull {image}", self.logger)
+        inspect = subprocess.run(
+            [
+                "docker",
+                "image",
+                "inspect",
+                "--format",
+                "{{json .RepoDigests}} {{.Id}}",
+                image,
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        repo_digests, image_id = inspect.stdout.strip().rsplit(" ", 1)
+        repo_digests = json.loads(repo_digests) or []
+        repository = _repository(image)
+        pinned = next(
+            (d for d in repo_digests if d.split("@")[0] == repository),
+            repo_digests[0] if repo_digests else None,
+        )
+        if pinned is None:
+            # built locally, never pushed: only the image ID identifies it
+            return CachedImage(image, image_id, image, time.time())
+        return CachedImage(image, pinned.split("@")[-1], pinned, time.time())
+
+    def _pull_sif(self, image: str) -> CachedImage:
+        """
+        Convert an image to a SIF file with Apptainer/Singularity.
+        """
+        sif = self.cache_directory / _sif_name(image)
+        tmp = sif.with_suffix(f".{os.getpid()}.tmp")
+        source = image if "://" in image else f"docker://{image}"
+        try:
+            run_command(f"{self.runtime} pull --force {tmp} {source}", self.logger)
+            os.replace(tmp, sif)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return CachedImage(image, file_digest(sif), str(sif), time.time())
+
+    def ensure_images(
+        self, images: Iterable[str], refresh: bool = False, workers: int = 2
+    ) -> List[CachedImage]:
+        """
+        Resolve (and pull) several images ahead of a batch.
+
+        Parameters
+        ----------
+        images : Iterable[str]
+            The images to warm up. Duplicates are pulled once.
+        refresh : bool, optional
+            Whether to resolve the tags again, by default False.
+        workers : int, optional
+            Number of images pulled at the same time, by default 2.
+
+        Returns
+        -------
+        List[CachedImage]
+            The resolved images, in order.
+        """
+        images = list(dict.fromkeys(images))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return list(executor.map(lambda i: self.ensure(i, refresh), images))
+
+
+def ensure_images(
+    images: Iterable[str],
+    cache_directory: Union[str, Path],
+    runtime: str = "docker",
+    refresh: bool = False,
+) -> List[CachedImage]:
+    """
+    Warm up the image cache of the node, see :meth:`ImageCache.ensure_images`.
+
+    Examples
+    --------
+    >>> ensure_images(
+    ...     ["pennlinc/qsiprep:1.0.0", "pennlinc/qsirecon:1.0.0"],
+    ...     "/scratch/images",
+    ...     runtime="apptainer",
+    ... )  # doctest: +SKIP
+    """
+    return ImageCache(cache_directory, runtime).ensure_images(images, refresh)
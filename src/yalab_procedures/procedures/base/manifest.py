@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Union
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover - optional dependency
+    xxhash = None
+
+MANIFEST_FILE = ".staging_manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path: Union[str, Path]) -> str:
+    """
+    Hash a file's content with xxh3 (if xxhash is installed) or BLAKE2b.
+    """
+    if xxhash is not None:
+        name, digest = "xxh3_128", xxhash.xxh3_128()
+    else:
+        name, digest = "blake2b", hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return f"{name}:{digest.hexdigest()}"
+
+
+class StagingManifest:
+    """
+    The record of the files staged into a directory, used to restage it
+    incrementally.
+
+    Every staged file is recorded with its source, size and modification time
+    (and, optionally, a content hash). When the directory is staged again, files
+    whose source did not change are left in place, changed and new files are
+    staged, and files staged before but no longer staged are removed.
+    Files of the directory that were not staged (e.g. outputs a tool wrote
+    there) are never touched.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The staging directory. The manifest is kept in it as a hidden file.
+    hash_contents : bool, optional
+        Whether to compare content hashes as well as sizes and modification
+        times, by default False.
+    """
+
+    def __init__(self, root: Union[str, Path], hash_contents: bool = False):
+        self.root = Path(root)
+        self.hash_contents = hash_contents
+        self.files: Dict[str, dict] = {}
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self.root / MANIFEST_FILE
+
+    @classmethod
+    def load(
+        cls, root: Union[str, Path], hash_contents: bool = False
+    ) -> "StagingManifest":
+        """
+        Load the manifest of a staging directory (empty if there is none).
+        """
+        manifest = cls(root, hash_contents)
+        try:
+            manifest.files = json.loads(manifest.path.read_text())["files"]
+        except (OSError, ValueError, KeyError):
+            manifest.files = {}
+        return manifest
+
+    def save(self):
+        """
+        Write the manifest atomically.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"version": 1, "files": self.files}, indent=1))
+        os.replace(tmp, self.path)
+
+    def _key(self, destination: Path) -> str:
+        return str(Path(destination).relative_to(self.root))
+
+    def is_current(
+        self, source: Union[str, Path], destination: Union[str, Path]
+    ) -> bool:
+        """
+        Whether ``destination`` is an up-to-date staged copy of ``source``.
+        Marks the destination as staged in any case.
+        """
+        key = self._key(destination)
+        with self._lock:
+            self._seen.add(key)
+            record = self.files.get(key)
+        if record is None or record["source"] != os.path.realpath(source):
+            return False
+        try:
+            st = os.stat(source)
+            dst = os.stat(destination)
+        except OSError:
+            return False
+        if (st.st_size, st.st_mtime_ns) != (record["size"], record["mtime_ns"]):
+            return False
+        if (dst.st_size, dst.st_mtime_ns) != (record["size"], record["mtime_ns"]):
+            return False
+        if self.hash_contents:
+            return record.get("hash") == file_digest(source)
+        return True
+
+    def record(self, source: Union[str, Path], destination: Union[str, Path]):
+        """
+        Record a freshly staged file.
+        """
+        st = os.stat(source)
+        entry = {
+            "source": os.path.realpath(source),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if self.hash_contents:
+            entry["hash"] = file_digest(source)
+        key = self._key(destination)
+        with self._lock:
+            self.files[key] = entry
+            self._seen.add(key)
+
+    def prune(self) -> int:
+        """
+        Remove the files staged before that were not staged this time.
+
+        Returns
+        -------
+        int
+            The number of removed files.
+        """
+        removed = 0
+        for key in sorted(set(self.files) - self._seen):
+            self.files.pop(key)
+            path = self.root / key
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                continue
+            # drop directories the removal left empty
+            parent = path.parent
+            while parent != self.root:
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+                parent = parent.parent
+        self._seen = set()
+        return removed
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import re
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+DEFAULT_SAMPLING_INTERVAL = 30.0
+
+_SIZE_UNITS = {
+    "b": 1,
+    "kb": 1000,
+    "kib": 1024,
+    "mb": 1000**2,
+    "mib": 1024**2,
+    "gb": 1000**3,
+    "gib": 1024**3,
+    "tb": 1000**4,
+    "tib": 1024**4,
+}
+
+
+def read_proc_io(pid: str = "self") -> Dict[str, int]:
+    """
+    Read the I/O counters of a process from ``/proc/<pid>/io``.
+
+    The counters of a process include those of its children once they have been
+    waited for, so reading them for the current process covers the commands it ran.
+
+    Returns
+    -------
+    Dict[str, int]
+        The counters (``rchar``, ``wchar``, ``read_bytes``, ``write_bytes``, ...),
+        or an empty dictionary if they are not available.
+    """
+    try:
+        text = Path(f"/proc/{pid}/io").read_text()
+    except OSError:
+        return {}
+    counters = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        counters[key.strip()] = int(value)
+    return counters
+
+
+def process_tree_rss(root_pid: int) -> int:
+    """
+    The total resident memory (bytes) of a process and all of its descendants.
+    """
+    children: Dict[int, list] = {}
+    rss: Dict[int, int] = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+            statm = (entry / "statm").read_text()
+        except OSError:
+            continue
+        pid = int(entry.name)
+        # the command name may contain spaces; fields resume after the last ")"
+        ppid = int(stat[stat.rfind(")") + 2 :].split()[1])
+        children.setdefault(ppid, []).append(pid)
+        rss[pid] = int(statm.split()[1]) * PAGE_SIZE
+    total = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total
+
+
+def parse_size(value: str) -> int:
+    """
+    Parse a human-readable size, as printed by ``docker stats`` (e.g. "1.5GiB").
+    """
+    match = re.match(r"\s*([\d.]+)\s*([a-zA-Z]*)", value)
+    if not match:
+        return 0
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS.get(unit.lower() or "b", 1))
+
+
+def sample_container_stats(container_name: str) -> Optional[dict]:
+    """
+    Take a single ``docker stats`` sample of a running container.
+
+    Returns
+    -------
+    Optional[dict]
+        The CPU percentage, memory usage (bytes) and block I/O of the container,
+        or None if the container is not running (yet) or docker is unavailable.
+    """
+    try:
+        result = subprocess.run(
+            [
+                "docker",
+                "stats",
+                "--no-stream",
+                "--format",
+                "{{json .}}",
+                container_name,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    stats = json.loads(result.stdout.strip().splitlines()[0])
+    return {
+        "cpu_percent": float(stats.get("CPUPerc", "0").rstrip("%") or 0),
+        "memory_bytes": parse_size(stats.get("MemUsage", "0").split("/")[0]),
+        "block_io": stats.get("BlockIO"),
+    }
+
+
+class RunMetrics:
+    """
+    Performance instrumentation of a single procedure run.
+
+    Records wall time, user/system CPU time (of the procedure and the commands
+    it ran), the peak RSS of the process tree, bytes read and written, the time
+    spent in each stage (e.g. staging, execution, cleanup) and, for container
+    procedures, periodic samples of the container's own stats.
+
+    Parameters
+    ----------
+    interval : float, optional
+        Seconds between samples of the process tree and the container,
+        by default 30.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stages: Dict[str, float] = {}
+        self.container_name: Optional[str] = None
+        self._container_samples: list = []
+        self._peak_tree_rss = 0
+        self._started = False
+        self._stopped_snapshot: Optional[dict] = None
+        self._stop_event = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def start(self):
+        """
+        Start measuring and sampling.
+        """
+        self._start_time = time.monotonic()
+        self._start_usage = self._usage()
+        self._start_io = read_proc_io()
+        self._started = True
+        self._stop_event.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> dict:
+        """
+        Stop sampling and freeze the metrics.
+        """
+        if not self._started:
+            return {}
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._sample()
+        self._stopped_snapshot = self.as_dict()
+        return self._stopped_snapshot
+
+    def watch_container(self, container_name: str):
+        """
+        Start sampling the stats of a running container.
+        """
+        self.container_name = container_name
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage of the run. Repeated stages accumulate.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.monotonic() - start
+
+    @staticmethod
+    def _usage() -> Dict[str, float]:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            "user_time": own.ru_utime + children.ru_utime,
+            "system_time": own.ru_stime + children.ru_stime,
+            # ru_maxrss is in kilobytes on Linux
+            "max_rss": max(own.ru_maxrss, children.ru_maxrss) * 1024,
+        }
+
+    def _sample(self):
+        self._peak_tree_rss = max(self._peak_tree_rss, process_tree_rss(os.getpid()))
+        if self.container_name is not None:
+            sample = sample_container_stats(self.container_name)
+            if sample is not None:
+                self._container_samples.append(sample)
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                self.logger.debug(f"Failed to sample run metrics: {e}")
+
+    def _container_summary(self) -> Optional[dict]:
+        samples = self._container_samples
+        if not samples:
+            return None
+        cpu = [s["cpu_percent"] for s in samples]
+        return {
+            "name": self.container_name,
+            "samples": len(samples),
+            "mean_cpu_percent": sum(cpu) / len(cpu),
+            "max_cpu_percent": max(cpu),
+            "peak_memory_bytes": max(s["memory_bytes"] for s in samples),
+            "block_io": samples[-1]["block_io"],
+        }
+
+    def as_dict(self) -> dict:
+        """
+        The metrics measured so far (or the frozen metrics, once stopped).
+        """
+        if self._stopped_snapshot is not None:
+            return self._stopped_snapshot
+        if not self._started:
+            return {}
+        usage = self._usage()
+        io = read_proc_io()
+        return {
+            "wall_time": time.monotonic() - self._start_time,
+            "user_time": usage["user_time"] - self._start_usage["user_time"],
+            "system_time": usage["system_time"] - self._start_usage["system_time"],
+            "peak_rss_bytes": max(self._peak_tree_rss, usage["max_rss"]),
+            "io": {
+                key: io[key] - self._start_io.get(key, 0)
+                for key in ("read_bytes", "write_bytes", "rchar", "wchar")
+                if key in io
+            },
+            "stages": dict(self.stages),
+            "container": self._container_summary(),
+        }
@@ -1,18 +1,54 @@
+import hashlib
 import json
 import logging
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Optional, Union
 
 from nipype.interfaces.base import (
     BaseInterface,
     BaseInterfaceInputSpec,
     Directory,
+    File,
     TraitedSpec,
+    Undefined,
     isdefined,
     traits,
 )
 
+from yalab_procedures.procedures.base.bids_filters import BidsFilter
+from yalab_procedures.procedures.base.container import (
+    ContainerRuntime,
+    get_container_runtime,
+)
+from yalab_procedures.procedures.base.fingerprint import (
+    changed_components,
+    compute_fingerprint,
+    normalize_inputs,
+)
+from yalab_procedures.procedures.base.images import CachedImage, ImageCache
+from yalab_procedures.procedures.base.manifest import StagingManifest
+from yalab_procedures.procedures.base.metrics import (
+    DEFAULT_SAMPLING_INTERVAL,
+    RunMetrics,
+)
+from yalab_procedures.procedures.base.progress import NipypeProgress
+from yalab_procedures.procedures.base.reaper import get_reaper
+from yalab_procedures.procedures.base.resources import (
+    ResourceGrant,
+    ResourceScheduler,
+)
+from yalab_procedures.procedures.base.staging import (
+    StagingPath,
+    log_staging_stats,
+    stage_paths,
+    staging_jobs,
+)
+from yalab_procedures.procedures.base.staging_cache import StagingCache
+from yalab_procedures.procedures.base.workdirs import WorkDirectories
+
 
 class ProcedureInputSpec(BaseInterfaceInputSpec):
     input_directory = Directory(
@@ -35,6 +71,77 @@ class ProcedureInputSpec(BaseInterfaceInputSpec):
         usedefault=True,
         desc="Whether to force the procedure to run even if the output directory already exists.",  # noqa: E501
     )
+    hash_input_contents = traits.Bool(
+        False,
+        usedefault=True,
+        desc="Whether to hash the content of input files (and not only their size and modification time) when fingerprinting a run.",  # noqa: E501
+    )
+    resource_directory = Directory(
+        desc="Directory holding the node-level resource ledger. If set, the procedure waits for CPUs and memory from the shared budget before running.",  # noqa: E501
+    )
+    mem_gb = traits.Float(desc="Memory (GB) the procedure may use")
+    metrics_interval = traits.Float(
+        DEFAULT_SAMPLING_INTERVAL,
+        usedefault=True,
+        desc="Seconds between samples of the run's memory usage (and of its container's stats).",  # noqa: E501
+    )
+
+
+class StagingInputSpec(BaseInterfaceInputSpec):
+    staging_cache_directory = Directory(
+        desc="Directory of the node-level staging cache. If set, staged inputs are shared with other runs instead of being staged and removed by every run.",  # noqa: E501
+    )
+    staging_cache_quota_gb = traits.Float(
+        desc="Maximal size of the staging cache (GB). Unused entries are evicted least-recently-used first.",  # noqa: E501
+    )
+    staging_workers = traits.Int(
+        4,
+        usedefault=True,
+        desc="Number of paths (e.g. participants) staged at the same time.",
+    )
+    staging_bandwidth_mb = traits.Float(
+        desc="Cap on the bandwidth (MB/s) used to copy inputs while staging. Hardlinked and reflinked files do not count.",  # noqa: E501
+    )
+
+
+class ContainerInputSpec(BaseInterfaceInputSpec):
+    container_runtime = traits.Enum(
+        "docker",
+        "apptainer",
+        "singularity",
+        "local",
+        usedefault=True,
+        desc="Runtime used to run the container: docker, apptainer/singularity, or local to run a stand-in executable directly.",  # noqa: E501
+    )
+    local_executable = traits.Str(
+        desc="Executable the local runtime runs in place of the container (by default the tool's name).",  # noqa: E501
+    )
+    reuse_work_directory = traits.Bool(
+        True,
+        usedefault=True,
+        desc="Whether to run in a stable work directory per procedure, participant and configuration (under work_directory), so a retried run resumes from the tool's cached results.",  # noqa: E501
+    )
+    keep_work_directory = traits.Enum(
+        "always",
+        "on_failure",
+        "never",
+        usedefault=True,
+        desc="When to keep the run's work directory: always, on_failure (so a retry can resume from it) or never.",  # noqa: E501
+    )
+    work_directory_max_age_days = traits.Float(
+        desc="Age (days since last use) after which reusable work directories are removed.",  # noqa: E501
+    )
+    work_directory_quota_gb = traits.Float(
+        desc="Maximal total size (GB) of the reusable work directories. The least recently used ones are removed first.",  # noqa: E501
+    )
+    track_progress = traits.Bool(
+        True,
+        usedefault=True,
+        desc="Whether to follow the workflow's nodes in the tool's output and write progress events to a JSON-lines file next to the log.",  # noqa: E501
+    )
+    image_cache_directory = Directory(
+        desc="Directory of the node-level image cache. If set, image tags are resolved to digests once, images are pulled (or converted to SIF files) ahead of the run, and the digest is part of the run's fingerprint.",  # noqa: E501
+    )
 
 
 class ProcedureOutputSpec(TraitedSpec):
@@ -46,9 +153,51 @@ class Procedure(BaseInterface):
     input_spec = ProcedureInputSpec
     output_spec = ProcedureOutputSpec
     _version = "0.0.1"
+    _container_name = None
+    # BIDS datatypes the procedure reads (None: stage the whole participant)
+    _required_datatypes = None
+    # called with every progress event of the tool's workflow, see NipypeProgress
+    progress_callback = None
+    # inputs that do not affect the results of the procedure
+    _fingerprint_exclude = (
+        "force",
+        "logging_directory",
+        "logging_level",
+        "hash_input_contents",
+        "resource_directory",
+        "nprocs",
+        "omp_nthreads",
+        "mem_gb",
+        "metrics_interval",
+        "staging_cache_directory",
+        "staging_cache_quota_gb",
+        "staging_workers",
+        "staging_bandwidth_mb",
+        "image_cache_directory",
+        "reuse_work_directory",
+        "keep_work_directory",
+        "work_directory_max_age_days",
+        "work_directory_quota_gb",
+        "track_progress",
+    )
+    # path inputs that are written to by the procedure rather than read from
+    _fingerprint_path_exclude = (
+        "output_directory",
+        "logging_directory",
+        "work_directory",
+        "temporary_bids_directory",
+        "fs_subjects_dir",
+    )
 
     def __init__(self, **inputs: Any):
         super().__init__(**inputs)
+        self._run_fingerprint = None
+        self._skipped = False
+        self._metrics = RunMetrics()
+        self._staging_lease = None
+        self._work_root = None
+        self._work_directory = None
+        self._progress = None
 
     def _run_interface(self, runtime) -> Any:
         """
@@ -61,17 +210,39 @@ class Procedure(BaseInterface):
             )
 
         self.setup_logging()
+        self._run_fingerprint = None
+        self._skipped = False
 
         # Check if the procedure has already been run
         finished_file, proceed = self._check_old_runs_finished()
         if not proceed:
+            self._skipped = True
             return runtime
 
+        # pull the images first, so the fingerprint records their digests
+        if self.ensure_images():
+            self._run_fingerprint = None
+        # freeze the fingerprint before the procedure rewrites its inputs
+        # (e.g. the input directory to the staged one)
+        self._get_run_fingerprint()
         self.logger.info(
             f"Running procedure with input directory: {self.inputs.input_directory}"  # noqa: E501
         )
         # Run the custom procedure
-        self.run_procedure(**self.inputs.get())
+        self._metrics = RunMetrics(self.inputs.metrics_interval)
+        self._metrics.start()
+        succeeded = False
+        try:
+            with self._reserve_resources():
+                self.run_procedure(**self.inputs.get())
+            succeeded = True
+        finally:
+            # a failed run must not pin its cache entry
+            self._release_staged_inputs()
+            self._release_work_directory(succeeded)
+            if self._progress is not None:
+                self._progress.close()
+            self._metrics.stop()
         self.logger.info(
             f"Procedure completed. Output directory: {self.inputs.output_directory}"  # noqa: E501
         )
@@ -79,15 +250,308 @@ class Procedure(BaseInterface):
 
         return runtime
 
+    @contextmanager
+    def _reserve_resources(self):
+        """
+        Waits for CPUs and memory from the node-level budget, if one is configured.
+        """
+        if not isdefined(self.inputs.resource_directory):
+            yield None
+            return
+        scheduler = ResourceScheduler(self.inputs.resource_directory)
+        cpus, memory_gb = self._requested_resources()
+        with self._timed_stage("queue"):
+            grant = scheduler.acquire(cpus, memory_gb)
+        try:
+            self.logger.info(
+                f"Granted {grant.cpus} CPUs and {grant.memory_gb} GB of memory from {self.inputs.resource_directory}"  # noqa: E501
+            )
+            self._apply_resource_grant(grant)
+            yield grant
+        finally:
+            scheduler.release(grant)
+
+    def _timed_stage(self, name: str):
+        """
+        Times a stage of the run (e.g. "staging", "execution" or "cleanup").
+        """
+        return self._metrics.stage(name)
+
+    def _container_runtime(self) -> ContainerRuntime:
+        """
+        The runtime the procedure's containers are run with.
+        """
+        executable = self.inputs.local_executable
+        return get_container_runtime(
+            self.inputs.container_runtime,
+            executable if isdefined(executable) else None,
+        )
+
+    def _name_container(self) -> Optional[str]:
+        """
+        Names the container of the current run so its stats can be sampled.
+        """
+        if not self._container_runtime().supports_names:
+            return None
+        self._container_name = f"{type(self).__name__.lower()}-{uuid.uuid4().hex[:12]}"
+        self._metrics.watch_container(self._container_name)
+        return self._container_name
+
+    def _track_progress(self) -> Optional[NipypeProgress]:
+        """
+        Starts following the progress of the tool's nipype workflow.
+
+        Returns
+        -------
+        Optional[NipypeProgress]
+            The tracker, to pass as the ``line_callback`` of ``run_command``
+            (None if progress tracking is disabled).
+        """
+        if not self.inputs.track_progress:
+            return None
+        log_file = getattr(self, "log_file_path", None)
+        events_file = (
+            Path(log_file).with_suffix(".progress.jsonl")
+            if log_file
+            else self._finished_file_path().with_suffix(".progress.jsonl")
+        )
+        self._progress = NipypeProgress(
+            events_file, callback=self.progress_callback, logger=self.logger
+        )
+        self.logger.info(f"Writing progress events to {events_file}")
+        return self._progress
+
+    def _stage_inputs(
+        self,
+        input_directory: Path,
+        paths: List[StagingPath],
+        temp_bids: Path,
+        exclude: List[str] = (),
+    ) -> Path:
+        """
+        Stages ``paths`` (relative to ``input_directory``) for the run,
+        ``staging_workers`` paths at a time.
+
+        With a staging cache, the run leases a shared staged tree;
+        otherwise the paths are staged into ``temp_bids`` incrementally,
+        using the manifest left there by a previous attempt. Only the files
+        selected by :meth:`_staging_filter` are staged.
+
+        Returns
+        -------
+        Path
+            The root of the staged tree.
+        """
+        include = self._staging_filter()
+        bandwidth_mb = self.inputs.staging_bandwidth_mb
+        options = {
+            "exclude": exclude,
+            "include": include,
+            "workers": self.inputs.staging_workers,
+            "bandwidth_mb": bandwidth_mb if isdefined(bandwidth_mb) else None,
+        }
+        if isdefined(self.inputs.staging_cache_directory):
+            self._staging_lease = self._staging_cache().acquire(
+                input_directory, paths, **options
+            )
+            return self._staging_lease.path
+        temp_bids.mkdir(parents=True, exist_ok=True)
+        stats = stage_paths(
+            staging_jobs(input_directory, paths, temp_bids),
+            logger=self.logger,
+            manifest=StagingManifest.load(
+                temp_bids, hash_contents=self.inputs.hash_input_contents
+            ),
+            **options,
+        )
+        log_staging_stats(self.logger, stats, temp_bids)
+        return temp_bids
+
+    def _participant_labels(self) -> List[str]:
+        """
+        The run's participant labels, whether given as one label or a list.
+        """
+        labels = getattr(self.inputs, "participant_label", Undefined)
+        if not isdefined(labels):
+            return []
+        return [labels] if isinstance(labels, str) else list(labels)
+
+    def _participant_succeeded(self) -> Optional[bool]:
+        """
+        Whether the run's outputs for its participant are complete, judged
+        from the outputs alone (None if the procedure cannot tell). Used to
+        split the results of a batched run per participant.
+        """
+        return None
+
+    def _participants_name(self) -> str:
+        """
+        A short, stable name for the run's participants.
+        """
+        labels = sorted(self._participant_labels())
+        name = "_".join(labels)
+        if len(labels) > 3:
+            name = hashlib.sha256(name.encode()).hexdigest()[:12]
+        return name
+
+    def _temporary_bids_name(self, prefix: str) -> str:
+        """
+        The name of the run's temporary BIDS directory. It depends on the
+        participants and the configuration key (see :meth:`_config_key`), so a
+        retried run restages into the same directory, while runs of the same
+        participants with other configurations never share (and prune) it.
+        """
+        return f"{prefix}_temp_bids_{self._participants_name()}_{self._config_key()}"
+
+    def _config_key(self) -> str:
+        """
+        A key of the run's configuration: its inputs, version and image,
+        but not the state of its input files.
+        """
+        components = self._get_run_fingerprint()["components"]
+        config = {key: components[key] for key in ("inputs", "version", "image")}
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+        return digest.hexdigest()[:16]
+
+    def _work_directories(self) -> WorkDirectories:
+        max_age = self.inputs.work_directory_max_age_days
+        quota = self.inputs.work_directory_quota_gb
+        return WorkDirectories(
+            self._work_root,
+            max_age if isdefined(max_age) else None,
+            quota if isdefined(quota) else None,
+        )
+
+    def _acquire_work_directory(self, prefix: str) -> Path:
+        """
+        Points the run at its stable work directory
+        (``<work_directory>/<prefix>/sub-<participants>/<config key>``),
+        so a retried run resumes from the tool's cached results.
+
+        Returns
+        -------
+        Path
+            The work directory of the run.
+        """
+        if self._work_directory is not None:
+            return self._work_directory
+        if not self.inputs.reuse_work_directory:
+            return Path(self.inputs.work_directory)
+        self._work_root = Path(self.inputs.work_directory)
+        self._work_directory = self._work_directories().claim(
+            prefix, f"sub-{self._participants_name()}", self._config_key()
+        )
+        self.inputs.work_directory = str(self._work_directory)
+        return self._work_directory
+
+    def _release_work_directory(self, succeeded: bool):
+        """
+        Keeps or removes the run's work directory according to
+        ``keep_work_directory`` and garbage-collects the old ones.
+        """
+        if self._work_directory is None:
+            return
+        work_directories = self._work_directories()
+        try:
+            work_directories.release(
+                self._work_directory, succeeded, self.inputs.keep_work_directory
+            )
+            work_directories.collect()
+        except OSError as e:
+            self.logger.warning(f"Failed to clean up work directories: {e}")
+        self.inputs.work_directory = str(self._work_root)
+        self._work_root = None
+        self._work_directory = None
+
+    def _staging_filter(self) -> Optional[BidsFilter]:
+        """
+        Selects the files to stage from the procedure's required datatypes
+        and its BIDS filter file (if it has one).
+        """
+        filter_file = getattr(self.inputs, "bids_filters", None)
+        include = BidsFilter.from_file(
+            filter_file if isdefined(filter_file) else None,
+            datatypes=self._required_datatypes,
+        )
+        return None if include.is_trivial() else include
+
+    def _release_staged_inputs(self) -> bool:
+        """
+        Releases the run's lease on the staging cache, if it holds one.
+
+        Returns
+        -------
+        bool
+            Whether a lease was released.
+        """
+        if self._staging_lease is None:
+            return False
+        self._staging_cache().release(self._staging_lease)
+        self._staging_lease = None
+        return True
+
+    def _staging_cache(self) -> StagingCache:
+        """
+        The node-level staging cache configured for the run.
+        """
+        quota = self.inputs.staging_cache_quota_gb
+        return StagingCache(
+            self.inputs.staging_cache_directory,
+            quota_gb=quota if isdefined(quota) else None,
+        )
+
+    def _cleanup_staged_inputs(self, temp_input_directory: Path):
+        """
+        Releases the staged inputs of the run: the lease on a cached tree,
+        or the temporary directory they were staged into. The directory is
+        moved aside and deleted in the background by the process' reaper.
+        """
+        if self._release_staged_inputs():
+            return
+        self.logger.info(
+            f"Cleaning up temporary input directory: {temp_input_directory}"
+        )
+        try:
+            get_reaper().schedule(temp_input_directory)
+        except OSError as e:
+            self.logger.warning(
+                f"Failed to remove temporary input directory: {temp_input_directory}. Error: {e}"  # noqa: E501
+            )
+
+    def _requested_resources(self):
+        """
+        Returns the number of CPUs and the memory (GB) the procedure asks for.
+        """
+        cpus = 1
+        for name in ("nprocs", "nthreads"):
+            if self.inputs.trait(name) is not None:
+                value = getattr(self.inputs, name)
+                if isdefined(value) and value:
+                    cpus = value
+                break
+        memory_gb = self.inputs.mem_gb if isdefined(self.inputs.mem_gb) else None
+        return cpus, memory_gb
+
+    def _apply_resource_grant(self, grant: ResourceGrant):
+        """
+        Limits the procedure's inputs to the granted resources.
+        """
+        for name in ("nprocs", "nthreads"):
+            if self.inputs.trait(name) is not None:
+                setattr(self.inputs, name, grant.cpus)
+        if self.inputs.trait("omp_nthreads") is not None:
+            omp_nthreads = self.inputs.omp_nthreads
+            if isdefined(omp_nthreads):
+                self.inputs.omp_nthreads = min(omp_nthreads, grant.cpus)
+        if grant.memory_gb is not None:
+            self.inputs.mem_gb = grant.memory_gb
+
     def _check_old_runs_finished(self) -> Any:
         """
-        Logs the completion of the procedure.
+        Checks whether a previous run with the same fingerprint has already finished.
         """
         # set up a "finished" file to keep track of when the procedure was last run # noqa: E501
-        finished_file = (
-            Path(self.inputs.logging_directory)
-            / f"{type(self).__name__}-{self._version}.done.json"
-        )
+        finished_file = self._finished_file_path()
         proceed = True
         if finished_file.exists():
             if self.inputs.force:
@@ -104,8 +568,24 @@ class Procedure(BaseInterface):
             self.logger.info(
                 f"Procedure was last run on {timestamp}. Checking if the configuration is the same."  # noqa: E501
             )
-            # check if the configuration is the same as the current configuration # noqa: E501
-            if self.inputs.output_directory == config["output_directory"]:
+            previous_fingerprint = data.get("fingerprint")
+            if previous_fingerprint is not None:
+                fingerprint = self._get_run_fingerprint()
+                if previous_fingerprint == fingerprint["fingerprint"]:
+                    self.logger.info(
+                        f"Run fingerprint {previous_fingerprint} matches the previous run. Skipping procedure."  # noqa: E501
+                    )
+                    proceed = False
+                else:
+                    changed = changed_components(
+                        data.get("fingerprint_components", {}),
+                        fingerprint["components"],
+                    )
+                    self.logger.info(
+                        f"Run fingerprint changed ({', '.join(changed)}). Will run procedure again."  # noqa: E501
+                    )
+            # fall back to the output directory for runs recorded without a fingerprint # noqa: E501
+            elif self.inputs.output_directory == config["output_directory"]:
                 msg = "User requested to regenerate outputs in the same directory. Please change the output directory or set force=True."  # noqa: E501
                 self.logger.error(
                     msg,
@@ -115,7 +595,140 @@ class Procedure(BaseInterface):
                 proceed = True
         return finished_file, proceed
 
-    def _write_finished_file(self, finished_file: Union[str, Path]):
+    def _finished_file_path(self) -> Path:
+        """
+        Returns the path of the "finished" file of the procedure.
+        """
+        logging_directory = self.inputs.logging_directory
+        if not isdefined(logging_directory):
+            logging_directory = Path(self.inputs.output_directory).parent / "logs"
+        return (
+            Path(logging_directory) / f"{type(self).__name__}-{self._version}.done.json"
+        )
+
+    def _is_up_to_date(self) -> bool:
+        """
+        Checks, without running anything, whether a finished run with the current fingerprint exists. # noqa: E501
+        """
+        finished_file = self._finished_file_path()
+        if self.inputs.force or not finished_file.exists():
+            return False
+        with open(str(finished_file), "r") as f:
+            data = json.load(f)
+        return data.get("fingerprint") == self._get_run_fingerprint()["fingerprint"]
+
+    def _container_image(self) -> Union[str, None]:
+        """
+        Returns the container image used by the procedure, if any.
+        Container-based procedures override this so the image is part of the run's fingerprint. # noqa: E501
+        """
+        return None
+
+    def _container_images(self) -> List[str]:
+        """
+        Returns every container image the procedure runs.
+        """
+        image = self._container_image()
+        return [image] if image else []
+
+    def _image_cache(self) -> Optional[ImageCache]:
+        """
+        The node-level image cache, if the procedure uses one.
+        """
+        directory = getattr(self.inputs, "image_cache_directory", None)
+        if not isdefined(directory) or directory is None:
+            return None
+        if self.inputs.container_runtime == "local":
+            return None
+        return ImageCache(directory, self.inputs.container_runtime)
+
+    def _resolve_image(self, image: str) -> Optional[CachedImage]:
+        """
+        Resolves an image through the image cache (None without a cache).
+        """
+        cache = self._image_cache()
+        return cache.ensure(image) if cache is not None else None
+
+    def _lookup_image(self, image: str) -> Optional[CachedImage]:
+        """
+        The image's resolution recorded in the image cache, without pulling
+        it (None without a cache, or before its first pull).
+        """
+        cache = self._image_cache()
+        if cache is None:
+            return None
+        if Path(image).is_file():
+            # a local SIF file is identified by its content, nothing to pull
+            return cache.ensure(image)
+        return cache.lookup(image)
+
+    def _runtime_image(self, image: str) -> str:
+        """
+        The image as passed to the container runtime: pinned to its digest
+        (or its SIF file) when an image cache is used.
+        """
+        cached = self._resolve_image(image)
+        return cached.reference if cached is not None else image
+
+    def ensure_images(self, refresh: bool = False) -> List[CachedImage]:
+        """
+        Resolves and pulls the procedure's images ahead of a batch, so the
+        first run on the node does not pay for the pull.
+
+        Parameters
+        ----------
+        refresh : bool, optional
+            Whether to resolve the tags again, by default False.
+
+        Returns
+        -------
+        List[CachedImage]
+            The resolved images (empty without an image cache).
+        """
+        cache = self._image_cache()
+        if cache is None:
+            return []
+        return cache.ensure_images(self._container_images(), refresh)
+
+    def _fingerprint_paths(self) -> Dict[str, Path]:
+        """
+        Returns the input files and directories whose state is part of the run's fingerprint. # noqa: E501
+        """
+        paths = {}
+        for name, value in self.inputs.get().items():
+            if name in self._fingerprint_exclude + self._fingerprint_path_exclude:
+                continue
+            trait_type = self.inputs.trait(name).trait_type
+            path_types = (File, Directory, traits.File, traits.Directory)
+            if not isinstance(trait_type, path_types) or not isdefined(value):
+                continue
+            paths[name] = Path(value)
+        return paths
+
+    def _get_run_fingerprint(self) -> Dict[str, Any]:
+        """
+        Computes (once per run) the fingerprint of the procedure's run.
+
+        The fingerprint covers the normalized inputs, the procedure's version,
+        the container image (with its digest, when an image cache already
+        resolved it) and a stat-based signature of the input files. Computing
+        it never pulls an image.
+        """
+        if self._run_fingerprint is None:
+            image = self._container_image()
+            cached = self._lookup_image(image) if image else None
+            if cached is not None:
+                image = f"{image}@{cached.digest}"
+            self._run_fingerprint = compute_fingerprint(
+                inputs=normalize_inputs(self.inputs.get(), self._fingerprint_exclude),
+                version=self._version,
+                paths=self._fingerprint_paths(),
+                image=image,
+                hash_contents=self.inputs.hash_input_contents,
+            )
+        return self._run_fingerprint
+
+    def _write_finished_file(self, finished_file: Union[str, Path], **fields: Any):
         """
         Writes a "finished" file to keep track of when the procedure was last run. # noqa: E501
 
@@ -123,6 +736,8 @@ class Procedure(BaseInterface):
         ----------
         finished_file : Union[str, Path]
             The path to the finished file.
+        **fields : Any
+            Fields to record in (or override in) the finished file.
         """
         config_to_save = {}
         # Fix JSON serialization issues
@@ -133,12 +748,43 @@ class Procedure(BaseInterface):
                 config_to_save[key] = None  # type: ignore[assignment]
             else:
                 config_to_save[key] = value
+        fingerprint = self._get_run_fingerprint()
+        record = {
+            "timestamp": str(datetime.now()),
+            "config": config_to_save,
+            "fingerprint": fingerprint["fingerprint"],
+            "fingerprint_components": fingerprint["components"],
+            "metrics": self._metrics.as_dict(),
+            "progress": (
+                self._progress.summary() if self._progress is not None else None
+            ),
+        }
+        record.update(fields)
         with open(str(finished_file), "w") as f:
-            json.dump(
-                {"timestamp": str(datetime.now()), "config": config_to_save},
-                f,  # noqa: E501
-                indent=6,
-            )
+            json.dump(record, f, indent=6)
+
+    def _write_batch_finished_file(self, batch_finished_file: Union[str, Path]):
+        """
+        Writes the participant's "finished" file after it was processed as part
+        of a batch, so later runs of the participant alone are skipped.
+
+        Parameters
+        ----------
+        batch_finished_file : Union[str, Path]
+            The "finished" file of the batched run.
+        """
+        try:
+            batch = json.loads(Path(batch_finished_file).read_text())
+        except (OSError, ValueError):
+            batch = {}
+        finished_file = self._finished_file_path()
+        finished_file.parent.mkdir(parents=True, exist_ok=True)
+        self._write_finished_file(
+            finished_file,
+            metrics=batch.get("metrics", {}),
+            progress=batch.get("progress"),
+            batch=str(batch_finished_file),
+        )
 
     def _check_same_configuration(self, config: Dict[str, Any]) -> bool:
         """
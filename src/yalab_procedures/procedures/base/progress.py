@@ -0,0 +1,175 @@
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+STARTED = "started"
+FINISHED = "finished"
+CACHED = "cached"
+FAILED = "failed"
+
+# nipype's node messages (nipype.workflow logger)
+_SETTING_UP = re.compile(r'\[Node\] Setting-up "(?P<node>[^"]+)" in')
+_FINISHED = re.compile(
+    r'\[Node\] Finished "(?P<node>[^"]+)"(?:, elapsed time (?P<elapsed>[\d.]+)s)?'
+)
+_CACHED = re.compile(r'\[Node\] Cached "(?P<node>[^"]+)"')
+_ERROR = re.compile(r'\[Node\] Error on "(?P<node>[^"]+)"')
+# MultiProc's job messages carry the full name of the node
+_JOB_COMPLETED = re.compile(r"\[Job \d+\] Completed \((?P<node>[^)]+)\)")
+_JOB_CACHED = re.compile(r"\[Job \d+\] Cached \((?P<node>[^)]+)\)")
+
+_PATTERNS = [
+    (_SETTING_UP, STARTED),
+    (_FINISHED, FINISHED),
+    (_JOB_COMPLETED, FINISHED),
+    (_CACHED, CACHED),
+    (_JOB_CACHED, CACHED),
+    (_ERROR, FAILED),
+]
+
+
+class NipypeProgress:
+    """
+    Follows a nipype workflow through its log and emits progress events.
+
+    Every line of the tool's output is fed to the tracker (it can be passed as
+    the ``line_callback`` of
+    :func:`~yalab_procedures.procedures.base.runner.run_command`). Node start,
+    finish, cache hit and failure messages become events like
+    ``{"time": ..., "event": "finished", "node": "qsiprep_wf.sub_01_wf.hmc",
+    "elapsed": 431.2, "completed": 57, "running": 3}``, which are appended
+    to a JSON-lines file as they happen and passed to an optional callback.
+    Nodes with a "started" event but no later event are still running (or
+    stuck).
+
+    Parameters
+    ----------
+    events_file : Optional[Union[str, Path]], optional
+        JSON-lines file to append the events to, by default None.
+    callback : Optional[Callable[[dict], None]], optional
+        Called with every event, by default None.
+    logger : Optional[logging.Logger], optional
+        Logger to report failed nodes to.
+    """
+
+    def __init__(
+        self,
+        events_file: Optional[Union[str, Path]] = None,
+        callback: Optional[Callable[[dict], None]] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.events_file = Path(events_file) if events_file else None
+        self.callback = callback
+        self.logger = logger or logging.getLogger(self.__class__.__name__)
+        self.running: Dict[str, float] = {}
+        self.timings: Dict[str, float] = {}
+        self.completed = 0
+        self.cached = 0
+        self.failed: List[str] = []
+        self._lock = threading.Lock()
+        self._file = None
+        if self.events_file is not None:
+            self.events_file.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.events_file, "a")
+
+    def _running_node(self, name: str) -> str:
+        """
+        The full name of a running node from the (possibly short) name
+        nipype logs when it finishes.
+        """
+        if name in self.running:
+            return name
+        # oldest first, as nipype reports nodes by their short name
+        for node in sorted(self.running, key=self.running.get):
+            if node.endswith(f".{name}"):
+                return node
+        return name
+
+    def __call__(self, line: str):
+        """
+        Parse a line of output.
+        """
+        for pattern, kind in _PATTERNS:
+            match = pattern.search(line)
+            if match:
+                break
+        else:
+            return
+        with self._lock:
+            event = self._update(kind, match)
+            if event is None:
+                return
+            if self._file is not None:
+                self._file.write(json.dumps(event) + "\n")
+                self._file.flush()
+        if kind == FAILED:
+            self.logger.warning(f"Node {event['node']} failed")
+        if self.callback is not None:
+            self.callback(event)
+
+    def _update(self, kind: str, match: re.Match) -> Optional[dict]:
+        """
+        Update the state of the workflow, returning the event (if any).
+        """
+        if kind == STARTED:
+            self.running[match["node"]] = time.time()
+            return self._event(kind, match["node"])
+        node = self._running_node(match["node"])
+        started = self.running.pop(node, None)
+        if started is None and node in self.timings:
+            # already counted: nipype reports both the node and its job
+            return None
+        if kind == FINISHED:
+            elapsed = match.groupdict().get("elapsed")
+            if elapsed is not None:
+                elapsed = float(elapsed)
+            elif started is not None:
+                elapsed = time.time() - started
+            self.timings[node] = elapsed or 0.0
+            self.completed += 1
+            return self._event(kind, node, elapsed)
+        if kind == CACHED:
+            self.timings[node] = 0.0
+            self.cached += 1
+            return self._event(kind, node)
+        self.failed.append(node)
+        return self._event(kind, node, time.time() - started if started else None)
+
+    def _event(self, kind: str, node: str, elapsed: Optional[float] = None) -> dict:
+        return {
+            "time": time.time(),
+            "event": kind,
+            "node": node,
+            "elapsed": elapsed,
+            "completed": self.completed,
+            "cached": self.cached,
+            "running": len(self.running),
+        }
+
+    def summary(self, slowest: int = 10) -> dict:
+        """
+        A summary of the workflow's progress, with its slowest nodes.
+        """
+        with self._lock:
+            return {
+                "completed": self.completed,
+                "cached": self.cached,
+                "failed": list(self.failed),
+                "running": sorted(self.running),
+                "slowest_nodes": dict(
+                    sorted(self.timings.items(), key=lambda item: -item[1])[:slowest]
+                ),
+            }
+
+    def close(self):
+        """
+        Close the events file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,199 @@
+import atexit
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import List, Optional, Union
+
+from yalab_procedures.procedures.base.resources import _pid_alive
+
+TRASH_DIRECTORY = ".trash"
+DEFAULT_REAPER_WORKERS = 8
+
+
+def remove_tree(path: Union[str, Path]):
+    """
+    Delete a directory tree with ``os.scandir`` (without following symlinks).
+    """
+    stack = [(str(path), False)]
+    while stack:
+        directory, emptied = stack.pop()
+        if emptied:
+            os.rmdir(directory)
+            continue
+        stack.append((directory, True))
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                else:
+                    os.unlink(entry.path)
+
+
+class Reaper:
+    """
+    Deletes directories in the background, off the critical path of the runs.
+
+    A directory handed to the reaper is first renamed into a ``.trash``
+    directory next to it, which is atomic and instant, so the path can be
+    reused right away and half-deleted trees are never visible. Its top-level
+    subdirectories are then unlinked in parallel by a pool of threads. Trees
+    left in the trash by processes that died are reaped as well.
+
+    The reaper lives for the whole process (see :func:`get_reaper`) and
+    is drained when the process exits.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of deletion threads, by default 8.
+    """
+
+    def __init__(self, workers: int = DEFAULT_REAPER_WORKERS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="reaper"
+        )
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def schedule(self, path: Union[str, Path]) -> Optional[Path]:
+        """
+        Move a directory to the trash and delete it in the background.
+
+        Returns
+        -------
+        Optional[Path]
+            The path of the directory in the trash, or None if it did not exist.
+        """
+        path = Path(path)
+        if not path.exists() and not path.is_symlink():
+            return None
+        trash = path.parent / TRASH_DIRECTORY
+        trash.mkdir(exist_ok=True)
+        self._reap_orphans(trash)
+        target = trash / f"{path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        os.rename(path, target)
+        self.logger.info(f"Scheduled {path} for background removal")
+        self._submit(target)
+        return target
+
+    def _reap_orphans(self, trash: Path):
+        """
+        Schedule the trees that processes which died left in the trash.
+        """
+        for entry in trash.iterdir():
+            pid = entry.name.rsplit(".", 2)[-2] if entry.name.count(".") >= 2 else ""
+            if not pid.isdigit() or _pid_alive(int(pid)):
+                continue
+            claimed = trash / f"{entry.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+            try:
+                # claim the tree so concurrent processes do not reap it twice
+                os.rename(entry, claimed)
+            except OSError:
+                continue
+            self._submit(claimed)
+
+    def _submit(self, target: Path):
+        with self._idle:
+            self._outstanding += 1
+        self._executor.submit(self._delete, target)
+
+    def _delete(self, target: Path):
+        """
+        Unlink the top level of a trashed tree and fan its subdirectories
+        out to the pool; the last subtree to finish removes the tree itself.
+        """
+        try:
+            if not target.is_dir() or target.is_symlink():
+                os.unlink(target)
+                self._finish(target)
+                return
+            subdirectories = []
+            with os.scandir(target) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    else:
+                        os.unlink(entry.path)
+        except OSError as e:
+            self._finish(target, e)
+            return
+        if not subdirectories:
+            self._finish(target)
+            return
+        remaining = [len(subdirectories)]
+        errors: List[OSError] = []
+        lock = threading.Lock()
+
+        def remove_subtree(subdirectory: str):
+            try:
+                remove_tree(subdirectory)
+            except OSError as e:
+                errors.append(e)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._finish(target, errors[0] if errors else None)
+
+        for subdirectory in subdirectories:
+            try:
+                self._executor.submit(remove_subtree, subdirectory)
+            except RuntimeError:
+                # the pool no longer accepts work once the interpreter exits
+                remove_subtree(subdirectory)
+
+    def _finish(self, target: Path, error: Optional[OSError] = None):
+        try:
+            if error is None and target.is_dir():
+                os.rmdir(target)
+        except OSError as e:
+            error = e
+        if error is not None:
+            self.logger.warning(f"Failed to remove {target}: {error}")
+        with self._idle:
+            self._outstanding -= 1
+            self._idle.notify_all()
+
+    def pending(self) -> int:
+        """
+        Number of directories still being deleted.
+        """
+        with self._idle:
+            return self._outstanding
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every scheduled directory has been deleted.
+
+        Returns
+        -------
+        bool
+            Whether all deletions finished (False if the timeout expired).
+        """
+        with self._idle:
+            if self._outstanding:
+                self.logger.info(f"Waiting for {self._outstanding} background removals")
+            return self._idle.wait_for(lambda: self._outstanding == 0, timeout)
+
+
+_reaper: Optional[Reaper] = None
+_reaper_lock = threading.Lock()
+
+
+def get_reaper() -> Reaper:
+    """
+    The process-wide reaper, drained when the process exits.
+    """
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = Reaper()
+            atexit.register(_reaper.drain)
+            # worker processes (e.g. of the CohortRunner) skip atexit handlers
+            Finalize(_reaper, _reaper.drain, exitpriority=10)
+        return _reaper
@@ -0,0 +1,247 @@
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from nipype.interfaces.base import isdefined
+
+LEDGER_FILE = "ledger.json"
+LOCK_FILE = ".ledger.lock"
+
+
+@dataclass
+class ResourceGrant:
+    """
+    CPU slots and memory handed out by the :class:`ResourceScheduler`.
+    """
+
+    lease_id: str
+    cpus: int
+    memory_gb: Optional[float] = None
+
+
+def total_memory_gb() -> float:
+    """
+    The physical memory of the node, in GB.
+    """
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+
+
+def _pid_alive(pid: int) -> bool:
+    """
+    Whether a process with the given pid is still running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ResourceScheduler:
+    """
+    A node-level CPU/memory budget shared by concurrent procedures.
+
+    The budget and the active leases live in a JSON ledger inside
+    ``state_directory`` that is guarded by a file lock, so independent processes
+    (e.g. CohortRunner workers, or several interactive runs) draw from the same
+    budget. Leases of processes that died are reclaimed automatically.
+
+    Parameters
+    ----------
+    state_directory : Union[str, Path]
+        Directory holding the ledger. Created if missing.
+    cpus : Optional[int], optional
+        Number of CPUs in the budget. Defaults to the budget already recorded
+        in the ledger, or to ``os.cpu_count()``.
+    memory_gb : Optional[float], optional
+        Memory in the budget (GB). Defaults to the budget already recorded
+        in the ledger, or to the node's physical memory.
+    poll_interval : float, optional
+        Seconds to wait between attempts while a request is queued, by default 5.
+    """
+
+    def __init__(
+        self,
+        state_directory: Union[str, Path],
+        cpus: Optional[int] = None,
+        memory_gb: Optional[float] = None,
+        poll_interval: float = 5.0,
+    ):
+        self.state_directory = Path(state_directory)
+        self.state_directory.mkdir(parents=True, exist_ok=True)
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(self.__class__.__name__)
+        with self._locked_ledger() as ledger:
+            budget = ledger.setdefault("budget", {})
+            if cpus is not None or "cpus" not in budget:
+                budget["cpus"] = int(cpus or os.cpu_count() or 1)
+            if memory_gb is not None or "memory_gb" not in budget:
+                budget["memory_gb"] = float(memory_gb or total_memory_gb())
+            self.budget = dict(budget)
+
+    @contextmanager
+    def _locked_ledger(self):
+        """
+        Open the ledger under an exclusive lock and write it back on exit.
+        """
+        with open(self.state_directory / LOCK_FILE, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                ledger_path = self.state_directory / LEDGER_FILE
+                ledger = (
+                    json.loads(ledger_path.read_text()) if ledger_path.exists() else {}
+                )
+                ledger.setdefault("leases", {})
+                yield ledger
+                tmp = ledger_path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(ledger, indent=2))
+                os.replace(tmp, ledger_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _in_use(leases: Dict[str, dict]) -> Dict[str, float]:
+        """
+        Sum the resources held by live leases, dropping those of dead processes.
+        """
+        for lease_id in [k for k, v in leases.items() if not _pid_alive(v["pid"])]:
+            leases.pop(lease_id)
+        return {
+            "cpus": sum(v["cpus"] for v in leases.values()),
+            "memory_gb": sum(v["memory_gb"] or 0 for v in leases.values()),
+        }
+
+    def try_acquire(
+        self, cpus: int, memory_gb: Optional[float] = None
+    ) -> Optional[ResourceGrant]:
+        """
+        Acquire resources if they are available right now.
+
+        Requests larger than the whole budget are clamped to the budget,
+        so they eventually run instead of waiting forever.
+
+        Returns
+        -------
+        Optional[ResourceGrant]
+            The grant, or None if the resources are currently in use.
+        """
+        with self._locked_ledger() as ledger:
+            budget = ledger["budget"]
+            cpus = max(1, min(int(cpus), budget["cpus"]))
+            if memory_gb is not None:
+                memory_gb = min(float(memory_gb), budget["memory_gb"])
+            in_use = self._in_use(ledger["leases"])
+            if in_use["cpus"] + cpus > budget["cpus"]:
+                return None
+            if in_use["memory_gb"] + (memory_gb or 0) > budget["memory_gb"]:
+                return None
+            grant = ResourceGrant(uuid.uuid4().hex, cpus, memory_gb)
+            ledger["leases"][grant.lease_id] = {
+                "pid": os.getpid(),
+                "cpus": grant.cpus,
+                "memory_gb": grant.memory_gb,
+                "since": time.time(),
+            }
+            return grant
+
+    def acquire(
+        self,
+        cpus: int,
+        memory_gb: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ) -> ResourceGrant:
+        """
+        Acquire resources, waiting in the queue until they free up.
+
+        Parameters
+        ----------
+        cpus : int
+            Number of CPU slots requested.
+        memory_gb : Optional[float], optional
+            Memory requested (GB), by default None (no memory reservation).
+        timeout : Optional[float], optional
+            Maximal number of seconds to wait, by default None (wait forever).
+
+        Returns
+        -------
+        ResourceGrant
+            The granted resources.
+
+        Raises
+        ------
+        TimeoutError
+            If the resources did not free up within ``timeout`` seconds.
+        """
+        start = time.monotonic()
+        announced = False
+        while True:
+            grant = self.try_acquire(cpus, memory_gb)
+            if grant is not None:
+                return grant
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(
+                    f"Could not acquire {cpus} CPUs / {memory_gb} GB within {timeout}s."
+                )
+            if not announced:
+                self.logger.info(
+                    f"Waiting for {cpus} CPUs / {memory_gb} GB to free up "
+                    f"(budget: {self.budget})."
+                )
+                announced = True
+            time.sleep(self.poll_interval)
+
+    def release(self, grant: ResourceGrant):
+        """
+        Return a grant's resources to the budget.
+        """
+        with self._locked_ledger() as ledger:
+            ledger["leases"].pop(grant.lease_id, None)
+
+    @contextmanager
+    def reserve(
+        self,
+        cpus: int,
+        memory_gb: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Context manager that acquires resources and releases them on exit.
+        """
+        grant = self.acquire(cpus, memory_gb, timeout)
+        try:
+            yield grant
+        finally:
+            self.release(grant)
+
+
+def container_resource_flags(cpus, memory_gb) -> list:
+    """
+    Translate CPU/memory limits into ``docker run`` flags.
+
+    Parameters
+    ----------
+    cpus : Optional[int]
+        Number of CPUs the container may use (Undefined/None for no limit).
+    memory_gb : Optional[float]
+        Memory the container may use, in GB (Undefined/None for no limit).
+
+    Returns
+    -------
+    list
+        The flags, e.g. ``["--cpus 8", "--memory 32g"]``.
+    """
+    flags = []
+    if isdefined(cpus) and cpus:
+        flags.append(f"--cpus {int(cpus)}")
+    if isdefined(memory_gb) and memory_gb:
+        flags.append(f"--memory {int(memory_gb * 1024)}m")
+    return flags
@@ -0,0 +1,216 @@
+import logging
+import os
+import signal
+import subprocess
+import threading
+from collections import deque
+from subprocess import CalledProcessError
+from typing import IO, Callable, List, Optional, Union
+
+DEFAULT_TAIL_LINES = 200
+# seconds the command's processes get to exit after SIGTERM before SIGKILL
+TERMINATE_GRACE_SECONDS = 10
+
+
+class CommandResult:
+    """
+    The result of a command run through :func:`run_command`.
+
+    Only the last lines of stderr are kept in memory; the full output
+    is streamed to the logger while the command runs.
+    """
+
+    def __init__(
+        self,
+        command: Union[str, List[str]],
+        returncode: int,
+        stderr_tail: List[str],
+        pid: Optional[int] = None,
+    ):
+        self.command = command
+        self.returncode = returncode
+        self.stderr_tail = stderr_tail
+        self.pid = pid
+
+    @property
+    def stderr(self) -> str:
+        """
+        The retained tail of the command's stderr.
+        """
+        return "\n".join(self.stderr_tail)
+
+    def check_returncode(self):
+        """
+        Raise a CalledProcessError if the command exited with a non-zero code.
+        """
+        if self.returncode != 0:
+            raise CalledProcessError(self.returncode, self.command, stderr=self.stderr)
+
+
+def _pump(
+    stream: IO[str],
+    logger: logging.Logger,
+    level: int,
+    tail: Optional[deque] = None,
+    line_callback: Optional[Callable[[str], None]] = None,
+):
+    """
+    Read a pipe line by line, forwarding every line to the logger.
+    """
+    with stream:
+        for line in iter(stream.readline, ""):
+            line = line.rstrip("\n")
+            logger.log(level, line)
+            if tail is not None:
+                tail.append(line)
+            if line_callback is not None:
+                try:
+                    line_callback(line)
+                except Exception as e:
+                    # a faulty observer must not stall the pipe
+                    logger.debug(f"Line callback failed: {e}")
+
+
+def _signal_group(process: subprocess.Popen, sig: int) -> bool:
+    """
+    Send a signal to the command's process group.
+
+    Returns
+    -------
+    bool
+        Whether any process of the group was left to signal.
+    """
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def _terminate(
+    process: subprocess.Popen,
+    own_group: bool,
+    grace: float = TERMINATE_GRACE_SECONDS,
+):
+    """
+    Terminate a command and everything it started (the shell, the container
+    client, the tool), killing whatever did not exit within ``grace`` seconds.
+    """
+    if not own_group:
+        process.kill()
+        process.wait()
+        return
+    if _signal_group(process, signal.SIGTERM):
+        try:
+            process.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            pass
+        _signal_group(process, signal.SIGKILL)
+    process.wait()
+
+
+def run_command(
+    command: Union[str, List[str]],
+    logger: logging.Logger,
+    shell: bool = True,
+    check: bool = True,
+    tail_lines: int = DEFAULT_TAIL_LINES,
+    stdout_level: int = logging.INFO,
+    stderr_level: int = logging.INFO,
+    line_callback: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None,
+    **popen_kwargs,
+) -> CommandResult:
+    """
+    Run a command, streaming its stdout and stderr line by line into a logger.
+
+    Both pipes are drained concurrently by reader threads so neither can block
+    the child process, and only the last ``tail_lines`` lines of stderr are
+    kept for error reporting. Failure is decided by the return code.
+
+    The command runs in its own process group: on an error (a non-zero
+    return code, a timeout or an interruption) the whole group is terminated,
+    so no child of the shell outlives the command.
+
+    Parameters
+    ----------
+    command : Union[str, List[str]]
+        The command to run.
+    logger : logging.Logger
+        The logger to stream the output to.
+    shell : bool, optional
+        Whether to run the command through the shell, by default True.
+    check : bool, optional
+        Whether to raise a CalledProcessError on a non-zero return code,
+        by default True.
+    tail_lines : int, optional
+        Number of stderr lines to keep for error reports, by default 200.
+    stdout_level : int, optional
+        Logging level for stdout lines, by default logging.INFO.
+    stderr_level : int, optional
+        Logging level for stderr lines, by default logging.INFO.
+    line_callback : Optional[Callable[[str], None]], optional
+        Called with every line of stdout and stderr (from the reader threads),
+        e.g. to follow the progress of the command, by default None.
+    timeout : Optional[float], optional
+        Seconds after which the command is terminated, by default None
+        (no limit).
+
+    Returns
+    -------
+    CommandResult
+        The return code and the stderr tail of the command.
+
+    Raises
+    ------
+    CalledProcessError
+        If ``check`` is True and the command exits with a non-zero code.
+    subprocess.TimeoutExpired
+        If the command did not finish within ``timeout`` seconds.
+    """
+    stderr_tail: deque = deque(maxlen=tail_lines)
+    popen_kwargs.setdefault("start_new_session", True)
+    own_group = bool(popen_kwargs["start_new_session"])
+    process = subprocess.Popen(
+        command,
+        shell=shell,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+        errors="replace",
+        **popen_kwargs,
+    )
+    readers = [
+        threading.Thread(
+            target=_pump,
+            args=(process.stdout, logger, stdout_level, None, line_callback),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_pump,
+            args=(process.stderr, logger, stderr_level, stderr_tail, line_callback),
+            daemon=True,
+        ),
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        returncode = process.wait(timeout=timeout)
+        if returncode != 0 and own_group:
+            # children of the shell may still hold the pipes
+            _signal_group(process, signal.SIGKILL)
+    except BaseException:
+        _terminate(process, own_group)
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+    result = CommandResult(command, returncode, list(stderr_tail), pid=process.pid)
+    if returncode != 0:
+        logger.error(f"Command exited with code {returncode}: {command}")
+        if result.stderr_tail:
+            logger.error(result.stderr)
+    if check:
+        result.check_returncode()
+    return result
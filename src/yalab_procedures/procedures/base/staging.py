@@ -0,0 +1,441 @@
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    CancelledError,
+    ThreadPoolExecutor,
+    wait,
+)
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from yalab_procedures.procedures.base.manifest import StagingManifest
+
+# ioctl request number of FICLONE (_IOW(0x94, 9, int)), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+HARDLINK = "hardlink"
+REFLINK = "reflink"
+COPY = "copy"
+UNCHANGED = "unchanged"
+
+# errors meaning "this file system (pair) does not support the operation"
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EMLINK,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.ENOTTY,
+}
+
+
+class BandwidthLimiter:
+    """
+    A token bucket shared by the staging threads to cap the copy bandwidth.
+
+    Only bytes that are actually copied count; hardlinks and reflinks are free.
+
+    Parameters
+    ----------
+    mb_per_second : float
+        The bandwidth cap, in MB/s.
+    """
+
+    def __init__(self, mb_per_second: float):
+        self.rate = mb_per_second * 1024**2
+        # allow bursts of up to one second of transfer
+        self.capacity = self.rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int):
+        """
+        Block until ``nbytes`` may be transferred.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= nbytes
+            deficit = -self._tokens
+        if deficit > 0:
+            time.sleep(deficit / self.rate)
+
+
+def _reflink(source: Path, destination: Path):
+    """
+    Clone a file with the FICLONE ioctl (btrfs, XFS, ...).
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _copy_file_range(
+    source: Path, destination: Path, limiter: Optional[BandwidthLimiter] = None
+):
+    """
+    Copy a file inside the kernel with copy_file_range(2),
+    falling back to a userspace copy where it is unavailable.
+    """
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                chunk = min(COPY_CHUNK_SIZE, size - copied)
+                if limiter is not None:
+                    limiter.consume(chunk)
+                n = os.copy_file_range(src.fileno(), dst.fileno(), chunk)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in _UNSUPPORTED:
+                raise
+            src.seek(copied)
+            dst.seek(copied)
+            for data in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+                if limiter is not None:
+                    limiter.consume(len(data))
+                dst.write(data)
+
+
+def stage_file(
+    source: Union[str, Path],
+    destination: Union[str, Path],
+    limiter: Optional[BandwidthLimiter] = None,
+) -> str:
+    """
+    Place a file at ``destination`` without copying its data whenever possible.
+
+    The file is hardlinked if both paths are on the same file system, reflinked
+    (FICLONE) if the file system supports copy-on-write clones, and copied with
+    ``copy_file_range`` otherwise. Symbolic links are resolved, so the staged
+    file is always a regular file (like ``rsync -L``).
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The file to stage.
+    destination : Union[str, Path]
+        Where to place it.
+    limiter : Optional[BandwidthLimiter], optional
+        Caps the bandwidth of copies, by default None (no cap).
+
+    Returns
+    -------
+    str
+        How the file was staged: "hardlink", "reflink", "copy" or "unchanged"
+        (if the destination already was the same file).
+    """
+    source = Path(os.path.realpath(source))
+    destination = Path(destination)
+    if destination.exists() or destination.is_symlink():
+        if destination.exists() and os.path.samefile(source, destination):
+            return UNCHANGED
+        destination.unlink()
+    try:
+        os.link(source, destination)
+        return HARDLINK
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+    try:
+        _reflink(source, destination)
+        method = REFLINK
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        _copy_file_range(source, destination, limiter)
+        method = COPY
+    shutil.copystat(source, destination)
+    return method
+
+
+def _is_excluded(name: str, exclude: Iterable[str]) -> bool:
+    return any(fnmatch(name, pattern) for pattern in exclude)
+
+
+def stage_path(
+    source: Union[str, Path],
+    destination_directory: Union[str, Path],
+    exclude: Iterable[str] = (),
+    include: Optional[Callable[[Path], bool]] = None,
+    limiter: Optional[BandwidthLimiter] = None,
+    cancel: Optional[threading.Event] = None,
+    manifest: Optional[StagingManifest] = None,
+) -> Counter:
+    """
+    Stage a file or a directory tree into ``destination_directory``.
+
+    This is the equivalent of ``rsync -aL --exclude=<pattern> source
+    destination_directory``: the source ends up at
+    ``destination_directory/<source name>``, symbolic links are followed, and
+    files (or directories) whose name matches one of the ``exclude`` glob
+    patterns are skipped. Every file is staged with :func:`stage_file`.
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        The file or directory to stage.
+    destination_directory : Union[str, Path]
+        The directory to stage it into. Created if missing.
+    exclude : Iterable[str], optional
+        Glob patterns of names to skip (e.g. ``"*.tck*"``).
+    include : Optional[Callable[[Path], bool]], optional
+        Predicate deciding which files and directories below ``source`` to
+        stage (e.g. a :class:`~yalab_procedures.procedures.base.bids_filters.BidsFilter`),
+        by default None (everything). Skipped entries are counted as "filtered".
+        If it has a ``rewrite`` method, files it returns content for (e.g.
+        tables listing filtered files) are written with that content instead,
+        and counted as "rewritten".
+    limiter : Optional[BandwidthLimiter], optional
+        Caps the bandwidth of copies, by default None (no cap).
+    cancel : Optional[threading.Event], optional
+        Stops staging (with a CancelledError) once set.
+    manifest : Optional[StagingManifest], optional
+        Manifest of the staging directory. Files it records as up to date
+        are skipped, and newly staged files are recorded in it.
+
+    Returns
+    -------
+    Counter
+        The number of files and bytes staged with each method,
+        e.g. ``{"hardlink": 12, "hardlink_bytes": 4096, ...}``.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the source does not exist.
+    """
+    source = Path(source)
+    if not source.exists():
+        raise FileNotFoundError(f"Cannot stage missing path: {source}")
+    exclude = list(exclude)
+    stats: Counter = Counter()
+    destination = Path(destination_directory) / source.name
+    if not source.is_dir():
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        _stage_file(source, destination, stats, limiter, manifest)
+        return stats
+    rewrite = getattr(include, "rewrite", None)
+    visited = set()
+    stack = [(source, destination)]
+    while stack:
+        directory, target = stack.pop()
+        if cancel is not None and cancel.is_set():
+            raise CancelledError(f"Staging of {source} was cancelled")
+        st = directory.stat()
+        # symbolic links may point back up the tree
+        if (st.st_dev, st.st_ino) in visited:
+            continue
+        visited.add((st.st_dev, st.st_ino))
+        target.mkdir(parents=True, exist_ok=True)
+        with os.scandir(directory) as it:
+            entries = list(it)
+        for entry in entries:
+            if _is_excluded(entry.name, exclude):
+                continue
+            if include is not None and not include(Path(entry.path)):
+                stats["filtered"] += 1
+                continue
+            if entry.is_dir():
+                stack.append((Path(entry.path), target / entry.name))
+            elif entry.is_file():
+                content = rewrite(Path(entry.path)) if rewrite is not None else None
+                if content is not None:
+                    _write_file(
+                        entry.path, target / entry.name, content, stats, manifest
+                    )
+                else:
+                    _stage_file(
+                        entry.path, target / entry.name, stats, limiter, manifest
+                    )
+    return stats
+
+
+def _stage_file(
+    source: Union[str, Path],
+    destination: Path,
+    stats: Counter,
+    limiter: Optional[BandwidthLimiter],
+    manifest: Optional[StagingManifest],
+):
+    """
+    Stage a single file of a tree, consulting and updating the manifest.
+    """
+    if manifest is not None and manifest.is_current(source, destination):
+        method = UNCHANGED
+    else:
+        method = stage_file(source, destination, limiter)
+        if manifest is not None:
+            manifest.record(source, destination)
+    stats[method] += 1
+    stats[f"{method}_bytes"] += os.stat(source).st_size
+
+
+def _write_file(
+    source: Union[str, Path],
+    destination: Path,
+    content: str,
+    stats: Counter,
+    manifest: Optional[StagingManifest],
+):
+    """
+    Stage a file of a tree with new content.
+
+    The file is replaced rather than written in place, so a hardlink staged
+    before never modifies the source.
+    """
+    tmp = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+    tmp.write_text(content)
+    os.replace(tmp, destination)
+    if manifest is not None:
+        manifest.record(source, destination)
+    stats["rewritten"] += 1
+
+
+StagingPath = Union[str, Tuple[str, str], Tuple[str, str, Tuple[str, ...]]]
+
+
+def staging_jobs(
+    source_root: Union[str, Path],
+    paths: Iterable[StagingPath],
+    destination_root: Union[str, Path],
+) -> List[tuple]:
+    """
+    Turn paths relative to a source root into :func:`stage_paths` jobs.
+
+    A path is either a relative path, staged at the same location under
+    ``destination_root``, a ``(source, destination directory)`` pair of
+    relative paths, or a ``(source, destination directory, exclude)``
+    triple whose exclude patterns only apply to that path. Duplicated paths
+    are staged once.
+    """
+    jobs = []
+    for path in dict.fromkeys(paths):
+        if isinstance(path, str):
+            path = (path, str(Path(path).parent))
+        source, destination_directory, *exclude = path
+        jobs.append(
+            (
+                Path(source_root) / source,
+                Path(destination_root) / destination_directory,
+                *exclude,
+            )
+        )
+    return jobs
+
+
+def stage_paths(
+    jobs: List[tuple],
+    exclude: Iterable[str] = (),
+    include: Optional[Callable[[Path], bool]] = None,
+    workers: int = 1,
+    bandwidth_mb: Optional[float] = None,
+    logger: Optional[logging.Logger] = None,
+    manifest: Optional[StagingManifest] = None,
+) -> Counter:
+    """
+    Stage several paths concurrently with a bounded pool of I/O threads.
+
+    Staging stops at the first error: the other jobs are cancelled and
+    the error is raised.
+
+    Parameters
+    ----------
+    jobs : List[tuple]
+        ``(source, destination_directory)`` pairs, see :func:`stage_path`,
+        or ``(source, destination_directory, exclude)`` triples with glob
+        patterns of names to skip in that job only.
+    exclude : Iterable[str], optional
+        Glob patterns of names to skip in every job.
+    include : Optional[Callable[[Path], bool]], optional
+        Predicate deciding which files and directories to stage.
+    workers : int, optional
+        Number of paths staged at the same time, by default 1.
+    bandwidth_mb : Optional[float], optional
+        Cap on the total copy bandwidth (MB/s), by default None (no cap).
+    logger : Optional[logging.Logger], optional
+        Logger to report progress to.
+    manifest : Optional[StagingManifest], optional
+        Manifest of the staging directory, to restage it incrementally.
+        Files recorded in it that were not staged this time are removed
+        and the manifest is saved once every job succeeded.
+
+    Returns
+    -------
+    Counter
+        The combined statistics of all jobs.
+    """
+    limiter = BandwidthLimiter(bandwidth_mb) if bandwidth_mb else None
+    cancel = threading.Event()
+    stats: Counter = Counter()
+    exclude = list(exclude)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(
+                stage_path,
+                source,
+                destination,
+                exclude + list(job_exclude[0] if job_exclude else ()),
+                include,
+                limiter,
+                cancel,
+                manifest,
+            ): source
+            for source, destination, *job_exclude in jobs
+        }
+        pending = set(futures)
+        completed = 0
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+            for future in done:
+                error = future.exception()
+                if error is not None:
+                    cancel.set()
+                    for other in pending:
+                        other.cancel()
+                    raise error
+                stats += future.result()
+                completed += 1
+                if logger is not None:
+                    logger.info(
+                        f"Staged {futures[future]} ({completed}/{len(futures)} paths)"
+                    )
+    if manifest is not None:
+        stats["removed"] += manifest.prune()
+        manifest.save()
+    return stats
+
+
+def log_staging_stats(logger: logging.Logger, stats: Counter, destination):
+    """
+    Log a one-line summary of a staging operation.
+    """
+    summary = ", ".join(
+        f"{stats[method]} files by {method} ({stats[f'{method}_bytes'] / 1024**2:.1f} MB)"  # noqa: E501
+        for method in (HARDLINK, REFLINK, COPY, UNCHANGED)
+        if stats[method]
+    )
+    if stats["filtered"]:
+        summary += f", {stats['filtered']} paths filtered out"
+    if stats["rewritten"]:
+        summary += f", {stats['rewritten']} files rewritten"
+    if stats["removed"]:
+        summary += f", {stats['removed']} stale files removed"
+    logger.info(f"Staged inputs into {destination}: {summary or 'nothing to do'}")
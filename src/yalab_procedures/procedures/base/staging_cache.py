@@ -0,0 +1,289 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+from yalab_procedures.procedures.base.bids_filters import BidsFilter
+from yalab_procedures.procedures.base.fingerprint import path_signature
+from yalab_procedures.procedures.base.reaper import get_reaper
+from yalab_procedures.procedures.base.resources import _pid_alive
+from yalab_procedures.procedures.base.staging import (
+    COPY,
+    StagingPath,
+    log_staging_stats,
+    stage_paths,
+    staging_jobs,
+)
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".index.lock"
+ENTRIES_DIRECTORY = "entries"
+INCOMING_DIRECTORY = "incoming"
+
+
+@dataclass
+class StagingLease:
+    """
+    A reference to a staged tree held by a running procedure.
+    """
+
+    lease_id: str
+    key: str
+    path: Path
+
+
+class StagingCache:
+    """
+    A node-level cache of staged BIDS trees, shared by concurrent and later runs.
+
+    Entries are keyed by the source directory, the staged paths and a stat-based
+    signature of their content, so a subject is staged once and reused until its
+    data changes. Every user holds a lease on the entry; entries without live
+    leases are evicted least-recently-used first once the cache exceeds its
+    quota. Trees are staged into an ``incoming`` directory and promoted with an
+    atomic rename, so a crashed run never leaves a half-written entry behind.
+
+    Parameters
+    ----------
+    cache_directory : Union[str, Path]
+        Directory holding the cache. Created if missing. Should be on the same
+        file system as the source data so files can be hardlinked.
+    quota_gb : Optional[float], optional
+        Maximal size of the cache (GB), by default None (no eviction).
+        Only bytes actually written count towards the quota;
+        hardlinked and reflinked files share their blocks with the source.
+    """
+
+    def __init__(
+        self, cache_directory: Union[str, Path], quota_gb: Optional[float] = None
+    ):
+        self.cache_directory = Path(cache_directory)
+        (self.cache_directory / ENTRIES_DIRECTORY).mkdir(parents=True, exist_ok=True)
+        (self.cache_directory / INCOMING_DIRECTORY).mkdir(exist_ok=True)
+        self.quota_gb = quota_gb
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @contextmanager
+    def _locked_index(self):
+        """
+        Open the index under an exclusive lock and write it back on exit.
+        """
+        with open(self.cache_directory / LOCK_FILE, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index_path = self.cache_directory / INDEX_FILE
+                index = (
+                    json.loads(index_path.read_text()) if index_path.exists() else {}
+                )
+                yield index
+                tmp = index_path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(index, indent=2))
+                os.replace(tmp, index_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def entry_key(
+        source_directory: Union[str, Path],
+        paths: Iterable[StagingPath],
+        exclude: Iterable[str] = (),
+        include: Optional[BidsFilter] = None,
+    ) -> str:
+        """
+        The cache key of a set of paths staged from a source directory.
+        """
+        source_directory = Path(os.path.realpath(source_directory))
+        digest = hashlib.sha256(str(source_directory).encode())
+        for path in sorted(paths, key=json.dumps):
+            source = path if isinstance(path, str) else path[0]
+            digest.update(f"\0{json.dumps(path)}\0".encode())
+            digest.update(path_signature(source_directory / source).encode())
+        digest.update(json.dumps(sorted(exclude)).encode())
+        if include is not None:
+            digest.update(include.key.encode())
+        return digest.hexdigest()[:32]
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_directory / ENTRIES_DIRECTORY / key
+
+    def acquire(
+        self,
+        source_directory: Union[str, Path],
+        paths: List[StagingPath],
+        exclude: Iterable[str] = (),
+        include: Optional[BidsFilter] = None,
+        workers: int = 1,
+        bandwidth_mb: Optional[float] = None,
+    ) -> StagingLease:
+        """
+        Lease a staged copy of ``paths`` (relative to ``source_directory``),
+        staging them first if the cache does not hold them yet.
+
+        Parameters
+        ----------
+        source_directory : Union[str, Path]
+            The root of the source dataset.
+        paths : List[StagingPath]
+            Files and directories to stage, relative to the source directory
+            (e.g. ``["sub-01", "dataset_description.json"]``),
+            see :func:`~yalab_procedures.procedures.base.staging.staging_jobs`.
+        exclude : Iterable[str], optional
+            Glob patterns of names to skip.
+        include : Optional[BidsFilter], optional
+            Filter selecting the files to stage, by default None (all of them).
+        workers : int, optional
+            Number of paths staged at the same time, by default 1.
+        bandwidth_mb : Optional[float], optional
+            Cap on the copy bandwidth (MB/s), by default None (no cap).
+
+        Returns
+        -------
+        StagingLease
+            The lease; its ``path`` is the root of the staged tree.
+        """
+        exclude = list(exclude)
+        key = self.entry_key(source_directory, paths, exclude, include)
+        lease = StagingLease(uuid.uuid4().hex, key, self.entry_path(key))
+        if self._add_lease(lease):
+            self.logger.info(f"Reusing staged inputs from {lease.path}")
+            return lease
+        incoming = (
+            self.cache_directory
+            / INCOMING_DIRECTORY
+            / f"{key}.{os.getpid()}.{lease.lease_id}"  # noqa: E501
+        )
+        try:
+            stats: Counter = stage_paths(
+                staging_jobs(source_directory, paths, incoming),
+                exclude=exclude,
+                include=include,
+                workers=workers,
+                bandwidth_mb=bandwidth_mb,
+                logger=self.logger,
+            )
+            log_staging_stats(self.logger, stats, lease.path)
+            with self._locked_index() as index:
+                if key not in index:
+                    # left over by a run that crashed while promoting
+                    shutil.rmtree(lease.path, ignore_errors=True)
+                    os.rename(incoming, lease.path)
+                    index[key] = {
+                        "source": str(source_directory),
+                        "paths": sorted(paths, key=json.dumps),
+                        "size": stats[f"{COPY}_bytes"],
+                        "created": time.time(),
+                        "last_used": time.time(),
+                        "leases": {},
+                    }
+                index[key]["leases"][lease.lease_id] = os.getpid()
+                index[key]["last_used"] = time.time()
+        finally:
+            # another process may have promoted the same entry first
+            shutil.rmtree(incoming, ignore_errors=True)
+        self.evict()
+        return lease
+
+    def _add_lease(self, lease: StagingLease) -> bool:
+        """
+        Register a lease on an existing entry.
+        """
+        with self._locked_index() as index:
+            entry = index.get(lease.key)
+            if entry is None:
+                return False
+            if not lease.path.is_dir():
+                index.pop(lease.key)
+                return False
+            entry["leases"][lease.lease_id] = os.getpid()
+            entry["last_used"] = time.time()
+            return True
+
+    def release(self, lease: StagingLease):
+        """
+        Drop a lease. The entry stays cached until it is evicted.
+        """
+        with self._locked_index() as index:
+            entry = index.get(lease.key)
+            if entry is not None:
+                entry["leases"].pop(lease.lease_id, None)
+                entry["last_used"] = time.time()
+        self.evict()
+
+    @contextmanager
+    def lease(
+        self,
+        source_directory: Union[str, Path],
+        paths: List[StagingPath],
+        exclude: Iterable[str] = (),
+        include: Optional[BidsFilter] = None,
+        **kwargs,
+    ):
+        """
+        Context manager that acquires a staged tree and releases it on exit.
+        """
+        lease = self.acquire(source_directory, paths, exclude, include, **kwargs)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def evict(self) -> List[str]:
+        """
+        Evict unused entries, least recently used first, until the cache
+        fits its quota. Leases held by dead processes and trees half-staged
+        by them are dropped first, with or without a quota.
+
+        Returns
+        -------
+        List[str]
+            The keys of the evicted entries.
+        """
+        evicted = []
+        with self._locked_index() as index:
+            for entry in index.values():
+                entry["leases"] = {
+                    k: pid for k, pid in entry["leases"].items() if _pid_alive(pid)
+                }
+            if self.quota_gb is not None:
+                evicted = self._evict_lru(index, self.quota_gb * 1024**3)
+        self._remove_leftovers()
+        return evicted
+
+    def _evict_lru(self, index: dict, quota: float) -> List[str]:
+        """
+        Evict the idle entries of the (locked) index, least recently used
+        first, until the cache fits ``quota`` bytes.
+        """
+        evicted = []
+        total = sum(entry["size"] for entry in index.values())
+        idle = sorted(
+            (key for key, entry in index.items() if not entry["leases"]),
+            key=lambda key: index[key]["last_used"],
+        )
+        for key in idle:
+            if total <= quota:
+                break
+            total -= index.pop(key)["size"]
+            # moved aside atomically, deleted in the background
+            get_reaper().schedule(self.entry_path(key))
+            evicted.append(key)
+            self.logger.info(f"Evicting staged inputs {key} from the staging cache")
+        return evicted
+
+    def _remove_leftovers(self):
+        """
+        Remove trees half-staged by processes that died.
+        """
+        for path in (self.cache_directory / INCOMING_DIRECTORY).iterdir():
+            owner = path.name.split(".")[1] if "." in path.name else ""
+            if owner.isdigit() and not _pid_alive(int(owner)):
+                get_reaper().schedule(path)
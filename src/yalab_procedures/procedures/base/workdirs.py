@@ -0,0 +1,196 @@
+import fcntl
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Union
+
+from yalab_procedures.procedures.base.reaper import get_reaper
+from yalab_procedures.procedures.base.resources import _pid_alive
+
+MARKER_FILE = ".work_directory.json"
+
+RUNNING = "running"
+FAILED = "failed"
+FINISHED = "finished"
+
+
+def _tree_size(path: Path) -> int:
+    """
+    Total size of the files below ``path`` (without following symlinks).
+    """
+    total = 0
+    stack = [str(path)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+class WorkDirectories:
+    """
+    Stable work directories, one per procedure, participant and configuration.
+
+    A run works in ``<root>/<procedure>/<participants>/<config key>``, so a
+    retried run with the same configuration mounts the same directory and
+    the tool (e.g. nipype) resumes from its cached results. Every directory
+    holds a small marker recording its owner, status and last use, which the
+    garbage collection relies on: directories of running processes are never
+    collected, and the others are removed once they are older than
+    ``max_age_days`` or, least recently used first, once the work directories
+    exceed ``quota_gb``.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The root work directory.
+    max_age_days : Optional[float], optional
+        Age (since last use) after which work directories are removed,
+        by default None (never).
+    quota_gb : Optional[float], optional
+        Maximal total size of the work directories (GB), by default None
+        (no quota).
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        max_age_days: Optional[float] = None,
+        quota_gb: Optional[float] = None,
+    ):
+        self.root = Path(root)
+        self.max_age_days = max_age_days
+        self.quota_gb = quota_gb
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def path(self, procedure: str, participants: str, config_key: str) -> Path:
+        return self.root / procedure / participants / config_key
+
+    @staticmethod
+    def _read_marker(path: Path) -> dict:
+        try:
+            return json.loads((path / MARKER_FILE).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_marker(path: Path, **fields):
+        marker = WorkDirectories._read_marker(path)
+        marker.update(fields, last_used=time.time())
+        tmp = path / f"{MARKER_FILE}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(marker, indent=2))
+        os.replace(tmp, path / MARKER_FILE)
+
+    @contextmanager
+    def _locked(self, path: Path):
+        """
+        Hold an exclusive lock on a work directory (through a lock file next
+        to it, which outlives the directory).
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.parent / f".{path.name}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def claim(self, procedure: str, participants: str, config_key: str) -> Path:
+        """
+        Claim the work directory of a run, creating it if needed.
+
+        If a live process already works in it, the run gets a private
+        directory next to it instead.
+
+        Returns
+        -------
+        Path
+            The work directory.
+        """
+        path = self.path(procedure, participants, config_key)
+        # two runs must not both find the directory free
+        with self._locked(path):
+            marker = self._read_marker(path)
+            owner = marker.get("owner")
+            if (
+                marker.get("status") == RUNNING
+                and owner not in (None, os.getpid())
+                and _pid_alive(owner)
+            ):
+                self.logger.warning(
+                    f"{path} is used by process {owner}, using a private work directory"  # noqa: E501
+                )
+                path = path.with_name(f"{config_key}.{os.getpid()}")
+            resumed = path.exists()
+            path.mkdir(parents=True, exist_ok=True)
+            self._write_marker(path, owner=os.getpid(), status=RUNNING)
+        self.logger.info(
+            f"{'Resuming from' if resumed else 'Created'} work directory {path}"
+        )
+        return path
+
+    def release(self, path: Union[str, Path], succeeded: bool, keep: str):
+        """
+        Release the work directory of a finished run.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            The work directory.
+        succeeded : bool
+            Whether the run succeeded.
+        keep : str
+            When to keep the directory: "always", "on_failure" (so a retry can
+            resume from it) or "never".
+        """
+        path = Path(path)
+        if keep == "never" or (keep == "on_failure" and succeeded):
+            get_reaper().schedule(path)
+            return
+        size = _tree_size(path) if self.quota_gb else None
+        self._write_marker(path, status=FINISHED if succeeded else FAILED, size=size)
+
+    def collect(self) -> List[Path]:
+        """
+        Remove the work directories that are too old or exceed the quota.
+
+        Returns
+        -------
+        List[Path]
+            The removed directories.
+        """
+        entries = []
+        for path in self.root.glob(f"*/*/*/{MARKER_FILE}"):
+            path = path.parent
+            marker = self._read_marker(path)
+            owner = marker.get("owner")
+            if marker.get("status") == RUNNING and owner and _pid_alive(owner):
+                continue
+            entries.append((marker.get("last_used", 0), marker.get("size"), path))
+        entries.sort(key=lambda entry: entry[0])
+        removed = []
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += [path for last_used, _, path in entries if last_used < cutoff]
+        if self.quota_gb is not None:
+            remaining = [entry for entry in entries if entry[2] not in removed]
+            sizes = {
+                path: size if size is not None else _tree_size(path)
+                for _, size, path in remaining
+            }
+            total = sum(sizes.values())
+            for _, _, path in remaining:
+                if total <= self.quota_gb * 1024**3:
+                    break
+                total -= sizes[path]
+                removed.append(path)
+        for path in removed:
+            self.logger.info(f"Removing work directory {path}")
+            get_reaper().schedule(path)
+        return removed
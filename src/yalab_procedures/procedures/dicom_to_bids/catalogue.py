@@ -0,0 +1,537 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import pydicom
+from heudiconv.utils import SeqInfo
+from pydicom.tag import Tag
+
+# environment variable pointing heuristics at the catalogue, see grouping()
+CATALOGUE_ENVIRONMENT_VARIABLE = "YALAB_DICOM_CATALOGUE"
+
+# the only tags the catalogue reads from each header
+HEADER_TAGS = [
+    "SOPClassUID",
+    "SeriesNumber",
+    "ProtocolName",
+    "SeriesDescription",
+    "ImageType",
+    "StudyInstanceUID",
+    "SeriesInstanceUID",
+    "PatientID",
+    "StudyDescription",
+    "ReferringPhysicianName",
+    "AccessionNumber",
+    "PatientAge",
+    "PatientSex",
+    "AcquisitionDate",
+    "AcquisitionTime",
+    "AcquisitionDateTime",
+    "RepetitionTime",
+    "EchoTime",
+    "EchoNumbers",
+    "Rows",
+    "Columns",
+    "NumberOfFrames",
+]
+# sequence names of GE/Philips, Siemens and Siemens XA scanners
+SEQUENCE_NAME_TAGS = [Tag(0x0018, 0x0024), Tag(0x0019, 0x109C), Tag(0x0018, 0x9005)]
+MOSAIC_IMAGES_TAG = Tag(0x0019, 0x100A)
+# SOP classes heudiconv does not convert
+IGNORED_SOP_CLASSES = (
+    "1.2.840.10008.5.1.4.1.1.66",  # Raw Data Storage
+    "1.2.840.10008.5.1.4.1.1.11.1",  # Grayscale Softcopy Presentation State
+)
+
+CHUNK_SIZE = 256
+
+# bumped whenever the headers table changes, which then is read again
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS headers (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    series_number INTEGER,
+    protocol_name TEXT,
+    series_uid TEXT,
+    image_type TEXT,
+    echo_number INTEGER,
+    study_uid TEXT,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS headers_series
+    ON headers (series_number, protocol_name, series_uid, image_type, echo_number);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirectories TEXT NOT NULL,
+    files TEXT NOT NULL
+);
+"""
+
+
+class DirectoryListing(NamedTuple):
+    """
+    The DICOM files and subdirectories of a directory, as of its mtime.
+    """
+
+    mtime_ns: int
+    subdirectories: List[str]
+    files: List[str]
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    return str(value)
+
+
+def _int(value) -> Optional[int]:
+    if isinstance(value, bytes):
+        # private tags of implicit VR files are not decoded (US)
+        return int.from_bytes(value[:2], "little") if value else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def read_header(path: str) -> Optional[dict]:
+    """
+    Read the fields the catalogue needs from the header of a DICOM file.
+
+    Only the tags in ``HEADER_TAGS`` (and the sequence name and mosaic size
+    private tags) are parsed, and the pixel data is never read.
+
+    Parameters
+    ----------
+    path : str
+        The DICOM file.
+
+    Returns
+    -------
+    Optional[dict]
+        The header fields, or None if the file is not a DICOM heudiconv
+        would convert (unreadable, no series number, raw data, ...).
+    """
+    try:
+        dcm = pydicom.dcmread(
+            path,
+            stop_before_pixels=True,
+            force=True,
+            specific_tags=HEADER_TAGS + SEQUENCE_NAME_TAGS + [MOSAIC_IMAGES_TAG],
+        )
+    except Exception:
+        return None
+    series_number = _int(dcm.get("SeriesNumber"))
+    if series_number is None or str(dcm.get("SOPClassUID", "")) in IGNORED_SOP_CLASSES:
+        return None
+    sequence_name = ""
+    for tag in SEQUENCE_NAME_TAGS:
+        element = dcm.get(tag)
+        if element is not None and element.value:
+            sequence_name = element.value
+            if isinstance(sequence_name, bytes):
+                sequence_name = sequence_name.decode(errors="ignore")
+            sequence_name = str(sequence_name).strip("\x00 ")
+            break
+    image_type = dcm.get("ImageType") or ()
+    if isinstance(image_type, str):
+        image_type = [image_type]
+    date, time = dcm.get("AcquisitionDate"), dcm.get("AcquisitionTime")
+    if not (date and time) and dcm.get("AcquisitionDateTime"):
+        acquisition = str(dcm.get("AcquisitionDateTime"))
+        date, time = acquisition[:8], acquisition[8:] or None
+    mosaic_element = dcm.get(MOSAIC_IMAGES_TAG)
+    return {
+        "series_number": series_number,
+        "protocol_name": str(dcm.get("ProtocolName", "") or ""),
+        "series_description": str(dcm.get("SeriesDescription", "") or ""),
+        "image_type": [str(value) for value in image_type],
+        "sequence_name": sequence_name,
+        "study_uid": _text(dcm.get("StudyInstanceUID")),
+        "series_uid": _text(dcm.get("SeriesInstanceUID")),
+        "patient_id": _text(dcm.get("PatientID")),
+        "study_description": _text(dcm.get("StudyDescription")),
+        "referring_physician_name": str(dcm.get("ReferringPhysicianName", "") or ""),
+        "accession_number": _text(dcm.get("AccessionNumber")),
+        "patient_age": _text(dcm.get("PatientAge")),
+        "patient_sex": _text(dcm.get("PatientSex")),
+        "date": _text(date) if date else None,
+        "time": _text(time) if time else None,
+        "repetition_time": _float(dcm.get("RepetitionTime"), -1000.0),
+        "echo_time": _float(dcm.get("EchoTime"), -1.0),
+        "echo_number": _int(dcm.get("EchoNumbers")),
+        "rows": _int(dcm.get("Rows")),
+        "columns": _int(dcm.get("Columns")),
+        "frames": _int(dcm.get("NumberOfFrames")),
+        "mosaic_images": _int(mosaic_element.value) if mosaic_element else None,
+    }
+
+
+def _read_headers(paths: Sequence[str]) -> List[Tuple[str, Optional[dict]]]:
+    return [(path, read_header(path)) for path in paths]
+
+
+def _series_key(header: dict) -> Tuple[int, str, Optional[str], str, Optional[int]]:
+    """
+    The fields telling series apart: heudiconv's series number and protocol
+    name, and the series UID, image type and echo number nibabel compares
+    to tell whether files belong to the same series.
+    """
+    return (
+        header["series_number"],
+        header["protocol_name"],
+        header["series_uid"],
+        "\\".join(header["image_type"]),
+        header.get("echo_number"),
+    )
+
+
+def _image_shape(header: dict) -> Optional[Tuple[int, ...]]:
+    """
+    The shape of one file's image, as nibabel's DICOM wrappers report it.
+    """
+    rows, columns = header["rows"], header["columns"]
+    if rows is None or columns is None:
+        if header["series_description"] == "PhoenixZIPReport":
+            return (0, 0, 0)
+        return None
+    mosaic_images = header["mosaic_images"]
+    if "MOSAIC" in header["image_type"] and mosaic_images:
+        tiles = math.ceil(math.sqrt(mosaic_images))
+        return (rows // tiles, columns // tiles, mosaic_images)
+    if header["frames"] and header["frames"] > 1:
+        return (rows, columns, header["frames"])
+    return (rows, columns)
+
+
+def _seqinfo(
+    header: dict, series_files: List[str], series_id: str, total_files: int
+) -> SeqInfo:
+    """
+    Build heudiconv's description of a series from the header of its first file.
+    """
+    size = list(_image_shape(header)) + [len(series_files)]
+    if len(size) < 4:
+        size.append(1)
+    image_type = tuple(header["image_type"])
+    return SeqInfo(
+        total_files_till_now=total_files,
+        example_dcm_file=os.path.basename(series_files[0]),
+        series_id=series_id,
+        dcm_dir_name=os.path.basename(os.path.dirname(series_files[0])),
+        series_files=len(series_files),
+        unspecified="",
+        dim1=size[0],
+        dim2=size[1],
+        dim3=size[2],
+        dim4=size[3],
+        TR=header["repetition_time"] / 1000,
+        TE=header["echo_time"],
+        protocol_name=header["protocol_name"],
+        is_motion_corrected="MOCO" in image_type,
+        is_derived="derived" in [value.lower() for value in image_type],
+        patient_id=header["patient_id"],
+        study_description=header["study_description"],
+        referring_physician_name=header["referring_physician_name"],
+        series_description=header["series_description"],
+        sequence_name=header["sequence_name"],
+        image_type=image_type,
+        accession_number=header["accession_number"],
+        patient_age=header["patient_age"],
+        patient_sex=header["patient_sex"],
+        date=header["date"],
+        series_uid=header["series_uid"],
+        time=header["time"],
+        custom=None,
+    )
+
+
+class DicomCatalogue:
+    """
+    A local SQLite catalogue of DICOM headers.
+
+    Headers are read once, in parallel and without their pixel data, and are
+    kept keyed by file path, size and modification time: updating the
+    catalogue only reads the files that are new or changed since, so reruns
+    (e.g. after changing the heuristic) cost a ``stat`` per file instead of a
+    header scan. The series table heudiconv gives to heuristics (its
+    ``SeqInfo`` records) is built from the catalogue with :meth:`series`.
+
+    Parameters
+    ----------
+    database : Union[str, Path]
+        The SQLite database file. Created if missing. Should be on local
+        disk, as SQLite locking is unreliable on network file systems.
+    """
+
+    def __init__(self, database: Union[str, Path]):
+        self.database = Path(database)
+        self.database.parent.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        with closing(self._connect()) as connection, connection:
+            (version,) = connection.execute("PRAGMA user_version").fetchone()
+            if version != SCHEMA_VERSION:
+                # catalogued headers lack the current fields
+                connection.execute("DROP TABLE IF EXISTS headers")
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    @staticmethod
+    def _select(connection: sqlite3.Connection, paths: Sequence[str], columns: str):
+        """
+        Select columns of the rows of some paths (through a temporary table,
+        as the catalogue may hold many more files than the ones asked for).
+        """
+        connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS wanted (path TEXT PRIMARY KEY)"
+        )
+        connection.execute("DELETE FROM wanted")
+        connection.executemany(
+            "INSERT OR IGNORE INTO wanted VALUES (?)", ((path,) for path in paths)
+        )
+        return connection.execute(
+            f"SELECT path, {columns} FROM headers JOIN wanted USING (path)"
+        )
+
+    def _stale(self, paths: Sequence[str]) -> Dict[str, Tuple[int, int]]:
+        """
+        The files whose header is not in the catalogue, or changed since it
+        was read, with their size and modification time.
+        """
+        with closing(self._connect()) as connection:
+            known = {
+                path: (size, mtime_ns)
+                for path, size, mtime_ns in self._select(
+                    connection, paths, "size, mtime_ns"
+                )
+            }
+        stale = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            if known.get(path) != key:
+                stale[path] = key
+        return stale
+
+    def update(self, files: Iterable[Union[str, Path]], workers: int = 1) -> int:
+        """
+        Read the headers of new and changed files into the catalogue.
+
+        Parameters
+        ----------
+        files : Iterable[Union[str, Path]]
+            The DICOM files.
+        workers : int, optional
+            Number of processes reading headers, by default 1.
+
+        Returns
+        -------
+        int
+            The number of headers read.
+        """
+        stale = self._stale([os.path.abspath(file) for file in files])
+        if not stale:
+            return 0
+        paths = sorted(stale)
+        chunks = [paths[i : i + CHUNK_SIZE] for i in range(0, len(paths), CHUNK_SIZE)]
+        self.logger.info(f"Reading {len(paths)} DICOM headers with {workers} workers")
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_read_headers, chunks))
+        else:
+            results = [_read_headers(chunk) for chunk in chunks]
+        rows = [
+            (
+                path,
+                *stale[path],
+                *(_series_key(header) if header else (None,) * 5),
+                header["study_uid"] if header else None,
+                json.dumps(header) if header else None,
+            )
+            for result in results
+            for path, header in result
+        ]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def headers(self, files: Iterable[Union[str, Path]]) -> Dict[str, Optional[dict]]:
+        """
+        The catalogued headers of files, in the order of ``files``.
+
+        Files that are not DICOMs heudiconv would convert map to None, and
+        files missing from the catalogue are left out.
+        """
+        paths = [os.path.abspath(file) for file in files]
+        with closing(self._connect()) as connection:
+            found = {
+                path: json.loads(header) if header else None
+                for path, header in self._select(connection, paths, "header")
+            }
+        return {path: found[path] for path in paths if path in found}
+
+    def directories(self, root: Union[str, Path]) -> Dict[str, DirectoryListing]:
+        """
+        The cached listings of a directory and its subdirectories, see
+        :func:`~yalab_procedures.procedures.dicom_to_bids.discovery.find_dicoms`.
+        """
+        root = os.path.abspath(root)
+        prefix = root.rstrip(os.sep) + os.sep
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT path, mtime_ns, subdirectories, files FROM directories "
+                "WHERE path = ? OR substr(path, 1, ?) = ?",
+                (root, len(prefix), prefix),
+            )
+            return {
+                path: DirectoryListing(mtime_ns, json.loads(subdirs), json.loads(files))
+                for path, mtime_ns, subdirs, files in rows
+            }
+
+    def listed_files(self, files: Iterable[Union[str, Path]]) -> Optional[List[str]]:
+        """
+        The files the cached directory listings record as DICOMs (see
+        :func:`~yalab_procedures.procedures.dicom_to_bids.discovery.find_dicoms`),
+        in the order of ``files``.
+
+        Returns
+        -------
+        Optional[List[str]]
+            The listed files (absolute paths), or None if none of their
+            directories was listed.
+        """
+        paths = [os.path.abspath(file) for file in files]
+        if not paths:
+            return []
+        parents = {os.path.dirname(path) for path in paths}
+        listings = self.directories(os.path.commonpath(list(parents)))
+        if not parents & listings.keys():
+            return None
+        listed = {file for listing in listings.values() for file in listing.files}
+        return [path for path in paths if path in listed]
+
+    def save_directories(self, listings: Dict[str, DirectoryListing]):
+        """
+        Cache directory listings.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        path,
+                        listing.mtime_ns,
+                        json.dumps(listing.subdirectories),
+                        json.dumps(listing.files),
+                    )
+                    for path, listing in listings.items()
+                ),
+            )
+
+    def series(self, files: Iterable[Union[str, Path]]) -> Dict[SeqInfo, List[str]]:
+        """
+        Group files into series the way heudiconv does (by series number and
+        protocol name) and describe each series.
+
+        Files sharing a series number and protocol name but not their series
+        UID, image type or echo number (e.g. the magnitude and phase images
+        of a fieldmap) are different series: their IDs get a ``-<n>`` suffix
+        (in the order of their first file) instead of being merged into one.
+
+        Parameters
+        ----------
+        files : Iterable[Union[str, Path]]
+            The DICOM files, which should already be catalogued.
+
+        Returns
+        -------
+        Dict[SeqInfo, List[str]]
+            The files of each series, keyed by the series' description and
+            ordered by series number.
+        """
+        groups: Dict[tuple, List[str]] = {}
+        first_headers = {}
+        for path, header in self.headers(files).items():
+            if header is None:
+                continue
+            key = _series_key(header)
+            groups.setdefault(key, []).append(path)
+            first_headers.setdefault(key, header)
+        # the series of each (series number, protocol name), in order
+        series_keys: Dict[Tuple[int, str], List[tuple]] = {}
+        for key in groups:
+            series_keys.setdefault(key[:2], []).append(key)
+        series = {}
+        total_files = 0
+        for number, protocol in sorted(series_keys):
+            keys = series_keys[(number, protocol)]
+            for index, key in enumerate(keys, 1):
+                header = first_headers[key]
+                if _image_shape(header) is None:
+                    # no image data (e.g. physiological logs)
+                    continue
+                series_id = f"{number}-{protocol}"
+                if len(keys) > 1:
+                    series_id = f"{series_id}-{index}"
+                total_files += len(groups[key])
+                seqinfo = _seqinfo(header, groups[key], series_id, total_files)
+                series[seqinfo] = groups[key]
+        return series
+
+
+def grouping(
+    files: List[str], dcmfilter=None, seqinfo_class=None
+) -> Dict[str, Dict[SeqInfo, List[str]]]:
+    """
+    heudiconv's custom grouping, read from the catalogue set in the
+    ``YALAB_DICOM_CATALOGUE`` environment variable instead of the headers.
+
+    Heuristics opt in by exposing it as their ``grouping`` function, which
+    heudiconv uses when run with ``-g custom``. The files are grouped as with
+    ``-g all``. DICOM filters (``filter_dicom``) are not supported.
+
+    heudiconv walks the input directory itself, so its files are restricted
+    to the DICOMs the catalogue's directory listings recorded (as found by
+    ``find_dicoms``), so that heudiconv converts the same files as the series
+    conversion.
+    """
+    database = os.environ.get(CATALOGUE_ENVIRONMENT_VARIABLE)
+    if not database:
+        raise RuntimeError(
+            f"{CATALOGUE_ENVIRONMENT_VARIABLE} is not set, cannot group DICOMs from the catalogue"  # noqa: E501
+        )
+    catalogue = DicomCatalogue(database)
+    listed = catalogue.listed_files(files)
+    if listed is not None:
+        files = listed
+    # no-op (a stat per file) if the procedure already indexed the session
+    catalogue.update(files)
+    return {"all": catalogue.series(files)}
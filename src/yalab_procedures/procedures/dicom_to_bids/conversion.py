@@ -0,0 +1,317 @@
+import csv
+import importlib.util
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from heudiconv import convert as heudiconv_convert
+from heudiconv.bids import add_rows_to_scans_keys_file, sanitize_label
+from heudiconv.utils import save_json, write_config
+
+from yalab_procedures.procedures.base.reaper import get_reaper
+from yalab_procedures.procedures.dicom_to_bids.catalogue import DicomCatalogue
+
+# staging area of the conversions, inside the output directory so the
+# converted files can be moved into place atomically
+STAGING_DIRECTORY = Path(".heudiconv") / "staging"
+SCANS_SUFFIX = "_scans.tsv"
+
+Item = Tuple[str, Tuple[str, ...], List[str]]
+
+
+def load_heuristic(heuristic_file: Union[str, Path]):
+    """
+    Load a heuristic file as a module.
+
+    Unlike heudiconv's loader, the module is not cached in ``sys.modules``, so
+    heuristics with the same file name (and edited heuristics) do not shadow
+    each other in long-running processes.
+    """
+    heuristic_file = os.path.realpath(heuristic_file)
+    spec = importlib.util.spec_from_file_location("heuristic", heuristic_file)
+    heuristic = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(heuristic)
+    heuristic.filename = heuristic_file
+    return heuristic
+
+
+@dataclass
+class ConversionSession:
+    """
+    A subject/session to convert.
+
+    Attributes
+    ----------
+    subject : str
+        The subject ID.
+    session : Optional[str]
+        The session ID.
+    files : List[str]
+        The session's DICOM files.
+    items : List[Item]
+        The series to convert (heudiconv's conversion items), filled by
+        :func:`convert_sessions`.
+    """
+
+    subject: str
+    session: Optional[str]
+    files: List[str]
+    items: List[Item] = field(default_factory=list, repr=False)
+
+    def __post_init__(self):
+        self.subject = sanitize_label(self.subject)
+        if self.session:
+            self.session = sanitize_label(self.session)
+
+    @property
+    def name(self) -> str:
+        return f"sub-{self.subject}" + (f"_ses-{self.session}" if self.session else "")
+
+
+def _convert_item(
+    item: Item,
+    staging_directory: str,
+    output_directory: str,
+    bids_options: Optional[str],
+    scaninfo_suffix: str,
+    min_meta: bool,
+) -> str:
+    """
+    Convert a single series into a staging directory with heudiconv's
+    converter (dcm2niix).
+
+    Returns
+    -------
+    str
+        The staging directory, mirroring the layout of the output directory.
+    """
+    prefix, outtypes, dicoms = item
+    staged_prefix = os.path.join(
+        staging_directory, os.path.relpath(prefix, output_directory)
+    )
+    heudiconv_convert.convert(
+        [(staged_prefix, outtypes, dicoms)],
+        converter="dcm2niix",
+        scaninfo_suffix=scaninfo_suffix,
+        custom_callable=None,
+        with_prov=False,
+        bids_options=bids_options,
+        outdir=staging_directory,
+        min_meta=min_meta,
+        overwrite=True,
+    )
+    return staging_directory
+
+
+def _run_jobs(jobs: List[tuple], workers: int) -> Iterator[tuple]:
+    """
+    Run conversion jobs, in a pool of processes if ``workers`` > 1 (heudiconv
+    and nipype are not thread-safe), yielding their result or error in order.
+    """
+    if workers <= 1:
+        for job in jobs:
+            try:
+                yield job, _convert_item(*job), None
+            except Exception as e:
+                yield job, None, e
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(job, executor.submit(_convert_item, *job)) for job in jobs]
+        for job, future in futures:
+            try:
+                yield job, future.result(), None
+            except Exception as e:
+                yield job, None, e
+
+
+def _read_scans(path: Path) -> Dict[str, List[str]]:
+    with open(path) as scans:
+        rows = list(csv.reader(scans, delimiter="\t"))
+    return {row[0]: row[1:] for row in rows[1:]}
+
+
+def _assemble(staging_directory: Path, output_directory: Path) -> List[Path]:
+    """
+    Move the converted files of a series from its staging directory into the
+    output directory, and add its rows to the session's scans.tsv.
+
+    Every file is moved with an atomic rename, and the scans.tsv is rewritten
+    to a temporary file that replaces it, so readers never see partial files.
+
+    Returns
+    -------
+    List[Path]
+        The files moved into the output directory.
+    """
+    moved = []
+    for path in sorted(staging_directory.rglob("*")):
+        if not path.is_file():
+            continue
+        target = output_directory / path.relative_to(staging_directory)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if path.name.endswith(SCANS_SUFFIX):
+            tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+            if target.exists():
+                shutil.copyfile(target, tmp)
+            add_rows_to_scans_keys_file(str(tmp), _read_scans(path))
+            os.replace(tmp, target)
+        else:
+            os.replace(path, target)
+        moved.append(target)
+    return moved
+
+
+def _write_info_files(
+    heuristic,
+    session: ConversionSession,
+    seqinfo: dict,
+    info: dict,
+    output_directory: Path,
+):
+    """
+    Write heudiconv's record of the conversion (.heudiconv/<subject>/...), as
+    heudiconv itself would.
+    """
+    info_directory = output_directory / ".heudiconv" / session.subject
+    if session.session:
+        info_directory = info_directory / f"ses-{session.session}"
+    info_directory = info_directory / "info"
+    info_directory.mkdir(parents=True, exist_ok=True)
+    suffix = f"_ses-{session.session}" if session.session else ""
+    shutil.copyfile(heuristic.filename, info_directory / "heuristic.py")
+    with open(info_directory / f"dicominfo{suffix}.tsv", "w") as dicominfo:
+        dicominfo.write("\t".join(next(iter(seqinfo))._fields) + "\n")
+        for series in seqinfo:
+            dicominfo.write("\t".join(str(value) for value in series) + "\n")
+    for kind in ("auto", "edit"):
+        write_config(
+            str(info_directory / f"{session.subject}{suffix}.{kind}.txt"), info
+        )
+    save_json(
+        str(info_directory / f"filegroup{suffix}.json"),
+        {series.series_id: files for series, files in seqinfo.items()},
+    )
+
+
+def convert_sessions(
+    sessions: Sequence[ConversionSession],
+    output_directory: Union[str, Path],
+    heuristic_file: Union[str, Path],
+    catalogue: DicomCatalogue,
+    workers: int = 1,
+    bids_options: Optional[str] = "notop",
+    min_meta: bool = False,
+    logger: Optional[logging.Logger] = None,
+) -> Dict[str, List[Path]]:
+    """
+    Convert sessions to BIDS, one dcm2niix job per series.
+
+    Every session is classified with the heuristic from the header
+    catalogue, and its series are converted by heudiconv's converter in a
+    pool of processes shared by all the sessions, so ``workers`` bounds the
+    number of conversions running at the same time across the archive.
+    Each series is converted into a staging directory and moved into the
+    output directory when it succeeds (see :func:`_assemble`).
+
+    Parameters
+    ----------
+    sessions : Sequence[ConversionSession]
+        The sessions to convert.
+    output_directory : Union[str, Path]
+        The BIDS directory.
+    heuristic_file : Union[str, Path]
+        The heudiconv heuristic.
+    catalogue : DicomCatalogue
+        The header catalogue (updated with the sessions' files).
+    workers : int, optional
+        Number of series converted at the same time, by default 1.
+    bids_options : Optional[str], optional
+        heudiconv's ``--bids`` options, by default "notop".
+    min_meta : bool, optional
+        Whether to skip embedding the DICOM metadata in the NIfTI files,
+        by default False.
+    logger : Optional[logging.Logger], optional
+        The logger.
+
+    Returns
+    -------
+    Dict[str, List[Path]]
+        The converted files of every session.
+
+    Raises
+    ------
+    RuntimeError
+        If some series failed to convert (after the others are assembled).
+    """
+    logger = logger or logging.getLogger(__name__)
+    output_directory = Path(output_directory).absolute()
+    heuristic = load_heuristic(str(heuristic_file))
+    scaninfo_suffix = getattr(heuristic, "scaninfo_suffix", ".json")
+    staging_root = output_directory / STAGING_DIRECTORY / str(os.getpid())
+    for session in sessions:
+        catalogue.update(session.files, workers=workers)
+        seqinfo = catalogue.series(session.files)
+        if not seqinfo:
+            logger.warning(f"No series to convert for {session.name}")
+            continue
+        info = heuristic.infotodict(list(seqinfo))
+        _write_info_files(heuristic, session, seqinfo, info, output_directory)
+        session.items = heudiconv_convert.conversion_info(
+            session.subject,
+            str(output_directory),
+            info,
+            {series.series_id: files for series, files in seqinfo.items()},
+            session.session,
+        )
+        logger.info(f"Converting {len(session.items)} series of {session.name}")
+
+    jobs = []
+    sessions_of_items = {}
+    for session in sessions:
+        for index, item in enumerate(session.items):
+            staging_directory = staging_root / session.name / str(index)
+            jobs.append(
+                (
+                    item,
+                    str(staging_directory),
+                    str(output_directory),
+                    bids_options,
+                    scaninfo_suffix,
+                    min_meta,
+                )
+            )
+            sessions_of_items[item[0]] = session.name
+    outputs: Dict[str, List[Path]] = {session.name: [] for session in sessions}
+    failures = []
+    custom_callable = getattr(heuristic, "custom_callable", None)
+    # assembled in submission order, so scans.tsv rows are added in order
+    for job, staging_directory, error in _run_jobs(jobs, workers):
+        item = job[0]
+        if error is not None:
+            logger.error(f"Failed to convert {item[0]}: {error}")
+            failures.append(item[0])
+            continue
+        outputs[sessions_of_items[item[0]]] += _assemble(
+            Path(staging_directory), output_directory
+        )
+        if custom_callable is not None:
+            custom_callable(*item)
+    get_reaper().schedule(staging_root)
+
+    populate_intended_for_opts = getattr(heuristic, "POPULATE_INTENDED_FOR_OPTS", None)
+    if populate_intended_for_opts is not None:
+        from heudiconv.bids import populate_intended_for
+
+        for session in sessions:
+            session_path = output_directory / f"sub-{session.subject}"
+            if session.session:
+                session_path = session_path / f"ses-{session.session}"
+            if session_path.exists():
+                populate_intended_for(str(session_path), **populate_intended_for_opts)
+    if failures:
+        raise RuntimeError(f"Failed to convert {len(failures)} series: {failures}")
+    return outputs
@@ -1,9 +1,10 @@
 # src/yalab_procedures/procedures/dicom_to_bids.py
 
+import os
 import shlex
 from pathlib import Path
-from subprocess import CalledProcessError, run
-from tempfile import TemporaryDirectory
+from subprocess import CalledProcessError
+from typing import Optional
 
 from nipype.interfaces.base import (
     CommandLine,
@@ -19,11 +20,23 @@ from yalab_procedures.procedures.base.procedure import (
     ProcedureInputSpec,
     ProcedureOutputSpec,
 )
+from yalab_procedures.procedures.base.runner import run_command
+from yalab_procedures.procedures.dicom_to_bids.catalogue import (
+    CATALOGUE_ENVIRONMENT_VARIABLE,
+    DicomCatalogue,
+)
+from yalab_procedures.procedures.dicom_to_bids.conversion import (
+    ConversionSession,
+    convert_sessions,
+    load_heuristic,
+)
+from yalab_procedures.procedures.dicom_to_bids.discovery import find_dicoms
 from yalab_procedures.procedures.dicom_to_bids.templates.post_heudiconv import (
-    create_pa_epi_workflow,
+    make_pa_epi,
 )
 
 DEFAULT_HEURISTIC = Path(__file__).parent / "templates" / "heuristic.py"
+DEFAULT_CATALOGUE_NAME = ".dicom_catalogue.sqlite"
 
 
 class DicomToBidsInputSpec(ProcedureInputSpec, CommandLineInputSpec):
@@ -34,7 +47,7 @@ class DicomToBidsInputSpec(ProcedureInputSpec, CommandLineInputSpec):
     subject_id = traits.Str(argstr="-s %s", mandatory=True, desc="Subject ID")
     session_id = traits.Str(argstr="-ss %s", desc="Session ID")
     heuristic_file = File(
-        DEFAULT_HEURISTIC,
+        str(DEFAULT_HEURISTIC),
         exists=True,
         mandatory=False,
         argstr="-f %s",
@@ -44,8 +57,8 @@ class DicomToBidsInputSpec(ProcedureInputSpec, CommandLineInputSpec):
     input_directory = Directory(
         exists=True,
         mandatory=True,
-        argstr="--files '%s'/*/*.dcm",
-        desc="Input directory containing DICOM files",
+        argstr="--files '%s'",
+        desc="Input directory containing DICOM files (at any depth)",
     )
     output_directory = Directory(
         exists=True,
@@ -84,6 +97,32 @@ class DicomToBidsInputSpec(ProcedureInputSpec, CommandLineInputSpec):
         usedefault=True,
         desc="Infer session ID from DICOM directory name",
     )
+    index_headers = traits.Bool(
+        True,
+        usedefault=True,
+        desc="Read the DICOM headers into a catalogue once, so heudiconv (and reruns) group the series from it instead of scanning the headers again",  # noqa: E501
+    )
+    dicom_catalogue = File(
+        desc="SQLite catalogue of DICOM headers (by default in the output directory)",  # noqa: E501
+    )
+    gzip_level = traits.Range(
+        low=1,
+        high=9,
+        value=1,
+        usedefault=True,
+        desc="gzip compression level of the fieldmaps written after the conversion",  # noqa: E501
+    )
+    conversion_mode = traits.Enum(
+        "heudiconv",
+        "series",
+        usedefault=True,
+        desc="Run heudiconv on the whole session, or convert every series in its own (parallel) dcm2niix job",  # noqa: E501
+    )
+    nprocs = traits.Int(
+        os.cpu_count(),
+        usedefault=True,
+        desc="Number of processes reading DICOM headers (and converting series) in parallel",  # noqa: E501
+    )
 
 
 class DicomToBidsOutputSpec(ProcedureOutputSpec):
@@ -108,7 +147,7 @@ class DicomToBidsProcedure(Procedure, CommandLine):
     >>> dcm2bids.inputs.session_id = '01'
     >>> dcm2bids.inputs.heuristic_file = '/path/to/heuristic.py'
     >>> dcm2bids.inputs.cmdline
-    'heudiconv -s 01 -ss 01 -f /path/to/heuristic.py --files /path/to/dicom/*/*.dcm -o /path/to/bids -c dcm2niix --overwrite --bids'
+    'heudiconv -s 01 -ss 01 -f /path/to/heuristic.py --files '/path/to/dicom' -o /path/to/bids -c dcm2niix --overwrite --bids'
     >>> res = dcmtobids.run() # doctest: +SKIP
 
     """
@@ -117,9 +156,14 @@ class DicomToBidsProcedure(Procedure, CommandLine):
     input_spec = DicomToBidsInputSpec
     output_spec = DicomToBidsOutputSpec
     _version = "0.0.1"
+    _fingerprint_exclude = Procedure._fingerprint_exclude + ("index_headers",)
+    _fingerprint_path_exclude = Procedure._fingerprint_path_exclude + (
+        "dicom_catalogue",
+    )
 
     def __init__(self, **inputs):
         super(DicomToBidsProcedure, self).__init__(**inputs)
+        self._catalogue = None
 
     def run_procedure(self, **kwargs):
         """
@@ -136,42 +180,165 @@ class DicomToBidsProcedure(Procedure, CommandLine):
         # self.standardize_input_directory()
         self.logger.debug(f"Input attributes: {kwargs}")
 
+        with self._timed_stage("indexing"):
+            self._catalogue = self.index_headers()
+        if self.inputs.conversion_mode == "series":
+            with self._timed_stage("execution"):
+                self.convert_series()
+            with self._timed_stage("fieldmap_correction"):
+                self.post_heudiconv_fieldmap_correction()
+            self.logger.info("Finished running DicomToBidsProcedure")
+            return
         # Run the heudiconv command
         command = self.build_commandline()
-        result = run(
-            command,
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        self.post_heudiconv_fieldmap_correction()
-        self.logger.info(result.stdout)
+        environment = os.environ.copy()
+        if self._catalogue is not None:
+            environment[CATALOGUE_ENVIRONMENT_VARIABLE] = str(self._catalogue.database)
+        with self._timed_stage("execution"):
+            result = run_command(command, self.logger, check=False, env=environment)
         if (
-            result.stderr
+            result.returncode != 0
             and "TypeError: 'NoneType' object is not iterable" not in result.stderr
         ):
-            self.logger.error(result.stderr)
-            raise CalledProcessError(
-                result.returncode, command, output=result.stdout, stderr=result.stderr
-            )
+            raise CalledProcessError(result.returncode, command, stderr=result.stderr)
+        with self._timed_stage("fieldmap_correction"):
+            self.post_heudiconv_fieldmap_correction()
         self.logger.info("Finished running DicomToBidsProcedure")
 
+    def _load_heuristic(self):
+        """
+        Load the heuristic file as a module.
+        """
+        return load_heuristic(self.inputs.heuristic_file)
+
+    def _dicom_files(self, catalogue: Optional[DicomCatalogue] = None) -> list:
+        """
+        The DICOM files of the input directory, at any depth (see
+        :func:`~yalab_procedures.procedures.dicom_to_bids.discovery.find_dicoms`).
+        """
+        files = find_dicoms(
+            self.inputs.input_directory,
+            workers=self.inputs.nprocs or 1,
+            catalogue=catalogue,
+        )
+        self.logger.debug(
+            f"Found {len(files)} DICOM files in {self.inputs.input_directory}"
+        )
+        return files
+
+    def _catalogue_path(self) -> Path:
+        if isdefined(self.inputs.dicom_catalogue):
+            return Path(self.inputs.dicom_catalogue)
+        return Path(self.inputs.output_directory) / DEFAULT_CATALOGUE_NAME
+
+    def _catalogue_grouping(self) -> bool:
+        """
+        Whether heudiconv can group the series from the catalogue.
+        """
+        if not self.inputs.index_headers:
+            return False
+        if self.inputs.grouping != "all":
+            self.logger.info(
+                f"Not indexing DICOM headers: not supported with {self.inputs.grouping} grouping"  # noqa: E501
+            )
+            return False
+        if not callable(getattr(self._load_heuristic(), "grouping", None)):
+            self.logger.info(
+                "Not indexing DICOM headers: the heuristic does not define a grouping function"  # noqa: E501
+            )
+            return False
+        return True
+
+    def index_headers(self):
+        """
+        Read the headers of new or changed DICOM files into the catalogue.
+
+        heudiconv then groups the series from the catalogue (through the
+        heuristic's ``grouping`` function and ``-g custom``) instead of
+        reading every header again. heudiconv only uses the catalogue with
+        the default grouping ("all") and heuristics that support it, the
+        series conversion mode always does.
+
+        Returns
+        -------
+        Optional[DicomCatalogue]
+            The catalogue, or None if it is not used.
+        """
+        # the series conversion always works from the catalogue
+        if self.inputs.conversion_mode != "series" and not self._catalogue_grouping():
+            return None
+        catalogue = DicomCatalogue(self._catalogue_path())
+        files = self._dicom_files(catalogue)
+        read = catalogue.update(files, workers=self.inputs.nprocs or 1)
+        self.logger.info(
+            f"Indexed {len(files)} DICOM files ({read} headers read) in {catalogue.database}"  # noqa: E501
+        )
+        return catalogue
+
+    def convert_series(self) -> dict:
+        """
+        Convert the session with one dcm2niix job per series, ``nprocs`` at a
+        time (see :func:`~yalab_procedures.procedures.dicom_to_bids.conversion.convert_sessions`).
+
+        Returns
+        -------
+        dict
+            The converted files of the session.
+        """
+        session = ConversionSession(
+            self.inputs.subject_id,
+            self.inputs.session_id if isdefined(self.inputs.session_id) else None,
+            self._dicom_files(self._catalogue),
+        )
+        return convert_sessions(
+            [session],
+            self.inputs.output_directory,
+            self.inputs.heuristic_file,
+            self._catalogue,
+            workers=self.inputs.nprocs or 1,
+            bids_options=self.inputs.bids,
+            logger=self.logger,
+        )
+
+    def classify_series(self) -> tuple:
+        """
+        Classify the session's series with the heuristic, from the header
+        catalogue and without running heudiconv (e.g. to audit a heuristic).
+
+        Returns
+        -------
+        tuple
+            The heuristic's info dict and the series it left unmatched (empty
+            for heuristics without a ``classify`` function).
+        """
+        catalogue = self._catalogue or self.index_headers()
+        if catalogue is None:
+            raise RuntimeError("Classifying series requires the DICOM header catalogue")
+        heuristic = self._load_heuristic()
+        seqinfos = list(catalogue.series(self._dicom_files(catalogue)))
+        if callable(getattr(heuristic, "classify", None)):
+            return heuristic.classify(seqinfos)
+        return heuristic.infotodict(seqinfos), []
+
+    def _format_arg(self, name, spec, value):
+        if name == "grouping" and self._catalogue is not None:
+            # let the heuristic group the series from the catalogue
+            return spec.argstr % "custom"
+        return super()._format_arg(name, spec, value)
+
     def post_heudiconv_fieldmap_correction(self):
         """
         Post-process fieldmap correction if needed
         """
-        with TemporaryDirectory() as tmpdir:
-            wf = create_pa_epi_workflow(
-                name="post_heudiconv_fieldmap_correction",
-                bids_dir=str(self.inputs.output_directory),
-                subject_id=self.inputs.subject_id,
-                session_id=(
-                    self.inputs.session_id if isdefined(self.inputs.session_id) else ""
-                ),
-            )
-            wf.base_dir = tmpdir
-            wf.run()
+        make_pa_epi(
+            bids_dir=str(self.inputs.output_directory),
+            subject_id=self.inputs.subject_id,
+            session_id=(
+                self.inputs.session_id if isdefined(self.inputs.session_id) else ""
+            ),
+            compresslevel=self.inputs.gzip_level,
+            threads=self.inputs.nprocs or 1,
+        )
 
     def infer_session_id(self):
         """
@@ -0,0 +1,109 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from yalab_procedures.procedures.dicom_to_bids.catalogue import (
+    DicomCatalogue,
+    DirectoryListing,
+)
+
+DICOM_EXTENSIONS = (".dcm", ".ima")
+DICOM_MAGIC = b"DICM"
+PREAMBLE_LENGTH = 128
+
+
+def is_dicom(path: Union[str, Path]) -> bool:
+    """
+    Whether a file is a DICOM file: by its extension, or for other files by
+    the "DICM" prefix following the 128 bytes preamble.
+    """
+    if str(path).lower().endswith(DICOM_EXTENSIONS):
+        return True
+    try:
+        with open(path, "rb") as f:
+            header = f.read(PREAMBLE_LENGTH + len(DICOM_MAGIC))
+    except OSError:
+        return False
+    return header[PREAMBLE_LENGTH:] == DICOM_MAGIC
+
+
+def _list_directory(
+    path: str, cached: Optional[DirectoryListing]
+) -> Optional[DirectoryListing]:
+    """
+    List the DICOM files and subdirectories of a directory, unless its cached
+    listing is still current. Hidden entries are skipped.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    if cached is not None and cached.mtime_ns == mtime_ns:
+        return cached
+    subdirectories, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif entry.is_file() and is_dicom(entry.path):
+                files.append(entry.path)
+    return DirectoryListing(mtime_ns, sorted(subdirectories), sorted(files))
+
+
+def find_dicoms(
+    root: Union[str, Path],
+    workers: int = 8,
+    catalogue: Optional[DicomCatalogue] = None,
+) -> List[str]:
+    """
+    Find the DICOM files below a directory, at any depth.
+
+    Directories are listed concurrently with ``os.scandir``, which keeps
+    many requests in flight on network storage. With a catalogue, the
+    listings are cached: a directory whose mtime did not change since (no
+    file was added, removed or renamed in it) is not listed again.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        The directory to search.
+    workers : int, optional
+        Number of directories listed at the same time, by default 8.
+    catalogue : Optional[DicomCatalogue], optional
+        The catalogue caching the listings, by default None.
+
+    Returns
+    -------
+    List[str]
+        The DICOM files (absolute paths), sorted.
+    """
+    root = os.path.abspath(root)
+    cached = catalogue.directories(root) if catalogue is not None else {}
+    listings: Dict[str, DirectoryListing] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = {executor.submit(_list_directory, root, cached.get(root)): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                listing = future.result()
+                if listing is None:
+                    continue
+                listings[path] = listing
+                for subdirectory in listing.subdirectories:
+                    future = executor.submit(
+                        _list_directory, subdirectory, cached.get(subdirectory)
+                    )
+                    pending[future] = subdirectory
+    if catalogue is not None:
+        catalogue.save_directories(
+            {
+                path: listing
+                for path, listing in listings.items()
+                if cached.get(path) != listing
+            }
+        )
+    return sorted(file for listing in listings.values() for file in listing.files)
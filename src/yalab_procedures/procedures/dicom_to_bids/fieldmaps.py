@@ -0,0 +1,214 @@
+import csv
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+from yalab_procedures.procedures.dicom_to_bids.templates.post_heudiconv import (
+    make_pa_epi,
+)
+
+# where the summary is written by default (hidden from BIDS validators)
+SUMMARY_FILE = Path(".heudiconv") / "fieldmaps.tsv"
+
+CREATED = "created"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+class FieldmapStatus(NamedTuple):
+    """
+    The outcome of the fieldmap of a session.
+
+    Attributes
+    ----------
+    subject : str
+        The subject ID.
+    session : str
+        The session ID ("" for subjects without sessions).
+    status : str
+        "created", "skipped" or "failed".
+    reason : str
+        Why the fieldmap was skipped or failed (its path if created).
+    """
+
+    subject: str
+    session: str
+    status: str
+    reason: str
+
+
+def _sessions(bids_dir: Path) -> List[Tuple[str, str, Path]]:
+    """
+    The (subject, session, directory) of every session of a BIDS dataset,
+    with an empty session for subjects without sessions.
+    """
+    sessions = []
+    for subject_dir in sorted(bids_dir.glob("sub-*")):
+        if not subject_dir.is_dir():
+            continue
+        subject = subject_dir.name[len("sub-") :]
+        session_dirs = sorted(p for p in subject_dir.glob("ses-*") if p.is_dir())
+        if not session_dirs:
+            sessions.append((subject, "", subject_dir))
+        for session_dir in session_dirs:
+            sessions.append((subject, session_dir.name[len("ses-") :], session_dir))
+    return sessions
+
+
+def _triage(
+    subject: str, session: str, directory: Path, pe_dir: str, target_dir: str
+) -> Optional[str]:
+    """
+    Why a session's fieldmap cannot (or need not) be created, if so.
+    """
+    prefix = f"sub-{subject}_" + (f"ses-{session}_" if session else "")
+    epi = directory / "fmap" / f"{prefix}acq-dwi_dir-{pe_dir}_epi.nii.gz"
+    if epi.exists():
+        return "fieldmap exists"
+    pe_dwis = list((directory / "dwi").glob(f"{prefix}dir-{pe_dir}_*dwi.nii.gz"))
+    if len(pe_dwis) != 1:
+        return f"{len(pe_dwis)} dir-{pe_dir} DWI series (expected 1)"
+    if not any((directory / "dwi").glob(f"{prefix}dir-{target_dir}_*dwi.nii.gz")):
+        return f"no dir-{target_dir} DWI to correct"
+    return None
+
+
+def _make_fieldmap(bids_dir: str, subject: str, session: str, kwargs: dict) -> str:
+    return make_pa_epi(bids_dir, subject, session, **kwargs)["epi_nii"]
+
+
+def _run(function, job: tuple) -> Tuple[Optional[str], Optional[Exception]]:
+    try:
+        return function(*job), None
+    except Exception as e:
+        return None, e
+
+
+def _result(future) -> Tuple[Optional[str], Optional[Exception]]:
+    try:
+        return future.result(), None
+    except Exception as e:
+        return None, e
+
+
+def find_missing_fieldmaps(
+    bids_dir: Union[str, Path], pe_dir: str = "PA", target_dir: str = "AP"
+) -> Tuple[List[Tuple[str, str]], List[FieldmapStatus]]:
+    """
+    Find the sessions of a BIDS dataset that have DWI series but no
+    ``acq-dwi_dir-<pe_dir>_epi`` fieldmap.
+
+    Parameters
+    ----------
+    bids_dir : Union[str, Path]
+        The BIDS dataset.
+    pe_dir : str, optional
+        The phase encoding direction of the fieldmap, by default "PA".
+    target_dir : str, optional
+        The phase encoding direction of the DWI it corrects, by default "AP".
+
+    Returns
+    -------
+    Tuple[List[Tuple[str, str]], List[FieldmapStatus]]
+        The (subject, session) missing a fieldmap that can be created, and
+        the sessions with DWI series skipped (and why).
+    """
+    missing, skipped = [], []
+    for subject, session, directory in _sessions(Path(bids_dir)):
+        if not any((directory / "dwi").glob("*_dwi.nii.gz")):
+            continue
+        reason = _triage(subject, session, directory, pe_dir, target_dir)
+        if reason is None:
+            missing.append((subject, session))
+        else:
+            skipped.append(FieldmapStatus(subject, session, SKIPPED, reason))
+    return missing, skipped
+
+
+def backfill_fieldmaps(
+    bids_dir: Union[str, Path],
+    workers: int = 1,
+    summary_file: Optional[Union[str, Path]] = None,
+    pe_dir: str = "PA",
+    target_dir: str = "AP",
+    b0_threshold: float = 50.0,
+    allow_first_as_b0: bool = False,
+    compresslevel: int = 1,
+    logger: Optional[logging.Logger] = None,
+) -> List[FieldmapStatus]:
+    """
+    Create the missing DWI fieldmaps of a whole BIDS dataset (see
+    :func:`find_missing_fieldmaps`), ``workers`` sessions at a time, and
+    write a summary of every session with DWI series.
+
+    Parameters
+    ----------
+    bids_dir : Union[str, Path]
+        The BIDS dataset.
+    workers : int, optional
+        Number of fieldmaps created at the same time, by default 1.
+    summary_file : Optional[Union[str, Path]], optional
+        The summary table (tab-separated), by default
+        ``<bids_dir>/.heudiconv/fieldmaps.tsv``.
+    pe_dir : str, optional
+        The phase encoding direction of the fieldmaps, by default "PA".
+    target_dir : str, optional
+        The phase encoding direction of the DWI they correct, by default
+        "AP".
+    b0_threshold : float, optional
+        The highest b-value of b0 volumes, by default 50.0.
+    allow_first_as_b0 : bool, optional
+        Whether to use the first volume of series without b0s, by default
+        False.
+    compresslevel : int, optional
+        The gzip level of the fieldmaps, by default 1.
+    logger : Optional[logging.Logger], optional
+        The logger.
+
+    Returns
+    -------
+    List[FieldmapStatus]
+        The outcome of every session with DWI series.
+    """
+    logger = logger or logging.getLogger(__name__)
+    bids_dir = Path(bids_dir).absolute()
+    missing, statuses = find_missing_fieldmaps(bids_dir, pe_dir, target_dir)
+    logger.info(f"Creating {len(missing)} fieldmaps ({len(statuses)} sessions skipped)")
+    kwargs = dict(
+        pe_dir=pe_dir,
+        target_dir=target_dir,
+        b0_threshold=b0_threshold,
+        allow_first_as_b0=allow_first_as_b0,
+        compresslevel=compresslevel,
+    )
+    jobs = [(str(bids_dir), subject, session, kwargs) for subject, session in missing]
+    if workers <= 1:
+        results = [_run(_make_fieldmap, job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_make_fieldmap, *job) for job in jobs]
+            results = [_result(future) for future in futures]
+    for (subject, session), (epi, error) in zip(missing, results):
+        if error is None:
+            statuses.append(FieldmapStatus(subject, session, CREATED, epi))
+        else:
+            label = f"sub-{subject}" + (f"_ses-{session}" if session else "")
+            logger.error(f"Failed to create the fieldmap of {label}: {error}")
+            statuses.append(FieldmapStatus(subject, session, FAILED, str(error)))
+    statuses.sort()
+    write_summary(statuses, summary_file or bids_dir / SUMMARY_FILE)
+    return statuses
+
+
+def write_summary(statuses: List[FieldmapStatus], path: Union[str, Path]) -> Path:
+    """
+    Write the outcome of the sessions' fieldmaps as a tab-separated table.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as summary:
+        writer = csv.writer(summary, delimiter="\t", lineterminator="\n")
+        writer.writerow(FieldmapStatus._fields)
+        writer.writerows(statuses)
+    return path
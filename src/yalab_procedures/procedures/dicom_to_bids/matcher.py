@@ -0,0 +1,131 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from heudiconv.utils import SeqInfo
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    A rule of a heuristic: series whose protocol name contains one of the
+    patterns are converted with the rule's template.
+
+    Attributes
+    ----------
+    patterns : Tuple[str, ...]
+        Substrings of the protocol name. A rule without patterns never
+        matches (its templates are still part of the heuristic's keys).
+    template : str
+        The output template of the series.
+    norm_template : Optional[str]
+        The template of series whose image type includes "NORM"
+        (intensity-normalized images), by default the template.
+    sbref_template : Optional[str]
+        The template of series whose description mentions "sbref"
+        (single-band references), by default the template.
+    """
+
+    patterns: Tuple[str, ...]
+    template: str
+    norm_template: Optional[str] = None
+    sbref_template: Optional[str] = None
+
+    def templates(self) -> List[str]:
+        return [
+            template
+            for template in (self.norm_template, self.template, self.sbref_template)
+            if template is not None
+        ]
+
+    def select(self, seqinfo: SeqInfo) -> str:
+        """
+        The template of a series matched by the rule.
+        """
+        if self.norm_template is not None and "NORM" in seqinfo.image_type:
+            return self.norm_template
+        if (
+            self.sbref_template is not None
+            and "sbref" in seqinfo.series_description.lower()
+        ):
+            return self.sbref_template
+        return self.template
+
+
+class RuleMatcher:
+    """
+    Matches protocol names against an ordered table of rules, the first
+    matching rule winning (like a chain of ``if "..." in protocol_name``).
+
+    The rules are compiled once into a single regular expression: one
+    optional lookahead per rule records whether its patterns occur anywhere
+    in the protocol name, so a single match finds every matching rule.
+
+    Parameters
+    ----------
+    rules : Sequence[Rule]
+        The rules, in order of precedence.
+    """
+
+    def __init__(self, rules: Sequence[Rule]):
+        self.rules = list(rules)
+        self._groups = []
+        lookaheads = []
+        for index, rule in enumerate(self.rules):
+            if not rule.patterns:
+                continue
+            alternatives = "|".join(re.escape(pattern) for pattern in rule.patterns)
+            lookaheads.append(f"(?:(?=.*?(?:{alternatives})()))?")
+            self._groups.append(index)
+        self._expression = re.compile("".join(lookaheads), re.DOTALL)
+
+    def match(self, protocol_name: str) -> Optional[Rule]:
+        """
+        The first rule matching a protocol name, if any.
+        """
+        groups = self._expression.match(protocol_name).groups()
+        for index, group in zip(self._groups, groups):
+            if group is not None:
+                return self.rules[index]
+        return None
+
+
+def classify(
+    seqinfos: Iterable[SeqInfo], matchers: Sequence[RuleMatcher]
+) -> Tuple[Dict[str, List[str]], List[SeqInfo]]:
+    """
+    Classify series with several tables of rules.
+
+    Every table is applied independently, so a series can be matched by a
+    rule of each table.
+
+    Parameters
+    ----------
+    seqinfos : Iterable[SeqInfo]
+        The series.
+    matchers : Sequence[RuleMatcher]
+        The tables of rules.
+
+    Returns
+    -------
+    Tuple[Dict[str, List[str]], List[SeqInfo]]
+        The series IDs of every template of the rules (including empty
+        ones), and the series no rule matched.
+    """
+    info: Dict[str, List[str]] = {
+        template: []
+        for matcher in matchers
+        for rule in matcher.rules
+        for template in rule.templates()
+    }
+    unmatched = []
+    for seqinfo in seqinfos:
+        matched = False
+        for matcher in matchers:
+            rule = matcher.match(seqinfo.protocol_name)
+            if rule is not None:
+                info[rule.select(seqinfo)].append(seqinfo.series_id)
+                matched = True
+        if not matched:
+            unmatched.append(seqinfo)
+    return info, unmatched
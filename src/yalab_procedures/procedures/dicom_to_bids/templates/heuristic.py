@@ -1,9 +1,95 @@
 from __future__ import annotations
 
+import logging
 from typing import Optional
 
 from heudiconv.utils import SeqInfo
 
+from yalab_procedures.procedures.dicom_to_bids.catalogue import (
+    grouping as catalogue_grouping,
+)
+from yalab_procedures.procedures.dicom_to_bids.matcher import (
+    Rule,
+    RuleMatcher,
+)
+from yalab_procedures.procedures.dicom_to_bids.matcher import (
+    classify as classify_series,
+)
+
+lgr = logging.getLogger(__name__)
+
+
+def _template(datatype: str, suffix: str) -> str:
+    return f"{{bids_subject_session_dir}}/{datatype}/{{bids_subject_session_prefix}}_{suffix}"  # noqa: E501
+
+
+# Structural, diffusion and fieldmap series, by protocol name.
+# The first matching rule wins, so the DWI SBRef rules are shadowed by the
+# DWI rules (their protocol names contain the DWI ones).
+STRUCTURAL_RULES = [
+    Rule(
+        ("T1w_MPRAGE",),
+        _template("anat", "ce-uncorrected_T1w"),
+        norm_template=_template("anat", "ce-corrected_T1w"),
+    ),
+    Rule(
+        ("T2w_SPC",),
+        _template("anat", "ce-uncorrected_T2w"),
+        norm_template=_template("anat", "ce-corrected_T2w"),
+    ),
+    Rule(("t2_tirm_tra_dark-fluid_FLAIR",), _template("anat", "FLAIR")),
+    Rule(
+        ("dMRI_MB4_185dirs_d15D45_AP", "ep2d_d15.5D60_MB3_AP"),
+        _template("dwi", "dir-AP_dwi"),
+    ),
+    Rule(
+        ("dMRI_MB4_6dirs_d15D45_PA", "ep2d_d15.5D60_MB3_PA"),
+        _template("dwi", "dir-PA_dwi"),
+    ),
+    Rule(("dMRI_MB4_185dirs_d15D45_AP_SBRef",), _template("dwi", "dir-AP_sbref")),
+    Rule(("dMRI_MB4_6dirs_d15D45_PA_SBRef",), _template("dwi", "dir-PA_sbref")),
+    Rule(
+        ("SpinEchoFieldMap_AP", "SE_rsfMRI_FieldMap_AP"),
+        _template("fmap", "acq-func_dir-AP_epi"),
+    ),
+    Rule(
+        ("SpinEchoFieldMap_PA", "SE_rsfMRI_FieldMap_PA"),
+        _template("fmap", "acq-func_dir-PA_epi"),
+    ),
+    # not acquired (yet)
+    Rule((), _template("fmap", "acq-task_dir-AP_epi")),
+    Rule((), _template("fmap", "acq-task_dir-PA_epi")),
+]
+
+# Functional tasks: task label -> protocol name of its BOLD (and SBRef) series
+TASKS = {
+    "rest": "rsfMRI_AP",
+    "bjj1": "fMRI_BJJ1_AP",
+    "bjj2": "fMRI_BJJ2_AP",
+    "bjj3": "fMRI_BJJ3_AP",
+    "climbing1": "fMRI_Climbing1_AP",
+    "climbing2": "fMRI_Climbing2_AP",
+    "climbing3": "fMRI_Climbing3_AP",
+    "music1": "fMRI_Music1_AP",
+    "music2": "fMRI_Music2_AP",
+    "music3": "fMRI_Music3_AP",
+    "movement1": "fMRI_Music_Movement1_AP",
+    "movement2": "fMRI_Music_Movement2_AP",
+    "emotionalnback": "fMRI_EmotionalNBack_AP",
+}
+
+FUNCTIONAL_RULES = [
+    Rule(
+        (protocol,),
+        _template("func", f"task-{task}_bold"),
+        sbref_template=_template("func", f"task-{task}_sbref"),
+    )
+    for task, protocol in TASKS.items()
+]
+
+# series are matched against both tables independently
+MATCHERS = [RuleMatcher(STRUCTURAL_RULES), RuleMatcher(FUNCTIONAL_RULES)]
+
 
 def create_key(
     template: Optional[str],
@@ -15,6 +101,20 @@ def create_key(
     return (template, outtype, annotation_classes)
 
 
+def grouping(files: list[str], dcmfilter, seqinfo) -> dict:
+    """Group the DICOMs from the header catalogue (used with ``-g custom``)"""
+    return catalogue_grouping(files, dcmfilter, seqinfo)
+
+
+def classify(
+    seqinfo: list[SeqInfo],
+) -> tuple[dict[tuple[str, tuple[str, ...], None], list], list[SeqInfo]]:
+    """Classify the series with the rule tables, returning the heuristic's
+    info dict and the series no rule matched"""
+    info, unmatched = classify_series(seqinfo, MATCHERS)
+    return {create_key(template): ids for template, ids in info.items()}, unmatched
+
+
 def infotodict(
     seqinfo: list[SeqInfo],
 ) -> dict[tuple[str, tuple[str, ...], None], list]:
@@ -28,258 +128,9 @@ def infotodict(
     subindex: sub index within group
     session: scan index for longitudinal acq
     """
-    t1_corrected = create_key(
-        "{bids_subject_session_dir}/anat/{bids_subject_session_prefix}_ce-corrected_T1w"
-    )
-    t1_uncorrected = create_key(
-        "{bids_subject_session_dir}/anat/{bids_subject_session_prefix}_ce-uncorrected_T1w"
-    )
-    t2_corrected = create_key(
-        "{bids_subject_session_dir}/anat/{bids_subject_session_prefix}_ce-corrected_T2w"
-    )
-    t2_uncorrected = create_key(
-        "{bids_subject_session_dir}/anat/{bids_subject_session_prefix}_ce-uncorrected_T2w"
-    )
-    flair = create_key(
-        "{bids_subject_session_dir}/anat/{bids_subject_session_prefix}_FLAIR"
-    )
-    dwi_ap = create_key(
-        "{bids_subject_session_dir}/dwi/{bids_subject_session_prefix}_dir-AP_dwi"
-    )
-    dwi_pa = create_key(
-        "{bids_subject_session_dir}/dwi/{bids_subject_session_prefix}_dir-PA_dwi"
-    )
-    dwi_ap_sbref = create_key(
-        "{bids_subject_session_dir}/dwi/{bids_subject_session_prefix}_dir-AP_sbref"
-    )
-    dwi_pa_sbref = create_key(
-        "{bids_subject_session_dir}/dwi/{bids_subject_session_prefix}_dir-PA_sbref"
-    )
-    fmap_ap = create_key(
-        "{bids_subject_session_dir}/fmap/{bids_subject_session_prefix}_acq-func_dir-AP_epi"
-    )
-    fmap_pa = create_key(
-        "{bids_subject_session_dir}/fmap/{bids_subject_session_prefix}_acq-func_dir-PA_epi"
-    )
-    fmap_task_ap = create_key(
-        "{bids_subject_session_dir}/fmap/{bids_subject_session_prefix}_acq-task_dir-AP_epi"
-    )
-    fmap_task_pa = create_key(
-        "{bids_subject_session_dir}/fmap/{bids_subject_session_prefix}_acq-task_dir-PA_epi"
-    )
-    rest = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-rest_bold"
-    )
-    rest_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-rest_sbref"
-    )
-    # Functional tasks
-    bjj1 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-bjj1_bold"
-    )
-    bjj1_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-bjj1_sbref"
-    )
-    bjj2 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-bjj2_bold"
-    )
-    bjj2_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-bjj2_sbref"
-    )
-    bjj3 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-bjj3_bold"
-    )
-    bjj3_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-bjj3_sbref"
-    )
-    climbing1 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-climbing1_bold"
-    )
-    climbing1_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-climbing1_sbref"
-    )
-    climbing2 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-climbing2_bold"
-    )
-    climbing2_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-climbing2_sbref"
-    )
-    climbing3 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-climbing3_bold"
-    )
-    climbing3_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-climbing3_sbref"
-    )
-    music1 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-music1_bold"
-    )
-    music1_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-music1_sbref"
-    )
-    music2 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-music2_bold"
-    )
-    music2_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-music2_sbref"
-    )
-    music3 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-music3_bold"
-    )
-    music3_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-music3_sbref"
-    )
-    movement1 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-movement1_bold"
-    )
-    movement1_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-movement1_sbref"
-    )
-    movement2 = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-movement2_bold"
-    )
-    movement2_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-movement2_sbref"
-    )
-    emotionalnback = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-emotionalnback_bold"
-    )
-    emotionalnback_sbref = create_key(
-        "{bids_subject_session_dir}/func/{bids_subject_session_prefix}_task-emotionalnback_sbref"
-    )
-
-    info: dict[tuple[str, tuple[str, ...], None], list] = {
-        t1_corrected: [],
-        t1_uncorrected: [],
-        t2_corrected: [],
-        t2_uncorrected: [],
-        flair: [],
-        dwi_ap: [],
-        dwi_pa: [],
-        dwi_ap_sbref: [],
-        dwi_pa_sbref: [],
-        fmap_ap: [],
-        fmap_pa: [],
-        fmap_task_ap: [],
-        fmap_task_pa: [],
-        rest: [],
-        rest_sbref: [],
-        bjj1: [],
-        bjj1_sbref: [],
-        bjj2: [],
-        bjj2_sbref: [],
-        bjj3: [],
-        bjj3_sbref: [],
-        climbing1: [],
-        climbing1_sbref: [],
-        climbing2: [],
-        climbing2_sbref: [],
-        climbing3: [],
-        climbing3_sbref: [],
-        music1: [],
-        music1_sbref: [],
-        music2: [],
-        music2_sbref: [],
-        music3: [],
-        music3_sbref: [],
-        movement1: [],
-        movement1_sbref: [],
-        movement2: [],
-        movement2_sbref: [],
-        emotionalnback: [],
-        emotionalnback_sbref: [],
-    }
-
-    for s in seqinfo:
-        if "T1w_MPRAGE" in s.protocol_name:
-            print(s.image_type)
-            if "NORM" in s.image_type:
-                info[t1_corrected].append(s.series_id)
-            else:
-                info[t1_uncorrected].append(s.series_id)
-        elif "T2w_SPC" in s.protocol_name:
-            if "NORM" in s.image_type:
-                info[t2_corrected].append(s.series_id)
-            else:
-                info[t2_uncorrected].append(s.series_id)
-        elif "t2_tirm_tra_dark-fluid_FLAIR" in s.protocol_name:
-            info[flair].append(s.series_id)
-        elif (
-            "dMRI_MB4_185dirs_d15D45_AP" in s.protocol_name
-            or "ep2d_d15.5D60_MB3_AP" in s.protocol_name
-        ):
-            info[dwi_ap].append(s.series_id)
-        elif (
-            "dMRI_MB4_6dirs_d15D45_PA" in s.protocol_name
-            or "ep2d_d15.5D60_MB3_PA" in s.protocol_name
-        ):
-            info[dwi_pa].append(s.series_id)
-        elif "dMRI_MB4_185dirs_d15D45_AP_SBRef" in s.protocol_name:
-            info[dwi_ap_sbref].append(s.series_id)
-        elif "dMRI_MB4_6dirs_d15D45_PA_SBRef" in s.protocol_name:
-            info[dwi_pa_sbref].append(s.series_id)
-        elif (
-            "SpinEchoFieldMap_AP" in s.protocol_name
-            or "SE_rsfMRI_FieldMap_AP" in s.protocol_name
-        ):
-            info[fmap_ap].append(s.series_id)
-        elif (
-            "SpinEchoFieldMap_PA" in s.protocol_name
-            or "SE_rsfMRI_FieldMap_PA" in s.protocol_name
-        ):
-            info[fmap_pa].append(s.series_id)
-        if "sbref" in s.series_description.lower():
-            if "rsfMRI_AP" in s.protocol_name:
-                info[rest_sbref].append(s.series_id)
-            elif "fMRI_BJJ1_AP" in s.protocol_name:
-                info[bjj1_sbref].append(s.series_id)
-            elif "fMRI_BJJ2_AP" in s.protocol_name:
-                info[bjj2_sbref].append(s.series_id)
-            elif "fMRI_BJJ3_AP" in s.protocol_name:
-                info[bjj3_sbref].append(s.series_id)
-            elif "fMRI_Climbing1_AP" in s.protocol_name:
-                info[climbing1_sbref].append(s.series_id)
-            elif "fMRI_Climbing2_AP" in s.protocol_name:
-                info[climbing2_sbref].append(s.series_id)
-            elif "fMRI_Climbing3_AP" in s.protocol_name:
-                info[climbing3_sbref].append(s.series_id)
-            elif "fMRI_Music1_AP" in s.protocol_name:
-                info[music1_sbref].append(s.series_id)
-            elif "fMRI_Music2_AP" in s.protocol_name:
-                info[music2_sbref].append(s.series_id)
-            elif "fMRI_Music3_AP" in s.protocol_name:
-                info[music3_sbref].append(s.series_id)
-            elif "fMRI_Music_Movement1_AP" in s.protocol_name:
-                info[movement1_sbref].append(s.series_id)
-            elif "fMRI_Music_Movement2_AP" in s.protocol_name:
-                info[movement2_sbref].append(s.series_id)
-            elif "fMRI_EmotionalNBack_AP" in s.protocol_name:
-                info[emotionalnback_sbref].append(s.series_id)
-        else:
-            if "rsfMRI_AP" in s.protocol_name:
-                info[rest].append(s.series_id)
-            elif "fMRI_BJJ1_AP" in s.protocol_name:
-                info[bjj1].append(s.series_id)
-            elif "fMRI_BJJ2_AP" in s.protocol_name:
-                info[bjj2].append(s.series_id)
-            elif "fMRI_BJJ3_AP" in s.protocol_name:
-                info[bjj3].append(s.series_id)
-            elif "fMRI_Climbing1_AP" in s.protocol_name:
-                info[climbing1].append(s.series_id)
-            elif "fMRI_Climbing2_AP" in s.protocol_name:
-                info[climbing2].append(s.series_id)
-            elif "fMRI_Climbing3_AP" in s.protocol_name:
-                info[climbing3].append(s.series_id)
-            elif "fMRI_Music1_AP" in s.protocol_name:
-                info[music1].append(s.series_id)
-            elif "fMRI_Music2_AP" in s.protocol_name:
-                info[music2].append(s.series_id)
-            elif "fMRI_Music3_AP" in s.protocol_name:
-                info[music3].append(s.series_id)
-            elif "fMRI_Music_Movement1_AP" in s.protocol_name:
-                info[movement1].append(s.series_id)
-            elif "fMRI_Music_Movement2_AP" in s.protocol_name:
-                info[movement2].append(s.series_id)
-            elif "fMRI_EmotionalNBack_AP" in s.protocol_name:
-                info[emotionalnback].append(s.series_id)
-
+    info, unmatched = classify(seqinfo)
+    for s in unmatched:
+        lgr.info(
+            f"Series {s.series_id} ({s.series_description}) matched no rule and will not be converted"  # noqa: E501
+        )
     return info
@@ -10,16 +10,79 @@ from nipype.interfaces.utility import Function, IdentityInterface
 def _count_b0s(pa_bval: str, b0_threshold: float = 50.0) -> int:
     import pathlib
 
-    import numpy as np
+    from yalab_procedures.procedures.dicom_to_bids.templates.post_heudiconv import (
+        _read_bvals,
+    )
 
     p = pathlib.Path(pa_bval)
     if not p.exists():
         raise FileNotFoundError(f"Missing bval file: {pa_bval}")
-    vals = []
-    with open(p, "r") as f:
+    return int((_read_bvals(pa_bval) <= b0_threshold).sum())
+
+
+def _read_bvals(pa_bval: str):
+    import numpy as np
+
+    bvals = []
+    with open(pa_bval, "r") as f:
         for line in f:
-            vals.extend([float(x) for x in line.strip().split()])
-    return int((np.asarray(vals, float) <= b0_threshold).sum())
+            bvals.extend([float(x) for x in line.strip().split()])
+    return np.asarray(bvals, float)
+
+
+def _volume_runs(indices) -> list[tuple[int, int]]:
+    """Group sorted volume indices into contiguous (start, stop) runs."""
+    runs: list[tuple[int, int]] = []
+    for i in indices:
+        i = int(i)
+        if runs and runs[-1][1] == i:
+            runs[-1] = (runs[-1][0], i + 1)
+        else:
+            runs.append((i, i + 1))
+    return runs
+
+
+def _save_nifti(img, path: str, compresslevel: int = 1, threads: int = 1) -> str:
+    """
+    Save an image atomically, gzipped at ``compresslevel`` (for .nii.gz),
+    with pigz on ``threads`` threads when it is available.
+    """
+    import gzip
+    import os
+    import shutil
+    import subprocess
+
+    from nibabel.fileholders import FileHolder
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        if not path.endswith(".gz"):
+            img.to_filename(f"{tmp}.nii")
+            os.replace(f"{tmp}.nii", tmp)
+        elif threads > 1 and shutil.which("pigz"):
+            img.to_filename(f"{tmp}.nii")
+            with open(tmp, "wb") as out:
+                subprocess.run(
+                    [
+                        "pigz",
+                        "-c",
+                        f"-{compresslevel}",
+                        "-p",
+                        str(threads),
+                        f"{tmp}.nii",
+                    ],
+                    stdout=out,
+                    check=True,
+                )
+        else:
+            with gzip.open(tmp, "wb", compresslevel=compresslevel) as out:
+                img.to_file_map({"image": FileHolder(fileobj=out)})
+        os.replace(tmp, path)
+    finally:
+        for leftover in (tmp, f"{tmp}.nii"):
+            if os.path.exists(leftover):
+                os.unlink(leftover)
+    return path
 
 
 def _write_mean_b0_epi(
@@ -28,42 +91,61 @@ def _write_mean_b0_epi(
     epi_nii_out: str,
     b0_threshold: float = 50.0,
     allow_first_as_b0: bool = False,
+    compresslevel: int = 1,
+    threads: int = 1,
+    bvals=None,
 ) -> str:
-    """Write the mean-b0 (or copy if 3D) directly to epi_nii_out."""
+    """Write the mean-b0 (or copy if 3D) directly to epi_nii_out.
+
+    Only the b0 volumes are read (through the image's data proxy, memory
+    mapped for uncompressed NIfTI) and averaged one run of contiguous volumes
+    at a time, so the whole 4D series is never loaded. ``bvals`` (already
+    parsed) takes precedence over ``pa_bval``.
+    """
     import shutil
     from pathlib import Path
 
     import nibabel as nib
     import numpy as np
 
-    img = nib.load(pa_nii)
-    data = img.get_fdata(dtype=np.float32)
+    from yalab_procedures.procedures.dicom_to_bids.templates.post_heudiconv import (
+        _read_bvals,
+        _save_nifti,
+        _volume_runs,
+    )
+
+    # keep a compressed file open, so reading the runs in order decompresses
+    # it once rather than from the start for every run
+    img = nib.load(pa_nii, keep_file_open=True)
     aff, hdr = img.affine, img.header
     Path(epi_nii_out).parent.mkdir(parents=True, exist_ok=True)
 
-    if data.ndim == 3:
+    if len(img.shape) == 3:
         shutil.copyfile(pa_nii, epi_nii_out)
         return epi_nii_out
 
-    bvals = []
-    with open(pa_bval, "r") as f:
-        for line in f:
-            bvals.extend([float(x) for x in line.strip().split()])
-    bvals = np.asarray(bvals, float)
-    if bvals.size != data.shape[3]:
+    if bvals is None:
+        bvals = _read_bvals(pa_bval)
+    if bvals.size != img.shape[3]:
         raise ValueError(
-            f"bvals length ({bvals.size}) != nvols ({data.shape[3]}) for {pa_nii}"
+            f"bvals length ({bvals.size}) != nvols ({img.shape[3]}) for {pa_nii}"
         )
 
     idx = np.where(bvals <= float(b0_threshold))[0]
     if idx.size > 0:
-        m = data[..., idx].mean(axis=3)
-        nib.save(nib.Nifti1Image(m, aff, hdr), epi_nii_out)
+        total = np.zeros(img.shape[:3], dtype=np.float64)
+        for start, stop in _volume_runs(idx):
+            run = np.asarray(img.dataobj[..., start:stop], dtype=np.float64)
+            total += run.sum(axis=3)
+        m = (total / idx.size).astype(np.float32)
+        _save_nifti(nib.Nifti1Image(m, aff, hdr), epi_nii_out, compresslevel, threads)
         return epi_nii_out
 
     if allow_first_as_b0:
-        vol0 = data[..., 0]
-        nib.save(nib.Nifti1Image(vol0, aff, hdr), epi_nii_out)
+        vol0 = np.asarray(img.dataobj[..., 0], dtype=np.float32)
+        _save_nifti(
+            nib.Nifti1Image(vol0, aff, hdr), epi_nii_out, compresslevel, threads
+        )
         return epi_nii_out
 
     raise RuntimeError(
@@ -145,6 +227,58 @@ def _write_epi_json_from_pa(pa_json: str, ap_rel: str, epi_json_out: str) -> str
     return epi_json_out
 
 
+# ----------------- in-process -----------------
+
+
+def make_pa_epi(
+    bids_dir: str,
+    subject_id: str,
+    session_id: str | None,
+    pe_dir: str = "PA",
+    target_dir: str = "AP",
+    b0_threshold: float = 50.0,
+    allow_first_as_b0: bool = False,
+    compresslevel: int = 1,
+    threads: int = 1,
+) -> dict:
+    """
+    Same as :func:`create_pa_epi_workflow`, run directly in the calling
+    process: the bvals are parsed once, and there is no workflow to hash,
+    pickle or cache, so it can be called for many sessions in a row.
+
+    Returns
+    -------
+    dict
+        The EPI fieldmap ("epi_nii", "epi_json") and the number of b0
+        volumes it averages ("n_b0").
+    """
+    import logging
+    from pathlib import Path
+
+    pa_nii, pa_json, _, pa_bval, ap_rel, epi_nii, epi_json = _discover_paths(
+        bids_dir, subject_id, session_id or "", pe_dir, target_dir
+    )
+    if not Path(pa_bval).exists():
+        raise FileNotFoundError(f"Missing bval file: {pa_bval}")
+    bvals = _read_bvals(pa_bval)
+    n_b0 = int((bvals <= b0_threshold).sum())
+    logging.getLogger(__name__).info(
+        f"Writing {epi_nii} from {n_b0} b0 volume(s) of {pa_nii}"
+    )
+    _write_mean_b0_epi(
+        pa_nii,
+        pa_bval,
+        epi_nii,
+        b0_threshold=b0_threshold,
+        allow_first_as_b0=allow_first_as_b0,
+        compresslevel=compresslevel,
+        threads=threads,
+        bvals=bvals,
+    )
+    _write_epi_json_from_pa(pa_json, ap_rel, epi_json)
+    return {"epi_nii": epi_nii, "epi_json": epi_json, "n_b0": n_b0}
+
+
 # ----------------- workflow -----------------
 
 
@@ -157,12 +291,17 @@ def create_pa_epi_workflow(
     name: str = "make_pa_epi",
     b0_threshold: float = 50.0,
     allow_first_as_b0: bool = False,
+    compresslevel: int = 1,
+    threads: int = 1,
 ):
     """
     Build a Nipype workflow that:
       - finds PA DWI + an AP DWI target,
       - writes a single-volume EPI fmap as the mean of PA b0s (or copies PA if 3D),
       - writes BIDS-valid JSON with IntendedFor -> AP DWI.
+
+    The EPI is gzipped at ``compresslevel``, on ``threads`` threads if pigz
+    is available. See :func:`make_pa_epi` to run it without nipype.
     """
     wf = Workflow(name=f"{name}_{subject_id}_{session_id or 'nosess'}")
 
@@ -176,6 +315,8 @@ def create_pa_epi_workflow(
                 "target_dir",
                 "b0_threshold",
                 "allow_first_as_b0",
+                "compresslevel",
+                "threads",
             ]
         ),
         name="it",
@@ -187,6 +328,8 @@ def create_pa_epi_workflow(
     it.inputs.target_dir = target_dir
     it.inputs.b0_threshold = float(b0_threshold)
     it.inputs.allow_first_as_b0 = bool(allow_first_as_b0)
+    it.inputs.compresslevel = int(compresslevel)
+    it.inputs.threads = int(threads)
 
     # 1) discover paths
     find = Node(
@@ -238,6 +381,8 @@ def create_pa_epi_workflow(
                 "epi_nii_out",
                 "b0_threshold",
                 "allow_first_as_b0",
+                "compresslevel",
+                "threads",
             ],
             output_names=["epi_nii_out"],
             function=_write_mean_b0_epi,
@@ -249,6 +394,8 @@ def create_pa_epi_workflow(
     wf.connect(find, "epi_nii", write_mean_epi, "epi_nii_out")
     wf.connect(it, "b0_threshold", write_mean_epi, "b0_threshold")
     wf.connect(it, "allow_first_as_b0", write_mean_epi, "allow_first_as_b0")
+    wf.connect(it, "compresslevel", write_mean_epi, "compresslevel")
+    wf.connect(it, "threads", write_mean_epi, "threads")
 
     # 4) JSON sidecar
     write_json = Node(
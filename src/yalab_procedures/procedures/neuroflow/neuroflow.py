@@ -1,7 +1,6 @@
 # src/yalab_procedures/procedures/dicom_to_bids.py
 
 from pathlib import Path
-from subprocess import CalledProcessError, run
 
 from nipype.interfaces.base import (
     CommandLine,
@@ -16,6 +15,7 @@ from yalab_procedures.procedures.base.procedure import (
     ProcedureInputSpec,
     ProcedureOutputSpec,
 )
+from yalab_procedures.procedures.base.runner import run_command
 
 NEUROFLOW_STEPS = [
     "smriprep",
@@ -174,19 +174,8 @@ class NeuroflowProcedure(Procedure, CommandLine):
 
         # Run the heudiconv command
         command = self.cmdline
-        result = run(
-            command,
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        self.logger.info(result.stdout)
-        if result.stderr:
-            self.logger.error(result.stderr)
-            raise CalledProcessError(
-                result.returncode, command, output=result.stdout, stderr=result.stderr
-            )
+        with self._timed_stage("execution"):
+            run_command(command, self.logger)
         self.logger.info("Finished running NeuroflowProcedure")
 
     def infer_subject_id(self):
@@ -1,8 +1,8 @@
 import logging
 import os
 from pathlib import Path
-from subprocess import CalledProcessError, run
-from typing import Any, Dict
+from subprocess import CalledProcessError
+from typing import Any, Dict, Optional
 
 from nipype.interfaces.base import (
     CommandLineInputSpec,
@@ -17,10 +17,11 @@ from yalab_procedures.procedures.base.procedure import (
     Procedure,
     ProcedureInputSpec,
     ProcedureOutputSpec,
+    StagingInputSpec,
 )
 
 
-class QsiparcInputSpec(ProcedureInputSpec, CommandLineInputSpec):
+class QsiparcInputSpec(ProcedureInputSpec, StagingInputSpec, CommandLineInputSpec):
     """
     Input specification for the QsiparcProcedure
     """
@@ -132,8 +133,10 @@ class QsiparcProcedure(Procedure):
             self.logger.info(
                 f"Attempting to locate outputs from previous run in {self.inputs.output_directory}"
             )
-            result = self._list_outputs()
-            if all(Path(value).exists() for value in result.values()):
+            if all(
+                self._participant_succeeded(participant)
+                for participant in self._participant_labels()
+            ):
                 self.logger.info(
                     f"Outputs already exist in {self.inputs.output_directory}. If you want to run the procedure again, set force=True."
                 )
@@ -145,11 +148,13 @@ class QsiparcProcedure(Procedure):
             )
             return
         # Prepare inputs
-        temp_input_directory = self._prepare_inputs()
+        with self._timed_stage("staging"):
+            temp_input_directory = self._prepare_inputs()
         # Run the qsiprep command
         config = self._initiate_config()
         try:
-            _ = run_parcellations(config)
+            with self._timed_stage("execution"):
+                _ = run_parcellations(config)
         except Exception as e:
             self.logger.error(f"QsiparcProcedure failed with error: {e}")
             raise CalledProcessError(
@@ -158,21 +163,9 @@ class QsiparcProcedure(Procedure):
                 output=str(e),
             ) from e
         self.logger.info("Finished running QSIPrepProcedure")
-        self.logger.info(
-            f"Cleaning up temporary input directory: {temp_input_directory}"
-        )
         # Clean up
-        result = run(
-            f"rm -rf {temp_input_directory}",
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
-            self.logger.warning(
-                f"Failed to remove temporary input directory: {temp_input_directory}. Error: {result.stderr}"  # noqa: E501
-            )
+        with self._timed_stage("cleanup"):
+            self._cleanup_staged_inputs(temp_input_directory)
         self._write_finished_file(finished_file)
 
     def _prepare_inputs(self):
@@ -187,38 +180,29 @@ class QsiparcProcedure(Procedure):
             temp_bids.mkdir(parents=True, exist_ok=True)
         else:
             temp_bids = work_directory
-        # generate random temporary directory
-        temp_bids = temp_bids / f"qsiparc_temp_bids_{os.getpid()}"
+        # a stable temporary directory lets retries restage incrementally
+        temp_bids = temp_bids / self._temporary_bids_name("qsiparc")
         self.logger.info(f"Using provided temporary BIDS directory: {temp_bids}")
-        temp_bids.mkdir(parents=True, exist_ok=True)
-        # rsync input directory to work directory
+        # stage the participants' data into the temporary BIDS directory
+        paths = []
         for participant in self.inputs.participant_label:
-            run(
-                f"rsync -azPL {input_directory}/sub-{participant} {temp_bids}",
-                shell=True,
-                check=True,
-            )
+            paths.append(f"sub-{participant}")
             for derivatives in (input_directory / "derivatives").glob(
                 f"qsirecon-*/sub-{participant}"
             ):
-                dest = temp_bids / "derivatives" / derivatives.parent.name
-                dest.mkdir(parents=True, exist_ok=True)
-                run(
-                    f"rsync -azPL --exclude='*.tck*' --exclude='*.trk*' {derivatives} {dest}",
-                    shell=True,
-                    check=True,
-                )
-                run(
-                    f"rsync -azPL {derivatives.parent}/dataset_description.json {temp_bids / 'derivatives'}",
-                    shell=True,
-                    check=True,
-                )
-        for fname in ["dataset_description.json", "atlases"]:
-            run(
-                f"rsync -azPL {input_directory / fname} {temp_bids}",
-                shell=True,
-                check=True,
-            )
+                pipeline = derivatives.parent.relative_to(input_directory)
+                paths += [
+                    # streamlines are not needed for parcellation
+                    (
+                        str(derivatives.relative_to(input_directory)),
+                        str(pipeline),
+                        ("*.tck*", "*.trk*"),
+                    ),
+                    # every pipeline keeps its own description
+                    str(pipeline / "dataset_description.json"),
+                ]
+        paths += ["dataset_description.json", "atlases"]
+        temp_bids = self._stage_inputs(input_directory, paths, temp_bids)
         self.inputs.input_directory = temp_bids
         return temp_bids
 
@@ -241,6 +225,20 @@ class QsiparcProcedure(Procedure):
             outputs["log_file"] = str(self.log_file_path)
         return outputs
 
+    def _participant_succeeded(self, participant_label: Optional[str] = None) -> bool:
+        """
+        Whether QSIParc wrote the parcellations of a participant (by default
+        the first) for any of the reconstruction pipelines
+        """
+        if participant_label is None:
+            participant_label = self._participant_labels()[0]
+        output_directory = Path(self.inputs.output_directory)
+        if output_directory.name != "qsiparc":
+            output_directory = output_directory / "qsiparc"
+        return any(
+            d.is_dir() for d in output_directory.glob(f"*/sub-{participant_label}")
+        )
+
     def _initiate_config(self) -> QSIReconConfig:
         """
         Initialize QSIReconConfig from inputs
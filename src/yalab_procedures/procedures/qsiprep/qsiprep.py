@@ -1,7 +1,6 @@
 import os
 from pathlib import Path
-from subprocess import CalledProcessError, run
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from nipype.interfaces.base import (
     CommandLine,
@@ -12,14 +11,20 @@ from nipype.interfaces.base import (
     traits,
 )
 
+from yalab_procedures.procedures.base.container import Mount
 from yalab_procedures.procedures.base.procedure import (
+    ContainerInputSpec,
     Procedure,
     ProcedureInputSpec,
     ProcedureOutputSpec,
+    StagingInputSpec,
 )
+from yalab_procedures.procedures.base.runner import run_command
 
 
-class QsiprepInputSpec(ProcedureInputSpec, CommandLineInputSpec):
+class QsiprepInputSpec(
+    ProcedureInputSpec, StagingInputSpec, ContainerInputSpec, CommandLineInputSpec
+):
     """
     Input specification for the QsiprepProcedure
     """
@@ -108,13 +113,19 @@ class QsiprepInputSpec(ProcedureInputSpec, CommandLineInputSpec):
     nprocs = traits.Int(
         os.cpu_count(),
         usedefault=True,
+        argstr="--nthreads %d",
         desc="Number of processes (compute tasks) that can be run in parallel (multiprocessing only).",
     )
     omp_nthreads = traits.Int(
         1,
         usedefault=True,
+        argstr="--omp-nthreads %d",
         desc="Number of CPUs a single process can access for multithreaded execution.",
     )
+    mem_gb = traits.Float(
+        argstr="--mem-mb %d",
+        desc="Upper bound memory limit (GB) for QSIPrep processes.",
+    )
 
     force = traits.Bool(
         False,
@@ -143,20 +154,24 @@ class QsiprepProcedure(Procedure, CommandLine):
     Procedure for running Qsiprep
     """
 
-    _cmd_prefix = "docker run --rm"
     _cmd = "pennlinc/qsiprep"
     input_spec = QsiprepInputSpec
     output_spec = QsiprepOutputSpec
     _version = "0.0.1"
+    _required_datatypes = ("anat", "dwi", "fmap")
 
     def __init__(self, **inputs: Any):
         super().__init__(**inputs)
 
-    def _parse_mounted_inputs(self):
+    def _parse_mounted_inputs(self) -> List[Mount]:
         """
         Parse mounted inputs
         """
-        return [inp for inp in self._parse_inputs() if inp.startswith("-v")]
+        return [
+            Mount.from_argstr(inp)
+            for inp in self._parse_inputs()
+            if inp.startswith("-v")
+        ]
 
     def _parse_cmd_inputs(self):
         """
@@ -184,6 +199,34 @@ class QsiprepProcedure(Procedure, CommandLine):
         value = getattr(self.inputs, key)
         return value if isdefined(value) else self.inputs.traits().get(key).default
 
+    def _container_image(self) -> str:
+        """
+        Get the container image used by the procedure
+        """
+        return f"{self._cmd}:{self._get_default_value('qsiprep_version')}"
+
+    def _fingerprint_paths(self) -> Dict[str, Path]:
+        """
+        Restrict the input directory's signature to the requested participants
+        """
+        paths = super()._fingerprint_paths()
+        if not isdefined(self.inputs.participant_label):
+            return paths
+        input_directory = paths.pop("input_directory")
+        for participant in self.inputs.participant_label:
+            paths[f"input_directory/sub-{participant}"] = (
+                input_directory / f"sub-{participant}"
+            )
+        return paths
+
+    def _format_arg(self, name, trait_spec, value):
+        """
+        Format memory, given in GB, as the MB expected by the container
+        """
+        if name == "mem_gb":
+            return trait_spec.argstr % int(value * 1024)
+        return super()._format_arg(name, trait_spec, value)
+
     def _add_mounts_to_command(
         self,
         mounts: dict = {
@@ -223,8 +266,10 @@ class QsiprepProcedure(Procedure, CommandLine):
             self.logger.info(
                 f"Attempting to locate outputs from previous run in {self.inputs.output_directory}"
             )
-            result = self._list_outputs()
-            if all(Path(value).exists() for value in result.values()):
+            if all(
+                self._participant_succeeded(participant)
+                for participant in self._participant_labels()
+            ):
                 self.logger.info(
                     f"Outputs already exist in {self.inputs.output_directory}. If you want to run the procedure again, set force=True."
                 )
@@ -236,38 +281,21 @@ class QsiprepProcedure(Procedure, CommandLine):
             )
             return
         # Prepare inputs
-        temp_input_directory = self._prepare_inputs()
+        with self._timed_stage("staging"):
+            temp_input_directory = self._prepare_inputs()
         # Run the qsiprep command
+        # a stable work directory lets a retried run resume from nipype's cache
+        self._acquire_work_directory("qsiprep")
+        self._name_container()
         command = self.cmdline
         # Log the command
         self.logger.info(f"Running command: {command}")
-        result = run(
-            command,
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        self.logger.info(result.stdout)
-        if result.stderr:
-            self.logger.error(result.stderr)
-            
+        with self._timed_stage("execution"):
+            run_command(command, self.logger, line_callback=self._track_progress())
         self.logger.info("Finished running QSIPrepProcedure")
-        self.logger.info(
-            f"Cleaning up temporary input directory: {temp_input_directory}"
-        )
         # Clean up
-        result = run(
-            f"rm -rf {temp_input_directory}",
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
-            self.logger.warning(
-                f"Failed to remove temporary input directory: {temp_input_directory}. Error: {result.stderr}"  # noqa: E501
-            )
+        with self._timed_stage("cleanup"):
+            self._cleanup_staged_inputs(temp_input_directory)
         self._write_finished_file(finished_file)
 
     def _locate_fs_license_file(self):
@@ -299,30 +327,23 @@ class QsiprepProcedure(Procedure, CommandLine):
             temp_bids.mkdir(parents=True, exist_ok=True)
         else:
             temp_bids = work_directory
-        # generate random temporary directory
-        temp_bids = temp_bids / f"qsiprep_temp_bids_{os.getpid()}"
+        # a stable temporary directory lets retries restage incrementally
+        temp_bids = temp_bids / self._temporary_bids_name("qsiprep")
         self.logger.info(
                 f"Using provided temporary BIDS directory: {temp_bids}"
             )
-        temp_bids.mkdir(parents=True, exist_ok=True)
-        # rsync input directory to work directory
-        for participant in self.inputs.participant_label:
-            run(
-                f"rsync -azPL {input_directory}/sub-{participant} {temp_bids}",
-                shell=True,
-                check=True,
-            )
-        for fname in [
-            "dataset_description.json",
-            "participants.tsv",
-            "participants.json",
-            "README",
-        ]:
-            run(
-                f"rsync -azPL {input_directory / fname} {temp_bids}",
-                shell=True,
-                check=True,
-            )
+        # stage the participants' data into the temporary BIDS directory
+        temp_bids = self._stage_inputs(
+            input_directory,
+            [f"sub-{participant}" for participant in self.inputs.participant_label]
+            + [
+                "dataset_description.json",
+                "participants.tsv",
+                "participants.json",
+                "README",
+            ],
+            temp_bids,
+        )
         self.inputs.input_directory = temp_bids
         return temp_bids
 
@@ -331,15 +352,20 @@ class QsiprepProcedure(Procedure, CommandLine):
         """`command` plus any arguments (args)
         validates arguments and generates command line"""
         self._check_mandatory_inputs()
-        allargs = (
-            [self._cmd_prefix]
-            + self._parse_mounted_inputs()
-            + [f"{self._cmd}:{self._get_default_value('qsiprep_version')} /data /out"]
+        args = (
+            ["/data /out"]
             + [self._get_default_value("analysis_level")]
             + self._parse_cmd_inputs()
             + self._add_mounts_to_command()
         )
-        return " ".join(allargs)
+        return self._container_runtime().command(
+            self._runtime_image(self._container_image()),
+            args,
+            mounts=self._parse_mounted_inputs(),
+            cpus=self.inputs.nprocs,
+            memory_gb=self.inputs.mem_gb,
+            container_name=self._container_name,
+        )
 
     def _list_outputs(self) -> Dict[str, str]:
         """
@@ -354,6 +380,19 @@ class QsiprepProcedure(Procedure, CommandLine):
             outputs["log_file"] = str(self.log_file_path)
         return outputs
 
+    def _participant_succeeded(self, participant_label: Optional[str] = None) -> bool:
+        """
+        Whether QSIPrep wrote the report of a participant (by default the
+        first), which it does once the participant's workflow finished
+        """
+        if participant_label is None:
+            participant_label = self._participant_labels()[0]
+        output_directory = Path(self._list_outputs()["output_directory"])
+        return any(
+            (directory / f"sub-{participant_label}.html").exists()
+            for directory in (output_directory, output_directory.parent)
+        )
+
     @property
     def sessions(self):
         """
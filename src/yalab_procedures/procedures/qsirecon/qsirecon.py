@@ -1,10 +1,8 @@
 import os
-import shlex
 import shutil
 from glob import glob
 from pathlib import Path
-from subprocess import CalledProcessError, run
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from nipype.interfaces.base import (
     CommandLine,
@@ -15,14 +13,20 @@ from nipype.interfaces.base import (
     traits,
 )
 
+from yalab_procedures.procedures.base.container import Mount, host_user
 from yalab_procedures.procedures.base.procedure import (
+    ContainerInputSpec,
     Procedure,
     ProcedureInputSpec,
     ProcedureOutputSpec,
+    StagingInputSpec,
 )
+from yalab_procedures.procedures.base.runner import run_command
 
 
-class QsireconInputSpec(ProcedureInputSpec, CommandLineInputSpec):
+class QsireconInputSpec(
+    ProcedureInputSpec, StagingInputSpec, ContainerInputSpec, CommandLineInputSpec
+):
     """
     Input specification for the QsireconProcedure
     """
@@ -76,7 +80,7 @@ class QsireconInputSpec(ProcedureInputSpec, CommandLineInputSpec):
     freesurfer_image = traits.Str(
         "freesurfer/freesurfer:7.4.1",
         usedefault=True,
-        desc="Docker image tag for FreeSurfer.",
+        desc="Container image of FreeSurfer (a Docker image tag, or a SIF file for Apptainer).",  # noqa: E501
     )
     work_directory = Directory(
         exists=False,
@@ -105,6 +109,18 @@ class QsireconInputSpec(ProcedureInputSpec, CommandLineInputSpec):
         sep=" ",
         desc="List of atlases to use",
     )
+    nprocs = traits.Int(
+        argstr="--nthreads %d",
+        desc="Number of processes (compute tasks) that can be run in parallel (multiprocessing only).",
+    )
+    omp_nthreads = traits.Int(
+        argstr="--omp-nthreads %d",
+        desc="Number of CPUs a single process can access for multithreaded execution.",
+    )
+    mem_gb = traits.Float(
+        argstr="--mem-mb %d",
+        desc="Upper bound memory limit (GB) for QSIRecon processes.",
+    )
     force = traits.Bool(
         False,
         usedefault=True,
@@ -132,7 +148,6 @@ class QsireconProcedure(Procedure, CommandLine):
     Procedure for running Qsiprep
     """
 
-    _cmd_prefix = "docker run --rm"
     _cmd = "pennlinc/qsirecon"
     input_spec = QsireconInputSpec
     output_spec = QsireconOutputSpec
@@ -141,11 +156,15 @@ class QsireconProcedure(Procedure, CommandLine):
     def __init__(self, **inputs: Any):
         super().__init__(**inputs)
 
-    def _parse_mounted_inputs(self):
+    def _parse_mounted_inputs(self) -> List[Mount]:
         """
         Parse mounted inputs
         """
-        return [inp for inp in self._parse_inputs() if inp.startswith("-v")]
+        return [
+            Mount.from_argstr(inp)
+            for inp in self._parse_inputs()
+            if inp.startswith("-v")
+        ]
 
     def _parse_cmd_inputs(self):
         """
@@ -173,6 +192,43 @@ class QsireconProcedure(Procedure, CommandLine):
         value = getattr(self.inputs, key)
         return value if isdefined(value) else self.inputs.traits().get(key).default
 
+    def _container_image(self) -> str:
+        """
+        Get the container image used by the procedure
+        """
+        return f"{self._cmd}:{self._get_default_value('qsirecon_version')}"
+
+    def _container_images(self) -> List[str]:
+        """
+        Get the container images used by the procedure (including FreeSurfer's)
+        """
+        images = super()._container_images()
+        if self.inputs.run_recon_all:
+            images.append(self.inputs.freesurfer_image)
+        return images
+
+    def _fingerprint_paths(self) -> Dict[str, Path]:
+        """
+        Restrict the input directory's signature to the requested participants
+        """
+        paths = super()._fingerprint_paths()
+        if not isdefined(self.inputs.participant_label):
+            return paths
+        input_directory = paths.pop("input_directory")
+        for participant in [self.inputs.participant_label]:
+            paths[f"input_directory/sub-{participant}"] = (
+                input_directory / f"sub-{participant}"
+            )
+        return paths
+
+    def _format_arg(self, name, trait_spec, value):
+        """
+        Format memory, given in GB, as the MB expected by the container
+        """
+        if name == "mem_gb":
+            return trait_spec.argstr % int(value * 1024)
+        return super()._format_arg(name, trait_spec, value)
+
     def _add_mounts_to_command(
         self,
         mounts: dict = {
@@ -213,8 +269,10 @@ class QsireconProcedure(Procedure, CommandLine):
             self.logger.info(
                 f"Attempting to locate outputs from previous run in {self.inputs.output_directory}"
             )
-            result = self._list_outputs()
-            if all(Path(value).exists() for value in result.values()):
+            if all(
+                self._participant_succeeded(participant)
+                for participant in self._participant_labels()
+            ):
                 self.logger.info(
                     f"Outputs already exist in {self.inputs.output_directory}. If you want to run the procedure again, set force=True."
                 )
@@ -226,36 +284,28 @@ class QsireconProcedure(Procedure, CommandLine):
             )
             return
         # Prepare inputs
-        temp_input_directory = self._prepare_inputs()
+        with self._timed_stage("staging"):
+            temp_input_directory = self._prepare_inputs()
 
         # OPTIONAL: run recon-all first
         if self.inputs.run_recon_all:
             fsdir = self._ensure_fs_subjects_dir()
             t1, flair = self._locate_qsiprep_preproc_anat()
-            self._run_recon_all(fsdir, t1, flair)
+            with self._timed_stage("recon_all"):
+                self._run_recon_all(fsdir, t1, flair)
         # Run the qsiprep command
+        # a stable work directory lets a retried run resume from nipype's cache
+        self._acquire_work_directory("qsirecon")
+        self._name_container()
         command = self.cmdline
         # Log the command
         self.logger.info(f"Running command: {command}")
-        result = run(
-            command,
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        self.logger.info(result.stdout)
-        if result.stderr:
-            self.logger.error(result.stderr)
-            raise CalledProcessError(
-                result.returncode, command, output=result.stdout, stderr=result.stderr
-            )
-        self.logger.info("Finished running SmriprepProcedure")
-        self.logger.info(
-            f"Cleaning up temporary input directory: {temp_input_directory}"
-        )
+        with self._timed_stage("execution"):
+            run_command(command, self.logger, line_callback=self._track_progress())
+        self.logger.info("Finished running QsireconProcedure")
         # Clean up
-        run(f"rm -rf {temp_input_directory}", shell=True, check=True)
+        with self._timed_stage("cleanup"):
+            self._cleanup_staged_inputs(temp_input_directory)
         self._write_finished_file(finished_file)
 
     def _locate_fs_license_file(self):
@@ -287,27 +337,21 @@ class QsireconProcedure(Procedure, CommandLine):
             temp_bids.mkdir(parents=True, exist_ok=True)
         else:
             temp_bids = work_directory
-        # generate random temporary directory
-        temp_bids = temp_bids / f"qsirecon_temp_bids_{os.getpid()}"
+        # a stable temporary directory lets retries restage incrementally
+        temp_bids = temp_bids / self._temporary_bids_name("qsirecon")
         self.logger.info(f"Using provided temporary BIDS directory: {temp_bids}")
-        temp_bids.mkdir(parents=True, exist_ok=True)
-        # rsync input directory to work directory
-        run(
-            f"rsync -azPL {input_directory}/sub-{self.inputs.participant_label} {temp_bids}",
-            shell=True,
-            check=True,
+        # stage the participant's data into the temporary BIDS directory
+        temp_bids = self._stage_inputs(
+            input_directory,
+            [
+                f"sub-{self.inputs.participant_label}",
+                "dataset_description.json",
+                # "participants.tsv",
+                # "participants.json",
+                # "README",
+            ],
+            temp_bids,
         )
-        for fname in [
-            "dataset_description.json",
-            # "participants.tsv",
-            # "participants.json",
-            # "README",
-        ]:
-            run(
-                f"rsync -azPL {input_directory / fname} {temp_bids}",
-                shell=True,
-                check=True,
-            )
         self.inputs.input_directory = temp_bids
         return temp_bids
 
@@ -316,15 +360,20 @@ class QsireconProcedure(Procedure, CommandLine):
         """`command` plus any arguments (args)
         validates arguments and generates command line"""
         self._check_mandatory_inputs()
-        allargs = (
-            [self._cmd_prefix]
-            + self._parse_mounted_inputs()
-            + [f"{self._cmd}:{self._get_default_value('qsirecon_version')} /data /out"]
+        args = (
+            ["/data /out"]
             + [self._get_default_value("analysis_level")]
             + self._parse_cmd_inputs()
             + self._add_mounts_to_command()
         )
-        return " ".join(allargs)
+        return self._container_runtime().command(
+            self._runtime_image(self._container_image()),
+            args,
+            mounts=self._parse_mounted_inputs(),
+            cpus=self.inputs.nprocs,
+            memory_gb=self.inputs.mem_gb,
+            container_name=self._container_name,
+        )
 
     def _list_outputs(self) -> Dict[str, str]:
         """
@@ -339,6 +388,19 @@ class QsireconProcedure(Procedure, CommandLine):
             outputs["log_file"] = str(self.log_file_path)
         return outputs
 
+    def _participant_succeeded(self, participant_label: Optional[str] = None) -> bool:
+        """
+        Whether QSIRecon wrote the report of a participant (by default the
+        run's), which it does once the participant's workflow finished
+        """
+        if participant_label is None:
+            participant_label = self._participant_labels()[0]
+        output_directory = Path(self._list_outputs()["output_directory"])
+        return any(
+            (directory / f"sub-{participant_label}.html").exists()
+            for directory in (output_directory, output_directory.parent)
+        )
+
     @property
     def sessions(self):
         """
@@ -357,6 +419,10 @@ class QsireconProcedure(Procedure, CommandLine):
         """
         if isdefined(self.inputs.fs_subjects_dir):
             fsdir = Path(self.inputs.fs_subjects_dir)
+        elif self._staging_lease is not None:
+            # cached inputs are shared with other runs and must stay untouched
+            fsdir = Path(self.inputs.work_directory) / "freesurfer"
+            self.inputs.fs_subjects_dir = str(fsdir)
         else:
             input_dir = Path(self.inputs.input_directory)
             if input_dir.name == "qsiprep":
@@ -442,7 +508,7 @@ class QsireconProcedure(Procedure, CommandLine):
 
     def _run_recon_all(self, fsdir: Path, t1_path: str, flair_path: str | None):
         """
-        Run FreeSurfer recon-all in Docker on the provided T1 (and optional FLAIR).
+        Run FreeSurfer recon-all in a container on the provided T1 (and optional FLAIR).
         Writes to fsdir/sub-<label>. Runs container as host UID:GID to avoid root ownership.
         """
         sub_id = f"sub-{self.inputs.participant_label}"
@@ -457,35 +523,27 @@ class QsireconProcedure(Procedure, CommandLine):
                 "fs_license_file must be provided (or FREESURFER_HOME set)."
             )
 
-        # Build docker run
-        fsimg = self.inputs.freesurfer_image
-
-        # Mounts
         mounts = [
-            f"-v {shlex.quote(t1_path)}:/in/T1.nii.gz:ro",
-            f"-v {shlex.quote(str(fsdir))}:/out",
-            f"-v {shlex.quote(fs_license)}:/fslicense.txt:ro",
+            Mount(t1_path, "/in/T1.nii.gz", read_only=True),
+            Mount(str(fsdir), "/out"),
+            Mount(fs_license, "/fslicense.txt", read_only=True),
         ]
-        flair_mount = (
-            f"-v {shlex.quote(flair_path)}:/in/FLAIR.nii.gz:ro" if flair_path else ""
-        )
-        if flair_mount:
-            mounts.append(flair_mount)
-
-        flair_args = "-FLAIR /in/FLAIR.nii.gz -FLAIRpial" if flair_path else ""
-
-        cmd = (
-            f"docker run --rm -i {' '.join(mounts)} "
-            f"{fsimg} bash -lc "
-            f'"export FS_LICENSE=/fslicense.txt; '
-            f'recon-all -sd /out -subject {sub_id} -i /in/T1.nii.gz {flair_args} -all"'
+        args = ["-sd /out", f"-subject {sub_id}", "-i /in/T1.nii.gz"]
+        if flair_path:
+            mounts.append(Mount(flair_path, "/in/FLAIR.nii.gz", read_only=True))
+            args.append("-FLAIR /in/FLAIR.nii.gz -FLAIRpial")
+        args.append("-all")
+
+        cmd = self._container_runtime().command(
+            self._runtime_image(self.inputs.freesurfer_image),
+            args,
+            mounts=mounts,
+            entrypoint="recon-all",
+            environment={"FS_LICENSE": "/fslicense.txt"},
+            user=host_user(),
+            cpus=self.inputs.nprocs,
+            memory_gb=self.inputs.mem_gb,
         )
 
         self.logger.info(f"Running recon-all: {cmd}")
-        res = run(cmd, shell=True, capture_output=True, text=True)
-        self.logger.info(res.stdout)
-        if res.returncode != 0:
-            self.logger.error(res.stderr)
-            raise CalledProcessError(
-                res.returncode, cmd, output=res.stdout, stderr=res.stderr
-            )
+        run_command(cmd, self.logger)
@@ -1,7 +1,6 @@
 import os
 from pathlib import Path
-from subprocess import CalledProcessError, run
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from nipype.interfaces.base import (
     CommandLine,
@@ -12,15 +11,21 @@ from nipype.interfaces.base import (
     traits,
 )
 
+from yalab_procedures.procedures.base.container import Mount
 from yalab_procedures.procedures.base.procedure import (
+    ContainerInputSpec,
     Procedure,
     ProcedureInputSpec,
     ProcedureOutputSpec,
+    StagingInputSpec,
 )
+from yalab_procedures.procedures.base.runner import run_command
 from yalab_procedures.procedures.smriprep.templates.outputs import SMRIPREP_OUTPUTS
 
 
-class SmriprepInputSpec(ProcedureInputSpec, CommandLineInputSpec):
+class SmriprepInputSpec(
+    ProcedureInputSpec, StagingInputSpec, ContainerInputSpec, CommandLineInputSpec
+):
     """
     Input specification for the SmriprepProcedure
     """
@@ -68,9 +73,11 @@ class SmriprepInputSpec(ProcedureInputSpec, CommandLineInputSpec):
         default_value="0.19.2",
         argstr="%s",
     )
-    participant_label = traits.Str(
+    participant_label = traits.Either(
+        traits.Str,
+        traits.List(traits.Str),
         argstr="--participant_label %s",
-        desc="Participant label",
+        desc="Participant label (or a list of labels to process in one container)",
     )
     output_spaces = traits.List(
         traits.Str,
@@ -94,6 +101,18 @@ class SmriprepInputSpec(ProcedureInputSpec, CommandLineInputSpec):
         default_value="unbiased",
         usedefault=True,
     )
+    nprocs = traits.Int(
+        argstr="--nprocs %d",
+        desc="Number of processes (compute tasks) that can be run in parallel (multiprocessing only).",
+    )
+    omp_nthreads = traits.Int(
+        argstr="--omp-nthreads %d",
+        desc="Number of CPUs a single process can access for multithreaded execution.",
+    )
+    mem_gb = traits.Float(
+        argstr="--mem-gb %s",
+        desc="Upper bound memory limit (GB) for sMRIPrep processes.",
+    )
     force = traits.Bool(
         False,
         usedefault=True,
@@ -136,20 +155,24 @@ class SmriprepProcedure(Procedure, CommandLine):
     Procedure for running Smriprep
     """
 
-    _cmd_prefix = "docker run --rm"
     _cmd = "nipreps/smriprep"
     input_spec = SmriprepInputSpec
     output_spec = SmriprepOutputSpec
     _version = "0.0.1"
+    _required_datatypes = ("anat",)
 
     def __init__(self, **inputs: Any):
         super().__init__(**inputs)
 
-    def _parse_mounted_inputs(self):
+    def _parse_mounted_inputs(self) -> List[Mount]:
         """
         Parse mounted inputs
         """
-        return [inp for inp in self._parse_inputs() if inp.startswith("-v")]
+        return [
+            Mount.from_argstr(inp)
+            for inp in self._parse_inputs()
+            if inp.startswith("-v")
+        ]
 
     def _parse_cmd_inputs(self):
         """
@@ -175,6 +198,26 @@ class SmriprepProcedure(Procedure, CommandLine):
         value = getattr(self.inputs, key)
         return value if isdefined(value) else self.inputs.traits().get(key).default
 
+    def _container_image(self) -> str:
+        """
+        Get the container image used by the procedure
+        """
+        return f"{self._cmd}:{self._get_default_value('smriprep_version')}"
+
+    def _fingerprint_paths(self) -> Dict[str, Path]:
+        """
+        Restrict the input directory's signature to the requested participants
+        """
+        paths = super()._fingerprint_paths()
+        if not isdefined(self.inputs.participant_label):
+            return paths
+        input_directory = paths.pop("input_directory")
+        for participant in self._participant_labels():
+            paths[f"input_directory/sub-{participant}"] = (
+                input_directory / f"sub-{participant}"
+            )
+        return paths
+
     def _add_mounts_to_command(
         self,
         mounts: dict = {
@@ -216,8 +259,10 @@ class SmriprepProcedure(Procedure, CommandLine):
             self.logger.info(
                 f"Attempting to locate outputs from previous run in {self.inputs.output_directory}"
             )
-            result = self._list_outputs()
-            if all(Path(value).exists() for value in result.values()):
+            if all(
+                self._participant_succeeded(participant)
+                for participant in self._participant_labels()
+            ):
                 self.logger.info(
                     f"Outputs already exist in {self.inputs.output_directory}. If you want to run the procedure again, set force=True."
                 )
@@ -230,28 +275,22 @@ class SmriprepProcedure(Procedure, CommandLine):
             return
 
         # Prepare inputs
-        temp_input_directory = self._prepare_inputs()
+        with self._timed_stage("staging"):
+            temp_input_directory = self._prepare_inputs()
         # Run the smriprep command
+        # a stable work directory lets a retried run resume from nipype's cache
+        self._acquire_work_directory("smriprep")
+        self._name_container()
         command = self.cmdline
         # Log the command
         self.logger.info(f"Running command: {command}")
-        result = run(
-            command,
-            shell=True,
-            check=False,
-            capture_output=True,
-            text=True,
-        )
-        self.logger.info(result.stdout)
-        if result.stderr:
-            self.logger.error(result.stderr)
-            raise CalledProcessError(
-                result.returncode, command, output=result.stdout, stderr=result.stderr
-            )
+        with self._timed_stage("execution"):
+            run_command(command, self.logger, line_callback=self._track_progress())
         self.post_run_edits()
         self.logger.info("Finished running SmriprepProcedure")
         # Clean up
-        run(f"rm -rf {temp_input_directory}", shell=True, check=True)
+        with self._timed_stage("cleanup"):
+            self._cleanup_staged_inputs(temp_input_directory)
         self._write_finished_file(finished_file)
 
     def post_run_edits(self):
@@ -267,9 +306,15 @@ class SmriprepProcedure(Procedure, CommandLine):
             fs_dir = Path(fs_dir)
         else:
             fs_dir = output_directory / "freesurfer"
-        subject_label = self.inputs.participant_label
+        for subject_label in self._participant_labels():
+            self._rename_freesurfer_directories(fs_dir, subject_label)
+
+    def _rename_freesurfer_directories(self, fs_dir: Path, subject_label: str):
+        """
+        Drop the session label from a participant's FreeSurfer directories
+        """
         # look for sub-<label>_ses-multi* directories
-        if len(self.sessions) > 1:
+        if len(self._sessions(subject_label)) > 1:
             for session_dir in fs_dir.glob(f"sub-{subject_label}_ses-multi*"):
                 self.logger.info(
                     f"Renaming FreeSurfer directory {session_dir} to remove session label."
@@ -307,25 +352,19 @@ class SmriprepProcedure(Procedure, CommandLine):
         """
         work_directory = Path(self.inputs.work_directory)
         input_directory = Path(self.inputs.input_directory)
-        temp_bids = work_directory / self.log_file_path.stem / "bids"
-        temp_bids.mkdir(parents=True, exist_ok=True)
-        # rsync input directory to work directory
-        run(
-            f"rsync -azPL {input_directory}/sub-{self.inputs.participant_label} {temp_bids}",
-            shell=True,
-            check=True,
+        temp_bids = work_directory / self._temporary_bids_name("smriprep")
+        # stage the participants' data into the temporary BIDS directory
+        temp_bids = self._stage_inputs(
+            input_directory,
+            [f"sub-{participant}" for participant in self._participant_labels()]
+            + [
+                "dataset_description.json",
+                "participants.tsv",
+                "participants.json",
+                "README",
+            ],
+            temp_bids,
         )
-        for fname in [
-            "dataset_description.json",
-            "participants.tsv",
-            "participants.json",
-            "README",
-        ]:
-            run(
-                f"rsync -azPL {input_directory / fname} {temp_bids}",
-                shell=True,
-                check=True,
-            )
         self.inputs.input_directory = temp_bids
         return temp_bids
 
@@ -334,23 +373,34 @@ class SmriprepProcedure(Procedure, CommandLine):
         """`command` plus any arguments (args)
         validates arguments and generates command line"""
         self._check_mandatory_inputs()
-        allargs = (
-            [self._cmd_prefix]
-            + self._parse_mounted_inputs()
-            + [f"{self._cmd}:{self._get_default_value('smriprep_version')} /data /out"]
+        args = (
+            ["/data /out"]
             + [self._get_default_value("analysis_level")]
             + self._parse_cmd_inputs()
             + self._add_mounts_to_command()
         )
-        return " ".join(allargs)
+        return self._container_runtime().command(
+            self._runtime_image(self._container_image()),
+            args,
+            mounts=self._parse_mounted_inputs(),
+            cpus=self.inputs.nprocs,
+            memory_gb=self.inputs.mem_gb,
+            container_name=self._container_name,
+        )
 
     def _list_outputs(
-        self, smriprep_outputs: dict = SMRIPREP_OUTPUTS
+        self,
+        smriprep_outputs: dict = SMRIPREP_OUTPUTS,
+        participant_label: Optional[str] = None,
     ) -> Dict[str, str]:
         """
-        List the outputs of the SmriprepProcedure
+        List the outputs of the SmriprepProcedure (for its first participant,
+        unless another one is given)
         """
-        outputs_level = "session" if len(self.sessions) == 1 else "subject"
+        if participant_label is None:
+            participant_label = self._participant_labels()[0]
+        sessions = self._sessions(participant_label)
+        outputs_level = "session" if len(sessions) == 1 else "subject"
         output_directory = Path(self.inputs.output_directory)
         outputs = self._outputs().get()
         outputs["output_directory"] = str(output_directory)
@@ -364,11 +414,11 @@ class SmriprepProcedure(Procedure, CommandLine):
                 template = desc.get(outputs_level) if isinstance(desc, dict) else desc
                 if outputs_level == "session":
                     value = template.format(
-                        subject=self.inputs.participant_label,
-                        session=self.sessions[0],
+                        subject=participant_label,
+                        session=sessions[0],
                     )
                 else:
-                    value = template.format(subject=self.inputs.participant_label)
+                    value = template.format(subject=participant_label)
                 outputs[key] = str(search_destination / value)
         if hasattr(self, "log_file_path"):
             outputs["log_file"] = str(self.log_file_path)
@@ -377,12 +427,25 @@ class SmriprepProcedure(Procedure, CommandLine):
     @property
     def sessions(self):
         """
-        Get the sessions
+        Get the sessions (of the first participant)
+        """
+        return self._sessions(self._participant_labels()[0])
+
+    def _sessions(self, participant_label: str) -> List[str]:
+        """
+        Get the sessions of a participant
         """
         return [
             session.name.split("-")[-1]
             for session in Path(self.inputs.input_directory).glob(
-                f"sub-{self.inputs.participant_label}/ses-*"
+                f"sub-{participant_label}/ses-*"
             )
             if session.is_dir()
         ]
+
+    def _participant_succeeded(self, participant_label: Optional[str] = None) -> bool:
+        """
+        Whether all outputs of a participant (by default the first) exist
+        """
+        outputs = self._list_outputs(participant_label=participant_label)
+        return all(Path(value).exists() for value in outputs.values())
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from yalab_procedures.interfaces.data_grabber import layout_cache
+from yalab_procedures.interfaces.data_grabber.data_grabber import (
+    YALabBidsQuery,
+    load_output_query,
+    query_sessions,
+)
+
+
+def write_session(bids_dir, subject, session):
+    dwi = bids_dir / f"sub-{subject}" / f"ses-{session}" / "dwi"
+    dwi.mkdir(parents=True)
+    for direction in ("AP", "PA"):
+        prefix = f"sub-{subject}_ses-{session}_dir-{direction}_dwi"
+        for extension in ("nii.gz", "bval", "bvec"):
+            (dwi / f"{prefix}.{extension}").write_text("")
+        (dwi / f"{prefix}.json").write_text("{}")
+
+
+@pytest.fixture
+def bids_dir(tmp_path):
+    bids_dir = tmp_path / "bids"
+    bids_dir.mkdir()
+    (bids_dir / "dataset_description.json").write_text(
+        json.dumps({"Name": "test", "BIDSVersion": "1.8.0"})
+    )
+    write_session(bids_dir, "01", "a")
+    return bids_dir
+
+
+def query(bids_dir, database_dir, subject):
+    grabber = YALabBidsQuery(raise_on_empty=False)
+    grabber.inputs.base_dir = str(bids_dir)
+    grabber.inputs.bids_database_dir = str(database_dir)
+    grabber.inputs.subject = subject
+    return grabber.run().outputs
+
+
+def test_load_output_query():
+    query = load_output_query()
+    query["dwi_ap_nifti"]["direction"] = "LR"
+    assert load_output_query()["dwi_ap_nifti"]["direction"] == "AP"
+
+
+def test_layout_cache(tmp_path, bids_dir):
+    database_dir = tmp_path / "databases"
+    outputs = query(bids_dir, database_dir, "01")
+    assert outputs.dwi_pa_bval == [
+        str(bids_dir / "sub-01/ses-a/dwi/sub-01_ses-a_dir-PA_dwi.bval")
+    ]
+    (dataset_dir,) = database_dir.iterdir()
+    (version,) = dataset_dir.iterdir()
+
+    # unchanged dataset: the index is neither rebuilt nor reloaded
+    layout = layout_cache.get_layout(bids_dir, database_dir)
+    assert layout_cache.get_layout(bids_dir, database_dir) is layout
+    assert list(dataset_dir.iterdir()) == [version]
+
+    # a new session is indexed into a new version
+    write_session(bids_dir, "02", "a")
+    outputs = query(bids_dir, database_dir, "02")
+    assert len(outputs.dwi_ap_json) == 1
+    assert len(list(dataset_dir.iterdir())) == 2
+
+    # other processes load the published index as is
+    layout_cache._LAYOUTS.clear()
+    assert len(layout_cache.get_layout(bids_dir, database_dir).get(subject="02")) == 8
+
+
+def test_query_sessions(tmp_path, bids_dir):
+    write_session(bids_dir, "01", "b")
+    write_session(bids_dir, "02", "a")
+    database_dir = tmp_path / "databases"
+    table = query_sessions(
+        bids_dir,
+        [("01", "a"), ("01", None), ("02", "a"), ("03", "a")],
+        None,
+        database_dir,
+    )
+    assert set(table) == {("01", "a"), ("01", ""), ("02", "a"), ("03", "a")}
+    assert table[("01", "a")]["dwi_pa_bval"] == [
+        str(bids_dir / "sub-01/ses-a/dwi/sub-01_ses-a_dir-PA_dwi.bval")
+    ]
+    assert len(table[("01", "")]["dwi_ap_nifti"]) == 2
+    assert table[("03", "a")]["dwi_ap_nifti"] == []
+    # same files as the grabber
+    outputs = query(bids_dir, database_dir, "02")
+    assert table[("02", "a")]["dwi_ap_json"] == outputs.dwi_ap_json
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+
+def write_dicom(
+    path: Path,
+    series_number: int,
+    protocol: str,
+    instance: int = 1,
+    image_type: str = "M",
+    echo_number: int = 1,
+):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(str(path), {}, file_meta=meta, preamble=b"\0" * 128)
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = "1.2.3"
+    ds.SeriesInstanceUID = f"1.2.3.{series_number}"
+    ds.SeriesNumber = series_number
+    ds.InstanceNumber = instance
+    ds.ProtocolName = protocol
+    ds.SeriesDescription = protocol
+    ds.ImageType = ["ORIGINAL", "PRIMARY", image_type, "NORM"]
+    ds.PatientID = "01"
+    ds.Modality = "MR"
+    ds.RepetitionTime = 2000
+    ds.EchoTime = 30
+    ds.EchoNumbers = echo_number
+    ds.AcquisitionDate = "20240101"
+    ds.AcquisitionTime = "101010"
+    ds.Rows = ds.Columns = 4
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.ImagePositionPatient = [0, 0, instance]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.PixelSpacing = [1, 1]
+    ds.PixelData = b"\0" * 32
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ds.save_as(str(path))
@@ -0,0 +1,111 @@
+import os
+from pathlib import Path
+
+import pytest
+from heudiconv.dicoms import group_dicoms_into_seqinfos
+
+from tests.procedures.dicom_to_bids.mock_dicom import write_dicom
+from yalab_procedures.procedures.dicom_to_bids.catalogue import (
+    CATALOGUE_ENVIRONMENT_VARIABLE,
+    DicomCatalogue,
+    grouping,
+)
+from yalab_procedures.procedures.dicom_to_bids.discovery import find_dicoms
+
+
+@pytest.fixture
+def dicom_files(tmp_path):
+    for i in range(3):
+        write_dicom(tmp_path / "dicom" / "t1" / f"{i}.dcm", 2, "T1w_MPRAGE", i + 1)
+    for i in range(2):
+        write_dicom(tmp_path / "dicom" / "rest" / f"{i}.dcm", 5, "rsfMRI_AP", i + 1)
+    (tmp_path / "dicom" / "rest" / "notes.dcm").write_text("not a DICOM")
+    return sorted(str(path) for path in (tmp_path / "dicom").glob("*/*.dcm"))
+
+
+def test_series_match_heudiconv(tmp_path, dicom_files):
+    catalogue = DicomCatalogue(tmp_path / "catalogue.sqlite")
+    assert catalogue.update(dicom_files, workers=2) == len(dicom_files)
+    expected = group_dicoms_into_seqinfos(list(dicom_files), "all")["all"]
+    assert catalogue.series(dicom_files) == expected
+
+
+def test_mixed_series_are_split(tmp_path, dicom_files, monkeypatch):
+    # the magnitude (two echoes) and phase images of a fieldmap share their
+    # series number and protocol name
+    fieldmap = tmp_path / "dicom" / "fmap"
+    for i in range(2):
+        write_dicom(fieldmap / f"e1_{i}.dcm", 7, "gre_field_mapping", i + 1)
+        write_dicom(fieldmap / f"e2_{i}.dcm", 7, "gre_field_mapping", i + 1, "M", 2)
+        write_dicom(fieldmap / f"p_{i}.dcm", 7, "gre_field_mapping", i + 1, "P", 2)
+    files = sorted(str(path) for path in (tmp_path / "dicom").glob("*/*.dcm"))
+    catalogue = DicomCatalogue(tmp_path / "catalogue.sqlite")
+    catalogue.update(files)
+    series = catalogue.series(files)
+    # heudiconv counts the files of every call
+    monkeypatch.setattr("heudiconv.dicoms.total_files", 0)
+    expected = group_dicoms_into_seqinfos(list(files), "all")["all"]
+    # heudiconv merges the files of the mixed series into one
+    mixed = {}
+    for seqinfo, series_files in series.items():
+        if seqinfo.series_id.startswith("7-"):
+            mixed[seqinfo] = series_files
+        else:
+            assert expected[seqinfo] == series_files
+    assert [seqinfo.series_id for seqinfo in mixed] == [
+        "7-gre_field_mapping-1",
+        "7-gre_field_mapping-2",
+        "7-gre_field_mapping-3",
+    ]
+    assert [seqinfo.image_type[2] for seqinfo in mixed] == ["M", "M", "P"]
+    assert [os.path.basename(files[0]) for files in mixed.values()] == [
+        "e1_0.dcm",
+        "e2_0.dcm",
+        "p_0.dcm",
+    ]
+    (merged,) = [
+        series_files
+        for seqinfo, series_files in expected.items()
+        if seqinfo.series_id == "7-gre_field_mapping"
+    ]
+    assert sorted(merged) == sorted(f for files in mixed.values() for f in files)
+
+
+def test_update_reads_changed_files_only(tmp_path, dicom_files):
+    catalogue = DicomCatalogue(tmp_path / "catalogue.sqlite")
+    catalogue.update(dicom_files)
+    assert catalogue.update(dicom_files) == 0
+    write_dicom(Path(dicom_files[0]), 2, "T1w_MPRAGE_renamed")
+    assert catalogue.update(dicom_files) == 1
+    protocols = [seqinfo.protocol_name for seqinfo in catalogue.series(dicom_files)]
+    assert "T1w_MPRAGE_renamed" in protocols
+
+
+def test_grouping_reads_the_catalogue(tmp_path, dicom_files, monkeypatch):
+    database = tmp_path / "catalogue.sqlite"
+    monkeypatch.setenv(CATALOGUE_ENVIRONMENT_VARIABLE, str(database))
+    seqinfos = grouping(dicom_files)["all"]
+    assert [seqinfo.series_id for seqinfo in seqinfos] == [
+        "2-T1w_MPRAGE",
+        "5-rsfMRI_AP",
+    ]
+    assert os.path.exists(database)
+
+
+def test_grouping_uses_the_listed_files(tmp_path, dicom_files, monkeypatch):
+    database = tmp_path / "catalogue.sqlite"
+    monkeypatch.setenv(CATALOGUE_ENVIRONMENT_VARIABLE, str(database))
+    # hidden files are not listed by find_dicoms, but heudiconv passes them
+    write_dicom(tmp_path / "dicom" / "t1" / ".backup.dcm", 9, "T1w_backup")
+    listed = find_dicoms(tmp_path / "dicom", catalogue=DicomCatalogue(database))
+    assert not any(file.endswith(".backup.dcm") for file in listed)
+    walked = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(tmp_path / "dicom")
+        for name in names
+    )
+    seqinfos = grouping(walked)["all"]
+    assert [seqinfo.series_id for seqinfo in seqinfos] == [
+        "2-T1w_MPRAGE",
+        "5-rsfMRI_AP",
+    ]
@@ -0,0 +1,92 @@
+import csv
+from pathlib import Path
+
+import heudiconv.convert
+import pytest
+from heudiconv.bids import save_scans_key
+
+from tests.procedures.dicom_to_bids.mock_dicom import write_dicom
+from yalab_procedures.procedures.base.reaper import get_reaper
+from yalab_procedures.procedures.dicom_to_bids.catalogue import DicomCatalogue
+from yalab_procedures.procedures.dicom_to_bids.conversion import (
+    STAGING_DIRECTORY,
+    ConversionSession,
+    convert_sessions,
+)
+from yalab_procedures.procedures.dicom_to_bids.dicom_to_bids import DEFAULT_HEURISTIC
+
+
+def fake_convert(items, outdir, **kwargs):
+    """Stands in for heudiconv's dcm2niix conversion of a single series."""
+    for prefix, _, dicoms in items:
+        if "rest" in dicoms[0]:
+            raise RuntimeError("dcm2niix failed")
+        Path(prefix).parent.mkdir(parents=True, exist_ok=True)
+        Path(f"{prefix}.nii.gz").write_text("nifti")
+        Path(f"{prefix}.json").write_text("{}")
+        save_scans_key((prefix, None, dicoms), [f"{prefix}.json"])
+
+
+@pytest.fixture
+def session(tmp_path):
+    for i in range(2):
+        write_dicom(tmp_path / "dicom" / "t1" / f"{i}.dcm", 2, "T1w_MPRAGE", i + 1)
+        write_dicom(tmp_path / "dicom" / "t2" / f"{i}.dcm", 3, "T2w_SPC", i + 1)
+        write_dicom(tmp_path / "dicom" / "rest" / f"{i}.dcm", 5, "rsfMRI", i + 1)
+    files = sorted(str(path) for path in (tmp_path / "dicom").glob("*/*.dcm"))
+    return ConversionSession("01", "a", files)
+
+
+def test_series_are_assembled_into_the_session(tmp_path, session, monkeypatch):
+    monkeypatch.setattr(heudiconv.convert, "convert", fake_convert)
+    output_directory = tmp_path / "bids"
+    output_directory.mkdir()
+    catalogue = DicomCatalogue(tmp_path / "catalogue.sqlite")
+    # the rest series is not in the heuristic, so it is not converted
+    outputs = convert_sessions(
+        [session], output_directory, DEFAULT_HEURISTIC, catalogue
+    )
+    anat = output_directory / "sub-01" / "ses-a" / "anat"
+    assert sorted(path.name for path in anat.iterdir()) == [
+        "sub-01_ses-a_ce-corrected_T1w.json",
+        "sub-01_ses-a_ce-corrected_T1w.nii.gz",
+        "sub-01_ses-a_ce-corrected_T2w.json",
+        "sub-01_ses-a_ce-corrected_T2w.nii.gz",
+    ]
+    assert len(outputs["sub-01_ses-a"]) == 6
+    scans = output_directory / "sub-01" / "ses-a" / "sub-01_ses-a_scans.tsv"
+    with open(scans) as f:
+        rows = list(csv.reader(f, delimiter="\t"))
+    assert [row[0] for row in rows[1:]] == [
+        "anat/sub-01_ses-a_ce-corrected_T1w.nii.gz",
+        "anat/sub-01_ses-a_ce-corrected_T2w.nii.gz",
+    ]
+    assert (
+        output_directory
+        / ".heudiconv"
+        / "01"
+        / "ses-a"
+        / "info"
+        / "dicominfo_ses-a.tsv"
+    ).exists()
+    # nothing is left in the staging area
+    assert get_reaper().drain(timeout=30)
+    assert not list((output_directory / STAGING_DIRECTORY).rglob("*.nii.gz"))
+
+
+def test_failed_series_are_reported(tmp_path, session, monkeypatch):
+    monkeypatch.setattr(heudiconv.convert, "convert", fake_convert)
+    heuristic = tmp_path / "heuristic.py"
+    heuristic.write_text(
+        "def infotodict(seqinfo):\n"
+        "    key = ('{bids_subject_session_dir}/func/"
+        "{bids_subject_session_prefix}_task-rest_bold', ('nii.gz',), None)\n"
+        "    return {key: [s.series_id for s in seqinfo if 'rsfMRI' in s.protocol_name]}\n"  # noqa: E501
+    )
+    with pytest.raises(RuntimeError, match="Failed to convert 1 series"):
+        convert_sessions(
+            [session],
+            tmp_path / "bids",
+            heuristic,
+            DicomCatalogue(tmp_path / "catalogue.sqlite"),
+        )
@@ -71,10 +71,11 @@ def test_initialization(dicom_to_bids_procedure):
 
 def test_command_line_construction(dicom_to_bids_procedure):
     expected_command = (
-        f"heudiconv --bids "
+        f"heudiconv --bids notop "
         f"-c dcm2niix "
+        f"-g all "
         f"-f {dicom_to_bids_procedure.inputs.heuristic_file} "
-        f"--files '{dicom_to_bids_procedure.inputs.input_directory}'/*/*.dcm "
+        f"--files '{dicom_to_bids_procedure.inputs.input_directory}' "
         f"-o {dicom_to_bids_procedure.inputs.output_directory} "
         f"--overwrite "
         f"-ss {dicom_to_bids_procedure.inputs.session_id} "
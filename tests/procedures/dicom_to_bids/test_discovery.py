@@ -0,0 +1,41 @@
+import os
+
+from tests.procedures.dicom_to_bids.mock_dicom import write_dicom
+from yalab_procedures.procedures.dicom_to_bids import discovery
+from yalab_procedures.procedures.dicom_to_bids.catalogue import DicomCatalogue
+from yalab_procedures.procedures.dicom_to_bids.discovery import find_dicoms, is_dicom
+
+
+def test_find_dicoms_at_any_depth(tmp_path):
+    write_dicom(tmp_path / "series" / "0001.dcm", 1, "T1w_MPRAGE")
+    write_dicom(tmp_path / "a" / "b" / "c" / "IM0001", 2, "T2w_SPC")
+    (tmp_path / "a" / "notes.txt").write_text("not a DICOM")
+    (tmp_path / ".hidden").mkdir()
+    write_dicom(tmp_path / ".hidden" / "0001.dcm", 3, "T2w_SPC")
+    assert is_dicom(tmp_path / "a" / "b" / "c" / "IM0001")
+    assert not is_dicom(tmp_path / "a" / "notes.txt")
+    assert find_dicoms(tmp_path, workers=4) == [
+        str(tmp_path / "a" / "b" / "c" / "IM0001"),
+        str(tmp_path / "series" / "0001.dcm"),
+    ]
+
+
+def test_listings_are_cached(tmp_path, monkeypatch):
+    root = tmp_path / "dicom"
+    write_dicom(root / "a" / "IM0001", 1, "T1w_MPRAGE")
+    write_dicom(root / "b" / "IM0001", 2, "T2w_SPC")
+    catalogue = DicomCatalogue(tmp_path / "catalogue.sqlite")
+    files = find_dicoms(root, catalogue=catalogue)
+    assert len(files) == 2
+
+    checked = []
+    monkeypatch.setattr(
+        discovery, "is_dicom", lambda path: checked.append(path) or True
+    )
+    assert find_dicoms(root, catalogue=catalogue) == files
+    assert checked == []
+    # a new file changes the directory's mtime
+    write_dicom(root / "b" / "IM0002", 2, "T2w_SPC")
+    os.utime(root / "b", ns=(0, os.stat(root / "b").st_mtime_ns + 1))
+    assert len(find_dicoms(root, catalogue=catalogue)) == 3
+    assert sorted(checked) == [str(root / "b" / "IM0001"), str(root / "b" / "IM0002")]
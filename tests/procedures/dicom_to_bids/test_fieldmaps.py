@@ -0,0 +1,52 @@
+import csv
+import json
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from yalab_procedures.procedures.dicom_to_bids.fieldmaps import backfill_fieldmaps
+
+BVALS = [0, 1000, 0]
+
+
+def write_dwi(bids_dir, subject, session, direction, sidecar=True):
+    prefix = f"sub-{subject}_ses-{session}_dir-{direction}_dwi"
+    dwi = bids_dir / f"sub-{subject}" / f"ses-{session}" / "dwi"
+    dwi.mkdir(parents=True, exist_ok=True)
+    data = np.ones((2, 2, 2, len(BVALS)), dtype=np.int16)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), dwi / f"{prefix}.nii.gz")
+    (dwi / f"{prefix}.bval").write_text(" ".join(map(str, BVALS)) + "\n")
+    if sidecar:
+        (dwi / f"{prefix}.json").write_text(
+            json.dumps({"PhaseEncodingDirection": "j", "TotalReadoutTime": 0.05})
+        )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_backfill_fieldmaps(tmp_path, workers):
+    for session in ("a", "b"):
+        write_dwi(tmp_path, "01", session, "AP")
+        write_dwi(tmp_path, "01", session, "PA")
+    write_dwi(tmp_path, "02", "a", "AP")  # no PA
+    write_dwi(tmp_path, "03", "a", "AP")
+    write_dwi(tmp_path, "03", "a", "PA", sidecar=False)
+    (tmp_path / "sub-04" / "ses-a" / "anat").mkdir(parents=True)  # no DWI
+
+    statuses = backfill_fieldmaps(tmp_path, workers=workers)
+    assert [status[:3] for status in statuses] == [
+        ("01", "a", "created"),
+        ("01", "b", "created"),
+        ("02", "a", "skipped"),
+        ("03", "a", "failed"),
+    ]
+    assert "0 dir-PA DWI" in statuses[2].reason
+    assert "Missing PA DWI JSON" in statuses[3].reason
+    with open(tmp_path / ".heudiconv" / "fieldmaps.tsv") as summary:
+        rows = list(csv.reader(summary, delimiter="\t"))
+    assert rows[0] == ["subject", "session", "status", "reason"]
+    assert len(rows) == 5
+
+    # created fieldmaps are skipped the next time
+    statuses = backfill_fieldmaps(tmp_path)
+    assert statuses[0].reason == "fieldmap exists"
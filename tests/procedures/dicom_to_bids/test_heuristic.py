@@ -0,0 +1,48 @@
+from heudiconv.utils import SeqInfo
+
+from yalab_procedures.procedures.dicom_to_bids.matcher import Rule, RuleMatcher
+from yalab_procedures.procedures.dicom_to_bids.templates import heuristic
+
+
+def make_seqinfo(series_id, protocol_name, series_description="", image_type=()):
+    return SeqInfo(*[None] * len(SeqInfo._fields))._replace(
+        series_id=series_id,
+        protocol_name=protocol_name,
+        series_description=series_description,
+        image_type=image_type,
+    )
+
+
+def test_first_matching_rule_wins():
+    matcher = RuleMatcher(
+        [
+            Rule(("dwi_AP",), "ap"),
+            Rule(("dwi_AP_SBRef",), "ap_sbref"),
+            Rule(("T1w", "MPRAGE"), "t1"),
+            Rule((), "never"),
+        ]
+    )
+    assert matcher.match("dMRI_dwi_AP_SBRef").template == "ap"
+    assert matcher.match("anat_MPRAGE").template == "t1"
+    assert matcher.match("localizer") is None
+
+
+def test_infotodict():
+    seqinfos = [
+        make_seqinfo("1-T1w_MPRAGE", "T1w_MPRAGE", image_type=("ORIGINAL", "NORM")),
+        make_seqinfo("2-T1w_MPRAGE", "T1w_MPRAGE", image_type=("ORIGINAL",)),
+        make_seqinfo("3-rsfMRI_AP", "rsfMRI_AP", "rsfMRI_AP_SBRef"),
+        make_seqinfo("4-rsfMRI_AP", "rsfMRI_AP", "rsfMRI_AP"),
+        make_seqinfo("5-localizer", "localizer"),
+    ]
+    info, unmatched = heuristic.classify(seqinfos)
+    assert info == heuristic.infotodict(seqinfos)
+    assert len(info) == 39
+    templates = {key[0]: ids for key, ids in info.items() if ids}
+    assert templates == {
+        heuristic._template("anat", "ce-corrected_T1w"): ["1-T1w_MPRAGE"],
+        heuristic._template("anat", "ce-uncorrected_T1w"): ["2-T1w_MPRAGE"],
+        heuristic._template("func", "task-rest_sbref"): ["3-rsfMRI_AP"],
+        heuristic._template("func", "task-rest_bold"): ["4-rsfMRI_AP"],
+    }
+    assert [s.series_id for s in unmatched] == ["5-localizer"]
@@ -0,0 +1,88 @@
+import json
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from yalab_procedures.procedures.dicom_to_bids.templates.post_heudiconv import (
+    _volume_runs,
+    _write_mean_b0_epi,
+    create_pa_epi_workflow,
+    make_pa_epi,
+)
+
+BVALS = [0, 1000, 0, 0, 1000, 5, 1000]
+
+
+@pytest.fixture
+def bids_session(tmp_path):
+    dwi = tmp_path / "sub-01" / "ses-a" / "dwi"
+    dwi.mkdir(parents=True)
+    data = np.arange(4 * 5 * 6 * len(BVALS), dtype=np.int16).reshape(
+        (4, 5, 6, len(BVALS))
+    )
+    for direction in ("AP", "PA"):
+        prefix = dwi / f"sub-01_ses-a_dir-{direction}_dwi"
+        nib.save(nib.Nifti1Image(data, np.eye(4)), f"{prefix}.nii.gz")
+        (dwi / f"{prefix}.bval").write_text(" ".join(map(str, BVALS)) + "\n")
+        (dwi / f"{prefix}.json").write_text(
+            json.dumps({"PhaseEncodingDirection": "j", "TotalReadoutTime": 0.05})
+        )
+    return tmp_path, data
+
+
+def test_volume_runs():
+    assert _volume_runs([0, 2, 3, 5]) == [(0, 1), (2, 4), (5, 6)]
+    assert _volume_runs([]) == []
+
+
+@pytest.mark.parametrize("suffix", [".nii.gz", ".nii"])
+def test_write_mean_b0_epi(tmp_path, bids_session, suffix):
+    bids_dir, data = bids_session
+    prefix = bids_dir / "sub-01" / "ses-a" / "dwi" / "sub-01_ses-a_dir-PA_dwi"
+    pa_nii = f"{prefix}{suffix}"
+    if suffix == ".nii":
+        nib.save(nib.load(f"{prefix}.nii.gz"), pa_nii)
+    out = _write_mean_b0_epi(
+        pa_nii, f"{prefix}.bval", str(tmp_path / "epi.nii.gz"), compresslevel=9
+    )
+    b0s = [i for i, b in enumerate(BVALS) if b <= 50]
+    expected = data[..., b0s].mean(axis=3)
+    # saved with the input's (scaled) int16 data type
+    np.testing.assert_allclose(
+        nib.load(out).get_fdata(), expected, atol=expected.max() / 1000
+    )
+    assert not list(tmp_path.glob("*.tmp*"))
+
+
+def test_create_pa_epi_workflow(tmp_path, bids_session):
+    bids_dir, _ = bids_session
+    wf = create_pa_epi_workflow(str(bids_dir), "01", "a", threads=2)
+    wf.base_dir = str(tmp_path / "work")
+    # keep crash files of a failing node out of the working directory
+    wf.config["execution"]["crashdump_dir"] = str(tmp_path / "crash")
+    wf.run()
+    fmap = bids_dir / "sub-01" / "ses-a" / "fmap"
+    assert nib.load(fmap / "sub-01_ses-a_acq-dwi_dir-PA_epi.nii.gz").ndim == 3
+    sidecar = json.loads((fmap / "sub-01_ses-a_acq-dwi_dir-PA_epi.json").read_text())
+    assert sidecar["IntendedFor"] == ["ses-a/dwi/sub-01_ses-a_dir-AP_dwi.nii.gz"]
+
+
+def test_make_pa_epi(tmp_path, bids_session):
+    bids_dir, data = bids_session
+    result = make_pa_epi(str(bids_dir), "01", "a")
+    assert result["n_b0"] == 4
+    b0s = [i for i, b in enumerate(BVALS) if b <= 50]
+    np.testing.assert_allclose(
+        nib.load(result["epi_nii"]).get_fdata(),
+        data[..., b0s].mean(axis=3),
+        atol=data.max() / 1000,
+    )
+    sidecar = json.loads(open(result["epi_json"]).read())
+    assert sidecar["IntendedFor"] == ["ses-a/dwi/sub-01_ses-a_dir-AP_dwi.nii.gz"]
+
+
+def test_make_pa_epi_missing_pa(bids_session):
+    bids_dir, _ = bids_session
+    with pytest.raises(FileNotFoundError):
+        make_pa_epi(str(bids_dir), "01", "a", pe_dir="LR")
@@ -2,7 +2,12 @@
 
 from pathlib import Path
 
-from src.yalab_procedures.procedures.base.procedure import Procedure
+from nipype.interfaces.base import traits
+
+from src.yalab_procedures.procedures.base.procedure import (
+    Procedure,
+    ProcedureInputSpec,
+)
 
 
 class MockProcedure(Procedure):
@@ -11,3 +16,60 @@ class MockProcedure(Procedure):
         # Simulate some processing
         output_dir = Path(kwargs["output_directory"])
         output_dir.mkdir(parents=True, exist_ok=True)
+
+
+class MockStagingProcedure(MockProcedure):
+    """
+    Points its input directory at a staged copy, as the wrappers do.
+    """
+
+    def run_procedure(self, **kwargs):
+        temp_bids = Path(kwargs["output_directory"]).parent / "temp_bids"
+        temp_bids.mkdir(parents=True, exist_ok=True)
+        self.inputs.input_directory = str(temp_bids)
+        super().run_procedure(**kwargs)
+
+
+class MockBatchInputSpec(ProcedureInputSpec):
+    participant_label = traits.List(traits.Str, desc="Participant labels")
+
+
+class MockBatchProcedure(Procedure):
+    """
+    Processes several participants in one run; participant "bad" fails, and
+    participant "crash" fails the run before any output is written.
+    """
+
+    input_spec = MockBatchInputSpec
+
+    def run_procedure(self, **kwargs):
+        output_dir = Path(kwargs["output_directory"])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        labels = self.inputs.participant_label
+        with open(output_dir / "runs.txt", "a") as f:
+            f.write(" ".join(labels) + "\n")
+        if "crash" in labels:
+            raise RuntimeError("participant crash failed")
+        for label in labels:
+            if label != "bad":
+                (output_dir / f"sub-{label}.done").touch()
+        if "bad" in labels:
+            raise RuntimeError("participant bad failed")
+
+    def _participant_succeeded(self):
+        output_dir = Path(self.inputs.output_directory)
+        return all(
+            (output_dir / f"sub-{label}.done").exists()
+            for label in self.inputs.participant_label
+        )
+
+
+class MockSharedOutputsProcedure(MockBatchProcedure):
+    """
+    Returns early once any participant wrote the shared outputs.
+    """
+
+    def run_procedure(self, **kwargs):
+        if (Path(kwargs["output_directory"]) / "runs.txt").exists():
+            return
+        super().run_procedure(**kwargs)
@@ -0,0 +1,149 @@
+import json
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.bids_filters import (
+    BidsFilter,
+    parse_bids_filename,
+)
+from yalab_procedures.procedures.base.staging import stage_path
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+@pytest.fixture
+def subject_dir(temp_dir):
+    session = temp_dir / "bids" / "sub-01" / "ses-01"
+    files = [
+        "anat/sub-01_ses-01_T1w.nii.gz",
+        "anat/sub-01_ses-01_T1w.json",
+        "dwi/sub-01_ses-01_dir-AP_dwi.nii.gz",
+        "dwi/sub-01_ses-01_dir-AP_dwi.bval",
+        "dwi/sub-01_ses-01_dir-AP_dwi.bvec",
+        "dwi/sub-01_ses-01_dir-PA_dwi.nii.gz",
+        "func/sub-01_ses-01_task-rest_bold.nii.gz",
+        "func/sub-01_ses-01_task-rest_bold.json",
+        "sub-01_ses-01_scans.tsv",
+    ]
+    for name in files:
+        (session / name).parent.mkdir(parents=True, exist_ok=True)
+        (session / name).touch()
+    return temp_dir / "bids" / "sub-01"
+
+
+@pytest.fixture
+def referencing_subject_dir(subject_dir):
+    session = subject_dir / "ses-01"
+    (session / "sub-01_ses-01_scans.tsv").write_text(
+        "filename\tacq_time\n"
+        "anat/sub-01_ses-01_T1w.nii.gz\t2024-01-01T10:00:00\n"
+        "dwi/sub-01_ses-01_dir-AP_dwi.nii.gz\t2024-01-01T10:10:00\n"
+        "func/sub-01_ses-01_task-rest_bold.nii.gz\t2024-01-01T10:20:00\n"
+    )
+    (session / "fmap").mkdir()
+    (session / "fmap" / "sub-01_ses-01_dir-PA_epi.json").write_text(
+        json.dumps(
+            {
+                "PhaseEncodingDirection": "j",
+                "IntendedFor": [
+                    "ses-01/dwi/sub-01_ses-01_dir-AP_dwi.nii.gz",
+                    "bids::sub-01/ses-01/func/sub-01_ses-01_task-rest_bold.nii.gz",
+                ],
+            }
+        )
+    )
+    return subject_dir
+
+
+def test_parse_bids_filename():
+    entities = parse_bids_filename("sub-01_ses-01_dir-AP_run-1_dwi.nii.gz")
+    assert entities == {
+        "subject": "01",
+        "session": "01",
+        "direction": "AP",
+        "run": "1",
+        "suffix": "dwi",
+        "extension": ".nii.gz",
+    }
+
+
+def test_required_datatypes(subject_dir, temp_dir):
+    stats = stage_path(
+        subject_dir, temp_dir / "staged", include=BidsFilter(["anat", "dwi"])
+    )
+    session = temp_dir / "staged" / "sub-01" / "ses-01"
+    assert (session / "anat" / "sub-01_ses-01_T1w.nii.gz").exists()
+    assert (session / "dwi" / "sub-01_ses-01_dir-PA_dwi.nii.gz").exists()
+    assert (session / "sub-01_ses-01_scans.tsv").exists()
+    assert not (session / "func").exists()
+    assert stats["filtered"] == 1
+
+
+def test_filter_file_selects_images_and_sidecars(subject_dir, temp_dir):
+    filter_file = temp_dir / "filters.json"
+    filter_file.write_text(
+        json.dumps({"dwi": {"datatype": "dwi", "direction": "AP", "run": None}})
+    )
+    include = BidsFilter.from_file(filter_file, datatypes=["anat", "dwi"])
+    stage_path(subject_dir, temp_dir / "staged", include=include)
+    dwi = temp_dir / "staged" / "sub-01" / "ses-01" / "dwi"
+    assert sorted(p.name for p in dwi.iterdir()) == [
+        "sub-01_ses-01_dir-AP_dwi.bval",
+        "sub-01_ses-01_dir-AP_dwi.bvec",
+        "sub-01_ses-01_dir-AP_dwi.nii.gz",
+    ]
+
+
+def test_queries_refine_default_queries():
+    include = BidsFilter(queries={"t1w": {"session": "01"}})
+    assert include(Path("sub-01/ses-01/anat/sub-01_ses-01_T1w.nii.gz"))
+    assert not include(Path("sub-01/ses-02/anat/sub-01_ses-02_T1w.nii.gz"))
+    # other suffixes are not targeted by the t1w query
+    assert include(Path("sub-01/ses-02/anat/sub-01_ses-02_T2w.nii.gz"))
+    assert include(Path("sub-01/ses-02/dwi/sub-01_ses-02_dwi.nii.gz"))
+
+
+def test_trivial_filter():
+    assert BidsFilter().is_trivial()
+    assert not BidsFilter(["anat"]).is_trivial()
+
+
+def test_references_to_filtered_files_are_dropped(referencing_subject_dir, temp_dir):
+    source = referencing_subject_dir / "ses-01"
+    original_scans = (source / "sub-01_ses-01_scans.tsv").read_text()
+    stats = stage_path(
+        referencing_subject_dir,
+        temp_dir / "staged",
+        include=BidsFilter(["anat", "dwi", "fmap"]),
+    )
+    session = temp_dir / "staged" / "sub-01" / "ses-01"
+    scans = (session / "sub-01_ses-01_scans.tsv").read_text().splitlines()
+    assert [line.split("\t")[0] for line in scans] == [
+        "filename",
+        "anat/sub-01_ses-01_T1w.nii.gz",
+        "dwi/sub-01_ses-01_dir-AP_dwi.nii.gz",
+    ]
+    sidecar = json.loads(
+        (session / "fmap" / "sub-01_ses-01_dir-PA_epi.json").read_text()
+    )
+    assert sidecar == {
+        "PhaseEncodingDirection": "j",
+        "IntendedFor": ["ses-01/dwi/sub-01_ses-01_dir-AP_dwi.nii.gz"],
+    }
+    assert stats["rewritten"] == 2
+    # the sources are left untouched
+    assert (source / "sub-01_ses-01_scans.tsv").read_text() == original_scans
+    assert "bids::" in (source / "fmap" / "sub-01_ses-01_dir-PA_epi.json").read_text()
+
+
+def test_references_are_kept_without_filtering(referencing_subject_dir):
+    session = referencing_subject_dir / "ses-01"
+    include = BidsFilter(["anat", "dwi", "fmap", "func"])
+    assert include.rewrite(session / "sub-01_ses-01_scans.tsv") is None
+    assert include.rewrite(session / "fmap" / "sub-01_ses-01_dir-PA_epi.json") is None
@@ -0,0 +1,214 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from tests.procedures.procedure.mock_procedure import (
+    MockBatchProcedure,
+    MockProcedure,
+    MockSharedOutputsProcedure,
+)
+from yalab_procedures.procedures.base.cohort import (
+    CohortRunner,
+    batch_participants,
+    default_batch_inputs,
+    default_job_inputs,
+    discover_participants,
+)
+from yalab_procedures.procedures.dicom_to_bids import DicomToBidsProcedure
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+def test_discover_participants(temp_dir):
+    (temp_dir / "sub-01" / "ses-a").mkdir(parents=True)
+    (temp_dir / "sub-01" / "ses-b").mkdir(parents=True)
+    (temp_dir / "sub-02").mkdir(parents=True)
+    (temp_dir / "dataset_description.json").touch()
+    assert discover_participants(temp_dir) == [
+        ("01", "a"),
+        ("01", "b"),
+        ("02", None),
+    ]
+    assert discover_participants(temp_dir, sessions=False) == [
+        ("01", None),
+        ("02", None),
+    ]
+
+
+def test_default_job_inputs():
+    assert default_job_inputs(DicomToBidsProcedure, "01", "a") == {
+        "subject_id": "01",
+        "session_id": "a",
+    }
+    with pytest.raises(ValueError):
+        default_job_inputs(MockProcedure, "01", None)
+
+
+def test_cohort_runner_runs_and_skips(temp_dir):
+    input_dir = temp_dir / "input"
+    input_dir.mkdir()
+    runner = CohortRunner(
+        MockProcedure,
+        base_inputs={
+            "input_directory": str(input_dir),
+            "output_directory": str(temp_dir / "output"),
+        },
+        participants=[("01", None), ("02", "a")],
+        logging_root=temp_dir / "logs",
+        inputs_factory=lambda subject, session: {},
+        max_workers=2,
+    )
+    results = runner.run()
+    assert [r.status for r in results] == ["finished", "finished"]
+    assert (temp_dir / "logs" / "sub-02" / "ses-a").is_dir()
+    assert (temp_dir / "logs" / "MockProcedure_cohort_summary.tsv").exists()
+
+    results = runner.run()
+    assert [r.status for r in results] == ["skipped", "skipped"]
+
+
+def test_whole_subject_procedure_runs_once_per_subject(temp_dir):
+    input_dir = temp_dir / "input"
+    input_dir.mkdir()
+    output_dir = temp_dir / "output"
+    runner = CohortRunner(
+        MockBatchProcedure,
+        base_inputs={
+            "input_directory": str(input_dir),
+            "output_directory": str(output_dir),
+        },
+        participants=[("01", "a"), ("01", "b"), ("02", None)],
+        logging_root=temp_dir / "logs",
+        max_workers=1,
+    )
+    assert runner.participants == [("01", None), ("02", None)]
+    results = runner.run()
+    assert [(r.subject, r.session, r.status) for r in results] == [
+        ("01", None, "finished"),
+        ("02", None, "finished"),
+    ]
+    assert sorted((output_dir / "runs.txt").read_text().splitlines()) == ["01", "02"]
+
+
+def test_run_without_participant_outputs_fails(temp_dir):
+    input_dir = temp_dir / "input"
+    input_dir.mkdir()
+    runner = CohortRunner(
+        MockSharedOutputsProcedure,
+        base_inputs={
+            "input_directory": str(input_dir),
+            "output_directory": str(temp_dir / "output"),
+        },
+        participants=[("01", None), ("02", None)],
+        logging_root=temp_dir / "logs",
+        max_workers=1,
+    )
+    results = runner.run()
+    assert [r.status for r in results] == ["finished", "failed"]
+    assert results[1].error == "The run finished without the participant's outputs"
+    assert not list((temp_dir / "logs" / "sub-02").glob("*.done.json"))
+
+
+def test_batch_participants():
+    participants = [("01", "a"), ("01", "b"), ("02", None), ("03", None)]
+    assert batch_participants(participants, 2) == [
+        [("01", "a"), ("01", "b"), ("02", None)],
+        [("03", None)],
+    ]
+    assert default_batch_inputs(MockBatchProcedure, ["01", "02"]) == {
+        "participant_label": ["01", "02"]
+    }
+    with pytest.raises(ValueError):
+        default_batch_inputs(MockProcedure, ["01", "02"])
+
+
+def test_cohort_runner_batches(temp_dir):
+    input_dir = temp_dir / "input"
+    input_dir.mkdir()
+    output_dir = temp_dir / "output"
+    runner = CohortRunner(
+        MockBatchProcedure,
+        base_inputs={
+            "input_directory": str(input_dir),
+            "output_directory": str(output_dir),
+        },
+        participants=[("01", None), ("02", None), ("bad", None), ("03", None)],
+        logging_root=temp_dir / "logs",
+        max_workers=1,
+        batch_size=3,
+    )
+    results = runner.run()
+    assert [r.status for r in results] == ["finished", "finished", "failed", "finished"]
+    assert (output_dir / "runs.txt").read_text().splitlines() == ["01 02 bad", "03"]
+    # the participants of the failed batch that completed are not run again
+    assert (
+        temp_dir / "logs" / "sub-01" / "MockBatchProcedure-0.0.1.done.json"
+    ).exists()
+    results = runner.run()
+    assert [r.status for r in results] == ["skipped", "skipped", "failed", "skipped"]
+    assert (output_dir / "runs.txt").read_text().splitlines()[-1] == "bad"
+
+
+def test_failed_batch_does_not_record_previous_outputs(temp_dir):
+    input_dir = temp_dir / "input"
+    input_dir.mkdir()
+    output_dir = temp_dir / "output"
+    output_dir.mkdir()
+    # outputs of an earlier (e.g. differently configured) run
+    (output_dir / "sub-01.done").touch()
+    runner = CohortRunner(
+        MockBatchProcedure,
+        base_inputs={
+            "input_directory": str(input_dir),
+            "output_directory": str(output_dir),
+        },
+        participants=[("01", None), ("crash", None)],
+        logging_root=temp_dir / "logs",
+        max_workers=1,
+        batch_size=2,
+    )
+    results = runner.run()
+    assert [r.status for r in results] == ["failed", "failed"]
+    assert not (
+        temp_dir / "logs" / "sub-01" / "MockBatchProcedure-0.0.1.done.json"
+    ).exists()
+
+
+def test_batch_inputs_must_agree(temp_dir):
+    runner = CohortRunner(
+        MockBatchProcedure,
+        base_inputs={"output_directory": str(temp_dir / "output")},
+        participants=[("01", "a"), ("01", "b"), ("02", None)],
+        logging_root=temp_dir / "logs",
+        inputs_factory=lambda subject, session: {
+            "participant_label": [subject],
+            "force": session == "b",
+        },
+        batch_size=2,
+    )
+    inputs = runner.batch_inputs([("01", "a"), ("02", None)])
+    assert inputs["participant_label"] == ["01", "02"]
+    assert inputs["force"] is False
+    with pytest.raises(ValueError, match="'force'"):
+        runner.batch_inputs([("01", "a"), ("01", "b")])
+
+
+def test_auto_batch_size(temp_dir):
+    runner = CohortRunner(
+        MockBatchProcedure,
+        base_inputs={"mem_gb": 16},
+        participants=[],
+        logging_root=temp_dir,
+        max_workers=4,
+        batch_size="auto",
+        participant_memory_gb=6,
+    )
+    # 10 subjects over 4 workers, but only 2 fit in 16 GB
+    assert runner.resolve_batch_size(10) == 2
+    runner.participant_memory_gb = None
+    assert runner.resolve_batch_size(10) == 3
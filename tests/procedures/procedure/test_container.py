@@ -0,0 +1,82 @@
+import pytest
+
+from yalab_procedures.procedures.base.container import (
+    LocalRuntime,
+    Mount,
+    get_container_runtime,
+)
+
+MOUNTS = [
+    Mount("/host/bids", "/data", read_only=True),
+    Mount("/host/out", "/out"),
+    Mount("/host/work", "/work"),
+]
+
+
+def test_mount_from_argstr():
+    assert Mount.from_argstr("-v /host/bids:/data:ro") == Mount(
+        "/host/bids", "/data", True
+    )
+    assert Mount.from_argstr("-v /host/out:/out") == Mount("/host/out", "/out")
+
+
+def test_docker_command():
+    cmd = get_container_runtime("docker").command(
+        "pennlinc/qsiprep:1.0.0",
+        ["/data /out participant", "--work-dir /work"],
+        mounts=MOUNTS,
+        environment={"FS_LICENSE": "/fslicense.txt"},
+        user="1000:1000",
+        cpus=4,
+        memory_gb=2,
+        container_name="qsiprep-run",
+    )
+    assert cmd == (
+        "docker run --rm --name qsiprep-run --user 1000:1000 "
+        "--cpus 4 --memory 2048m "
+        "-v /host/bids:/data:ro -v /host/out:/out -v /host/work:/work "
+        "-e FS_LICENSE=/fslicense.txt "
+        "pennlinc/qsiprep:1.0.0 /data /out participant --work-dir /work"
+    )
+
+
+def test_apptainer_command(tmp_path):
+    runtime = get_container_runtime("apptainer")
+    assert not runtime.supports_names
+    cmd = runtime.command(
+        "pennlinc/qsiprep:1.0.0",
+        ["/data /out participant"],
+        mounts=MOUNTS[:2],
+        cpus=4,
+        container_name="ignored",
+    )
+    assert cmd == (
+        "apptainer run --cleanenv -B /host/bids:/data:ro -B /host/out:/out "
+        "docker://pennlinc/qsiprep:1.0.0 /data /out participant"
+    )
+    sif = tmp_path / "freesurfer.sif"
+    cmd = runtime.command(str(sif), ["-all"], entrypoint="recon-all")
+    assert cmd == f"apptainer exec --cleanenv {sif} recon-all -all"
+
+
+def test_local_command_maps_container_paths():
+    cmd = LocalRuntime().command(
+        "pennlinc/qsiprep:1.0.0",
+        ["/data /out participant", "--work-dir /work/qsiprep"],
+        mounts=MOUNTS,
+        environment={"FS_LICENSE": "/out/license.txt"},
+        cpus=4,
+    )
+    assert cmd == (
+        "env FS_LICENSE=/host/out/license.txt qsiprep /host/bids /host/out "
+        "participant --work-dir /host/work/qsiprep"
+    )
+    cmd = LocalRuntime("/opt/bin/fake-qsiprep").command(
+        "pennlinc/qsiprep:1.0.0", ["/datafile"], mounts=MOUNTS
+    )
+    assert cmd == "/opt/bin/fake-qsiprep /datafile"
+
+
+def test_unknown_runtime():
+    with pytest.raises(ValueError):
+        get_container_runtime("podman")
@@ -0,0 +1,56 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.fingerprint import (
+    changed_components,
+    compute_fingerprint,
+    normalize_inputs,
+    path_signature,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+def test_normalize_inputs_excludes_keys(temp_dir):
+    inputs = {"input_directory": temp_dir, "force": True, "nprocs": 4}
+    normalized = normalize_inputs(inputs, exclude=["force"])
+    assert normalized == {"input_directory": str(temp_dir), "nprocs": 4}
+
+
+def test_path_signature_tracks_changes(temp_dir):
+    (temp_dir / "a.txt").write_text("a")
+    before = path_signature(temp_dir)
+    assert path_signature(temp_dir) == before
+    (temp_dir / "b.txt").write_text("b")
+    assert path_signature(temp_dir) != before
+
+
+def test_content_hash_detects_same_size_edits(temp_dir):
+    data = temp_dir / "a.txt"
+    data.write_text("a")
+    stat = data.stat()
+    stat_before = path_signature(data)
+    hash_before = path_signature(data, hash_contents=True)
+    # edit in place, keeping the size and restoring the modification time
+    with open(data, "r+") as f:
+        f.write("b")
+    os.utime(data, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert data.stat().st_size == stat.st_size
+    assert data.stat().st_mtime_ns == stat.st_mtime_ns
+    # the stat signature cannot tell, the content hash does
+    assert path_signature(data) == stat_before
+    assert path_signature(data, hash_contents=True) != hash_before
+
+
+def test_compute_fingerprint_components(temp_dir):
+    first = compute_fingerprint({"a": 1}, "0.0.1", {"input": temp_dir}, "img:1")
+    second = compute_fingerprint({"a": 1}, "0.0.1", {"input": temp_dir}, "img:2")
+    assert first["fingerprint"] != second["fingerprint"]
+    assert changed_components(first["components"], second["components"]) == ["image"]
@@ -0,0 +1,105 @@
+import json
+import os
+import stat
+from pathlib import Path
+
+import pytest
+
+from tests.procedures.procedure.mock_procedure import MockProcedure
+from yalab_procedures.procedures.base.images import ImageCache, ensure_images
+from yalab_procedures.procedures.base.procedure import (
+    ContainerInputSpec,
+    ProcedureInputSpec,
+)
+
+FAKE_DOCKER = """#!/bin/sh
+echo "$@" >> "{calls}"
+if [ "$1" = "image" ]; then
+    echo '["pennlinc/qsiprep@sha256:abc"] sha256:123'
+fi
+"""
+
+FAKE_APPTAINER = """#!/bin/sh
+echo "$@" >> "{calls}"
+echo "sif content of $4" > "$3"
+"""
+
+
+class MockImageInputSpec(ProcedureInputSpec, ContainerInputSpec):
+    pass
+
+
+class MockImageProcedure(MockProcedure):
+    input_spec = MockImageInputSpec
+
+    def _container_image(self) -> str:
+        return "pennlinc/qsiprep:latest"
+
+
+def _install(bin_dir: Path, name: str, script: str, calls: Path):
+    path = bin_dir / name
+    path.write_text(script.format(calls=calls))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+
+
+@pytest.fixture
+def fake_runtimes(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    calls = tmp_path / "calls.txt"
+    _install(bin_dir, "docker", FAKE_DOCKER, calls)
+    _install(bin_dir, "apptainer", FAKE_APPTAINER, calls)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return calls
+
+
+def test_docker_image_is_pinned_once(tmp_path, fake_runtimes):
+    cache = ImageCache(tmp_path / "images")
+    image = cache.ensure("pennlinc/qsiprep:latest")
+    assert image.digest == "sha256:abc"
+    assert image.reference == "pennlinc/qsiprep@sha256:abc"
+    # the recorded digest is reused without pulling again
+    assert cache.ensure("pennlinc/qsiprep:latest") == image
+    assert fake_runtimes.read_text().count("pull") == 1
+    cache.ensure("pennlinc/qsiprep:latest", refresh=True)
+    assert fake_runtimes.read_text().count("pull") == 2
+
+
+def test_apptainer_images_are_converted_to_sif(tmp_path, fake_runtimes):
+    images = ensure_images(
+        ["pennlinc/qsiprep:1.0.0", "pennlinc/qsiprep:1.0.0", "freesurfer:7"],
+        tmp_path / "images",
+        runtime="apptainer",
+    )
+    assert len(images) == 2
+    sif = Path(images[0].reference)
+    assert sif.suffix == ".sif" and sif.is_file()
+    assert "docker://pennlinc/qsiprep:1.0.0" in sif.read_text()
+    index = json.loads((tmp_path / "images" / "apptainer-images.json").read_text())
+    assert index["pennlinc/qsiprep:1.0.0"]["digest"] == images[0].digest
+    # a deleted SIF file is converted again
+    sif.unlink()
+    assert ImageCache(tmp_path / "images", "apptainer").lookup(images[0].image) is None
+
+
+def test_fingerprint_does_not_pull(tmp_path, fake_runtimes):
+    (tmp_path / "input").mkdir()
+    inputs = {
+        "input_directory": str(tmp_path / "input"),
+        "output_directory": str(tmp_path / "output"),
+        "image_cache_directory": str(tmp_path / "images"),
+    }
+    procedure = MockImageProcedure(**inputs)
+    fingerprint = procedure._get_run_fingerprint()
+    assert fingerprint["components"]["image"] == "pennlinc/qsiprep:latest"
+    assert not procedure._is_up_to_date()
+    assert not fake_runtimes.exists()
+    # the run pulls the image, and records its digest
+    procedure.run()
+    assert fake_runtimes.read_text().count("pull") == 1
+    procedure = MockImageProcedure(**inputs)
+    assert procedure._get_run_fingerprint()["components"]["image"] == (
+        "pennlinc/qsiprep:latest@sha256:abc"
+    )
+    assert procedure._is_up_to_date()
+    assert fake_runtimes.read_text().count("pull") == 1
@@ -0,0 +1,67 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.manifest import (
+    MANIFEST_FILE,
+    StagingManifest,
+    file_digest,
+)
+from yalab_procedures.procedures.base.staging import stage_paths, staging_jobs
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+def stage(root: Path, staged: Path, hash_contents: bool = False):
+    return stage_paths(
+        staging_jobs(root, ["sub-01"], staged),
+        manifest=StagingManifest.load(staged, hash_contents=hash_contents),
+    )
+
+
+def test_restaging_is_incremental(temp_dir):
+    root = temp_dir / "bids"
+    anat = root / "sub-01" / "anat"
+    anat.mkdir(parents=True)
+    for name in ("T1w.nii.gz", "T2w.nii.gz", "FLAIR.nii.gz"):
+        (anat / name).write_bytes(name.encode())
+    staged = temp_dir / "staged"
+    stats = stage(root, staged)
+    assert stats["unchanged"] == 0
+    assert (staged / MANIFEST_FILE).exists()
+    # outputs written next to the staged files are not ours to remove
+    (staged / "freesurfer").mkdir()
+    (staged / "freesurfer" / "output").write_text("keep")
+
+    stats = stage(root, staged)
+    assert stats["unchanged"] == 3
+
+    # replace one file, remove another
+    replacement = temp_dir / "new_T1w.nii.gz"
+    replacement.write_bytes(b"new T1w")
+    replacement.replace(anat / "T1w.nii.gz")
+    (anat / "FLAIR.nii.gz").unlink()
+    stats = stage(root, staged)
+    assert stats["unchanged"] == 1
+    assert stats["removed"] == 1
+    staged_anat = staged / "sub-01" / "anat"
+    assert (staged_anat / "T1w.nii.gz").read_bytes() == b"new T1w"
+    assert not (staged_anat / "FLAIR.nii.gz").exists()
+    assert (staged / "freesurfer" / "output").exists()
+
+
+def test_hashed_manifest(temp_dir):
+    root = temp_dir / "bids"
+    (root / "sub-01").mkdir(parents=True)
+    (root / "sub-01" / "scans.tsv").write_text("data")
+    staged = temp_dir / "staged"
+    stage(root, staged, hash_contents=True)
+    manifest = StagingManifest.load(staged)
+    record = manifest.files["sub-01/scans.tsv"]
+    assert record["hash"] == file_digest(root / "sub-01" / "scans.tsv")
+    assert stage(root, staged, hash_contents=True)["unchanged"] == 1
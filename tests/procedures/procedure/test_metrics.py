@@ -0,0 +1,53 @@
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from tests.procedures.procedure.mock_procedure import MockProcedure
+from yalab_procedures.procedures.base.metrics import RunMetrics, parse_size
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+def test_parse_size():
+    assert parse_size("1.5GiB") == int(1.5 * 1024**3)
+    assert parse_size("200MB") == 200 * 1000**2
+    assert parse_size("12B") == 12
+    assert parse_size("") == 0
+
+
+def test_run_metrics_stages_accumulate():
+    metrics = RunMetrics(interval=60)
+    metrics.start()
+    with metrics.stage("staging"):
+        time.sleep(0.01)
+    with metrics.stage("staging"):
+        time.sleep(0.01)
+    snapshot = metrics.stop()
+    assert snapshot["stages"]["staging"] >= 0.02
+    assert snapshot["wall_time"] >= snapshot["stages"]["staging"]
+    assert snapshot["peak_rss_bytes"] > 0
+    # stopped metrics are frozen
+    assert metrics.as_dict() is snapshot
+
+
+def test_done_file_records_metrics(temp_dir):
+    input_dir = temp_dir / "input"
+    input_dir.mkdir()
+    procedure = MockProcedure(
+        input_directory=str(input_dir),
+        output_directory=str(temp_dir / "output"),
+        logging_directory=str(temp_dir / "logs"),
+    )
+    procedure.run()
+    done_file = json.loads(procedure._finished_file_path().read_text())
+    metrics = done_file["metrics"]
+    for key in ("wall_time", "user_time", "system_time", "peak_rss_bytes", "io"):
+        assert key in metrics
+    assert metrics["container"] is None
@@ -1,11 +1,16 @@
 # tests/procedures/procedure/test_procedure.py
 
+import json
 import tempfile
 from pathlib import Path
 
 import pytest
 
-from tests.procedures.procedure.mock_procedure import MockProcedure
+from tests.procedures.procedure.mock_procedure import (
+    MockBatchProcedure,
+    MockProcedure,
+    MockStagingProcedure,
+)
 from yalab_procedures.procedures.base.procedure import Procedure
 
 
@@ -75,3 +80,76 @@ def test_naive_procedure(temp_dir):
     procedure = Procedure(**config)
     with pytest.raises(NotImplementedError):
         procedure.run()
+
+
+def _count_runs(log_dir: Path) -> int:
+    return sum(
+        log_file.read_text().count("Running the mock procedure")
+        for log_file in log_dir.glob("*.log")
+    )
+
+
+def test_matching_fingerprint_skips_rerun(temp_dir):
+    input_dir = temp_dir / "input"
+    log_dir = temp_dir / "logs"
+    input_dir.mkdir(parents=True, exist_ok=True)
+    (input_dir / "data.txt").write_text("data")
+    config = {
+        "input_directory": str(input_dir),
+        "output_directory": str(temp_dir / "output"),
+        "logging_directory": str(log_dir),
+    }
+    MockProcedure(**config).run()
+    MockProcedure(**config).run()
+    assert _count_runs(log_dir) == 1
+    done_file = next(log_dir.glob("*.done.json"))
+    assert "fingerprint" in json.loads(done_file.read_text())
+
+
+def test_staged_input_directory_skips_rerun(temp_dir):
+    input_dir = temp_dir / "input"
+    log_dir = temp_dir / "logs"
+    input_dir.mkdir(parents=True, exist_ok=True)
+    (input_dir / "data.txt").write_text("data")
+    config = {
+        "input_directory": str(input_dir),
+        "output_directory": str(temp_dir / "output"),
+        "logging_directory": str(log_dir),
+    }
+    first = MockStagingProcedure(**config)
+    first.run()
+    second = MockStagingProcedure(**config)
+    second.run()
+    assert not first._skipped
+    assert second._skipped
+    assert _count_runs(log_dir) == 1
+
+
+def test_temporary_bids_name_depends_on_configuration(temp_dir):
+    config = {
+        "input_directory": str(temp_dir),
+        "output_directory": str(temp_dir / "output"),
+        "participant_label": ["01"],
+    }
+    first = MockBatchProcedure(**config)._temporary_bids_name("mock")
+    assert MockBatchProcedure(**config)._temporary_bids_name("mock") == first
+    config["output_directory"] = str(temp_dir / "other")
+    second = MockBatchProcedure(**config)._temporary_bids_name("mock")
+    assert second != first
+    assert first.startswith("mock_temp_bids_01_")
+
+
+def test_changed_input_triggers_rerun(temp_dir):
+    input_dir = temp_dir / "input"
+    log_dir = temp_dir / "logs"
+    input_dir.mkdir(parents=True, exist_ok=True)
+    (input_dir / "data.txt").write_text("data")
+    config = {
+        "input_directory": str(input_dir),
+        "output_directory": str(temp_dir / "output"),
+        "logging_directory": str(log_dir),
+    }
+    MockProcedure(**config).run()
+    (input_dir / "data.txt").write_text("new data")
+    MockProcedure(**config).run()
+    assert _count_runs(log_dir) == 2
@@ -0,0 +1,49 @@
+import json
+
+from yalab_procedures.procedures.base.progress import NipypeProgress
+
+LOG = [
+    '241017-10:00:00,001 nipype.workflow INFO:\t [Node] Setting-up "wf.sub_01_wf.n4" in "/work/wf/sub_01_wf/n4".',  # noqa: E501
+    '241017-10:00:00,002 nipype.workflow INFO:\t [Node] Setting-up "wf.sub_01_wf.hmc" in "/work/wf/sub_01_wf/hmc".',  # noqa: E501
+    '241017-10:00:01,000 nipype.workflow INFO:\t [Node] Finished "n4", elapsed time 12.5s.',  # noqa: E501
+    "241017-10:00:01,001 nipype.workflow INFO:\t [Job 3] Completed (wf.sub_01_wf.n4).",  # noqa: E501
+    '241017-10:00:02,000 nipype.workflow INFO:\t [Node] Setting-up "wf.sub_01_wf.bet" in "/work/wf/sub_01_wf/bet".',  # noqa: E501
+    '241017-10:00:02,001 nipype.workflow INFO:\t [Node] Cached "wf.sub_01_wf.bet" - collecting precomputed outputs',  # noqa: E501
+    "241017-10:00:02,002 nipype.workflow INFO:\t [Job 4] Cached (wf.sub_01_wf.bet).",
+    "an unrelated line",
+]
+
+
+def test_progress_events(tmp_path):
+    events = []
+    progress = NipypeProgress(tmp_path / "progress.jsonl", callback=events.append)
+    for line in LOG:
+        progress(line)
+    progress.close()
+    assert [(e["event"], e["node"]) for e in events] == [
+        ("started", "wf.sub_01_wf.n4"),
+        ("started", "wf.sub_01_wf.hmc"),
+        ("finished", "wf.sub_01_wf.n4"),
+        ("started", "wf.sub_01_wf.bet"),
+        ("cached", "wf.sub_01_wf.bet"),
+    ]
+    assert events[2]["elapsed"] == 12.5
+    assert events[2]["completed"] == 1 and events[2]["running"] == 1
+    written = [
+        json.loads(line)
+        for line in (tmp_path / "progress.jsonl").read_text().splitlines()
+    ]
+    assert written == events
+    summary = progress.summary()
+    assert summary["completed"] == 1 and summary["cached"] == 1
+    # the node still running is the one to look at when a run stalls
+    assert summary["running"] == ["wf.sub_01_wf.hmc"]
+    assert summary["slowest_nodes"]["wf.sub_01_wf.n4"] == 12.5
+
+
+def test_failed_node(tmp_path):
+    progress = NipypeProgress()
+    progress('[Node] Setting-up "wf.eddy" in "/work/wf/eddy".')
+    progress('[Node] Error on "wf.eddy" (/work/wf/eddy)')
+    assert progress.summary()["failed"] == ["wf.eddy"]
+    assert progress.summary()["running"] == []
@@ -0,0 +1,52 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.reaper import TRASH_DIRECTORY, Reaper
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+def make_tree(root: Path):
+    for subject in range(5):
+        directory = root / f"sub-{subject:02d}" / "dwi"
+        directory.mkdir(parents=True)
+        for i in range(10):
+            (directory / f"file_{i}.nii.gz").write_bytes(b"data")
+    (root / "dataset_description.json").write_text("{}")
+    os.symlink(root / "dataset_description.json", root / "link.json")
+
+
+def test_schedule_moves_aside_and_deletes(temp_dir):
+    tree = temp_dir / "temp_bids"
+    make_tree(tree)
+    reaper = Reaper(workers=4)
+    target = reaper.schedule(tree)
+    # the path is free right away
+    assert not tree.exists()
+    assert target.parent == temp_dir / TRASH_DIRECTORY
+    assert reaper.drain(timeout=30)
+    assert not target.exists()
+    assert reaper.pending() == 0
+
+
+def test_schedule_missing_path(temp_dir):
+    assert Reaper().schedule(temp_dir / "missing") is None
+
+
+def test_orphans_of_dead_processes_are_reaped(temp_dir):
+    trash = temp_dir / TRASH_DIRECTORY
+    orphan = trash / f"temp_bids.{2**22 + 1}.deadbeef"
+    make_tree(orphan)
+    tree = temp_dir / "other"
+    tree.mkdir()
+    reaper = Reaper()
+    reaper.schedule(tree)
+    assert reaper.drain(timeout=30)
+    assert list(trash.iterdir()) == []
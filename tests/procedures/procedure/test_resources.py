@@ -0,0 +1,70 @@
+import json
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from tests.procedures.procedure.mock_procedure import MockProcedure
+from yalab_procedures.procedures.base.resources import (
+    ResourceScheduler,
+    container_resource_flags,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+def test_scheduler_queues_when_budget_is_used(temp_dir):
+    scheduler = ResourceScheduler(temp_dir, cpus=4, memory_gb=8)
+    first = scheduler.try_acquire(3, 4)
+    assert first is not None
+    assert scheduler.try_acquire(2) is None
+    assert scheduler.try_acquire(1, 8) is None
+    second = scheduler.try_acquire(1, 4)
+    assert second is not None
+    scheduler.release(first)
+    assert scheduler.try_acquire(2) is not None
+
+
+def test_scheduler_clamps_oversized_requests(temp_dir):
+    scheduler = ResourceScheduler(temp_dir, cpus=2, memory_gb=4)
+    grant = scheduler.acquire(16, 64, timeout=0)
+    assert grant.cpus == 2
+    assert grant.memory_gb == 4
+
+
+def test_scheduler_reclaims_dead_leases(temp_dir):
+    scheduler = ResourceScheduler(temp_dir, cpus=2, memory_gb=4)
+    grant = scheduler.try_acquire(2)
+    ledger_file = temp_dir / "ledger.json"
+    ledger = json.loads(ledger_file.read_text())
+    ledger["leases"][grant.lease_id]["pid"] = 2**22 + 1  # no such process
+    ledger_file.write_text(json.dumps(ledger))
+    assert scheduler.try_acquire(2) is not None
+
+
+def test_budget_is_shared_between_instances(temp_dir):
+    ResourceScheduler(temp_dir, cpus=3, memory_gb=4)
+    assert ResourceScheduler(temp_dir).budget == {"cpus": 3, "memory_gb": 4.0}
+
+
+def test_container_resource_flags():
+    assert container_resource_flags(4, 2.5) == ["--cpus 4", "--memory 2560m"]
+    assert container_resource_flags(None, None) == []
+
+
+def test_procedure_releases_resources(temp_dir):
+    input_dir = temp_dir / "input"
+    input_dir.mkdir()
+    procedure = MockProcedure(
+        input_directory=str(input_dir),
+        output_directory=str(temp_dir / "output"),
+        resource_directory=str(temp_dir / "resources"),
+        mem_gb=1.0,
+    )
+    procedure.run()
+    ledger = json.loads((temp_dir / "resources" / "ledger.json").read_text())
+    assert ledger["leases"] == {}
@@ -0,0 +1,95 @@
+import logging
+import os
+import time
+from subprocess import CalledProcessError, TimeoutExpired
+
+import pytest
+
+from yalab_procedures.procedures.base.runner import run_command
+
+
+def test_run_command_streams_output(caplog):
+    logger = logging.getLogger("test_runner")
+    with caplog.at_level(logging.INFO, logger="test_runner"):
+        result = run_command("echo out; echo err 1>&2", logger)
+    assert result.returncode == 0
+    assert "out" in caplog.messages
+    assert "err" in caplog.messages
+
+
+def test_stderr_does_not_mean_failure():
+    logger = logging.getLogger("test_runner")
+    result = run_command("echo warning 1>&2", logger)
+    assert result.returncode == 0
+    assert result.stderr == "warning"
+
+
+def test_stderr_tail_is_bounded():
+    logger = logging.getLogger("test_runner")
+    result = run_command(
+        "for i in $(seq 1 50); do echo line$i 1>&2; done; exit 3",
+        logger,
+        check=False,
+        tail_lines=5,
+    )
+    assert result.returncode == 3
+    assert result.stderr_tail == [f"line{i}" for i in range(46, 51)]
+
+
+def test_non_zero_exit_raises():
+    logger = logging.getLogger("test_runner")
+    with pytest.raises(CalledProcessError) as error:
+        run_command("echo boom 1>&2; exit 2", logger)
+    assert error.value.returncode == 2
+    assert "boom" in error.value.stderr
+
+
+def test_line_callback_sees_both_streams():
+    logger = logging.getLogger("test_runner")
+    lines = []
+    run_command("echo out; echo err 1>&2", logger, line_callback=lines.append)
+    assert sorted(lines) == ["err", "out"]
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # zombies have exited, they only wait to be reaped
+            return stat.read().split(")")[-1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _wait_exited(pid: int, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not _is_running(pid):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_timeout_terminates_the_process_group():
+    logger = logging.getLogger("test_runner")
+    lines = []
+    start = time.monotonic()
+    with pytest.raises(TimeoutExpired):
+        run_command(
+            "sleep 60 & echo $!; wait", logger, line_callback=lines.append, timeout=1
+        )
+    assert time.monotonic() - start < 30
+    assert _wait_exited(int(lines[0]))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_failure_terminates_the_process_group():
+    logger = logging.getLogger("test_runner")
+    lines = []
+    start = time.monotonic()
+    result = run_command(
+        "sleep 60 & echo $!; exit 3", logger, check=False, line_callback=lines.append
+    )
+    assert result.returncode == 3
+    assert time.monotonic() - start < 30
+    assert _wait_exited(int(lines[0]))
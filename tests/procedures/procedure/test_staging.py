@@ -0,0 +1,130 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.staging import (
+    HARDLINK,
+    UNCHANGED,
+    BandwidthLimiter,
+    stage_file,
+    stage_path,
+    stage_paths,
+    staging_jobs,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+@pytest.fixture
+def bids_tree(temp_dir):
+    subject = temp_dir / "bids" / "sub-01"
+    (subject / "dwi").mkdir(parents=True)
+    (subject / "dwi" / "sub-01_dwi.nii.gz").write_bytes(b"dwi" * 100)
+    (subject / "dwi" / "sub-01_dwi.tck").write_bytes(b"tracks")
+    # a symlinked file and a symlinked directory, as produced by datalad/git-annex
+    external = temp_dir / "annex"
+    (external / "anat").mkdir(parents=True)
+    (external / "anat" / "sub-01_T1w.nii.gz").write_bytes(b"t1w")
+    (external / "sub-01_dwi.bval").write_text("0 1000")
+    os.symlink(external / "anat", subject / "anat")
+    os.symlink(external / "sub-01_dwi.bval", subject / "dwi" / "sub-01_dwi.bval")
+    return subject
+
+
+def test_stage_file_hardlinks_on_same_filesystem(temp_dir):
+    source = temp_dir / "source.txt"
+    source.write_text("data")
+    destination = temp_dir / "destination.txt"
+    assert stage_file(source, destination) == HARDLINK
+    assert os.path.samefile(source, destination)
+    # staging again is a no-op
+    assert stage_file(source, destination) == UNCHANGED
+
+
+def test_stage_path_follows_symlinks(bids_tree, temp_dir):
+    staged = temp_dir / "staged"
+    stats = stage_path(bids_tree, staged)
+    subject = staged / "sub-01"
+    assert not (subject / "anat").is_symlink()
+    assert (subject / "anat" / "sub-01_T1w.nii.gz").read_bytes() == b"t1w"
+    bval = subject / "dwi" / "sub-01_dwi.bval"
+    assert not bval.is_symlink()
+    assert bval.read_text() == "0 1000"
+    assert sum(stats[m] for m in ("hardlink", "reflink", "copy")) == 4
+
+
+def test_stage_path_excludes(bids_tree, temp_dir):
+    staged = temp_dir / "staged"
+    stage_path(bids_tree, staged, exclude=["*.tck*"])
+    assert (staged / "sub-01" / "dwi" / "sub-01_dwi.nii.gz").exists()
+    assert not (staged / "sub-01" / "dwi" / "sub-01_dwi.tck").exists()
+
+
+def test_stage_path_missing_source(temp_dir):
+    with pytest.raises(FileNotFoundError):
+        stage_path(temp_dir / "missing", temp_dir / "staged")
+
+
+def test_stage_paths_in_parallel(temp_dir):
+    root = temp_dir / "bids"
+    for subject in range(8):
+        (root / f"sub-{subject:02d}" / "anat").mkdir(parents=True)
+        (root / f"sub-{subject:02d}" / "anat" / "T1w.nii.gz").write_bytes(b"t1w")
+    (root / "dataset_description.json").write_text("{}")
+    paths = [f"sub-{subject:02d}" for subject in range(8)]
+    paths += ["dataset_description.json", "dataset_description.json"]
+    staged = temp_dir / "staged"
+    stats = stage_paths(staging_jobs(root, paths, staged), workers=4)
+    assert sum(stats[m] for m in ("hardlink", "reflink", "copy")) == 9
+    assert (staged / "sub-07" / "anat" / "T1w.nii.gz").exists()
+
+
+def test_stage_paths_with_job_excludes(temp_dir):
+    root = temp_dir / "bids"
+    (root / "sub-01" / "dwi").mkdir(parents=True)
+    (root / "sub-01" / "dwi" / "tracts.tck").write_bytes(b"raw")
+    paths = ["sub-01"]
+    for pipeline in ("qsirecon-a", "qsirecon-b"):
+        derivatives = root / "derivatives" / pipeline
+        (derivatives / "sub-01").mkdir(parents=True)
+        (derivatives / "sub-01" / "tracts.tck.gz").write_bytes(b"tck")
+        (derivatives / "sub-01" / "scalars.nii.gz").write_bytes(b"nii")
+        (derivatives / "dataset_description.json").write_text(pipeline)
+        paths += [
+            (f"derivatives/{pipeline}/sub-01", f"derivatives/{pipeline}", ("*.tck*",)),
+            f"derivatives/{pipeline}/dataset_description.json",
+        ]
+    staged = temp_dir / "staged"
+    stage_paths(staging_jobs(root, paths, staged), workers=4)
+    # the exclude only applies to the derivatives
+    assert (staged / "sub-01" / "dwi" / "tracts.tck").exists()
+    for pipeline in ("qsirecon-a", "qsirecon-b"):
+        derivatives = staged / "derivatives" / pipeline
+        assert not (derivatives / "sub-01" / "tracts.tck.gz").exists()
+        assert (derivatives / "sub-01" / "scalars.nii.gz").exists()
+        assert (derivatives / "dataset_description.json").read_text() == pipeline
+
+
+def test_stage_paths_fails_fast(temp_dir):
+    root = temp_dir / "bids"
+    (root / "sub-01").mkdir(parents=True)
+    with pytest.raises(FileNotFoundError):
+        stage_paths(
+            staging_jobs(root, ["sub-01", "sub-02"], temp_dir / "staged"), workers=2
+        )
+
+
+def test_bandwidth_limiter_throttles():
+    limiter = BandwidthLimiter(mb_per_second=1)
+    start = time.monotonic()
+    # the first second of transfer is a burst, the next half second is throttled
+    limiter.consume(1024**2)
+    limiter.consume(512 * 1024)
+    assert time.monotonic() - start >= 0.4
@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.reaper import get_reaper
+from yalab_procedures.procedures.base.staging_cache import StagingCache
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+@pytest.fixture
+def bids_root(temp_dir):
+    root = temp_dir / "bids"
+    (root / "sub-01" / "anat").mkdir(parents=True)
+    (root / "sub-01" / "anat" / "sub-01_T1w.nii.gz").write_bytes(b"t1w")
+    (root / "dataset_description.json").write_text("{}")
+    return root
+
+
+def test_entries_are_shared(bids_root, temp_dir):
+    cache = StagingCache(temp_dir / "cache")
+    paths = ["sub-01", "dataset_description.json"]
+    first = cache.acquire(bids_root, paths)
+    second = cache.acquire(bids_root, paths)
+    assert first.path == second.path
+    assert (first.path / "sub-01" / "anat" / "sub-01_T1w.nii.gz").exists()
+    assert (first.path / "dataset_description.json").exists()
+    index = json.loads((temp_dir / "cache" / "index.json").read_text())
+    assert len(index[first.key]["leases"]) == 2
+    cache.release(first)
+    cache.release(second)
+    index = json.loads((temp_dir / "cache" / "index.json").read_text())
+    assert index[first.key]["leases"] == {}
+
+
+def test_changed_source_gets_new_entry(bids_root, temp_dir):
+    cache = StagingCache(temp_dir / "cache")
+    with cache.lease(bids_root, ["sub-01"]) as first:
+        pass
+    t1w = bids_root / "sub-01" / "anat" / "sub-01_T1w.nii.gz"
+    t1w.write_bytes(b"new t1w")
+    os.utime(t1w, ns=(0, 0))
+    with cache.lease(bids_root, ["sub-01"]) as second:
+        assert second.key != first.key
+
+
+def test_lru_eviction_spares_leased_entries(temp_dir):
+    root = temp_dir / "bids"
+    for subject in ("01", "02", "03"):
+        (root / f"sub-{subject}").mkdir(parents=True)
+        (root / f"sub-{subject}" / "data").write_bytes(b"x" * 1024)
+    cache = StagingCache(temp_dir / "cache", quota_gb=1.5 * 1024 / 1024**3)
+    index_path = temp_dir / "cache" / "index.json"
+    leased = cache.acquire(root, ["sub-01"])
+    with cache.lease(root, ["sub-02"]) as lease:
+        second = lease.key
+    # fake the size of the entries, since hardlinks take no space
+    index = json.loads(index_path.read_text())
+    for entry in index.values():
+        entry["size"] = 1024
+    index_path.write_text(json.dumps(index))
+    with cache.lease(root, ["sub-03"]):
+        pass
+    index = json.loads(index_path.read_text())
+    assert leased.key in index
+    assert second not in index
+    assert not cache.entry_path(second).exists()
+    assert leased.path.exists()
+
+
+def test_dead_leases_are_dropped(bids_root, temp_dir):
+    cache = StagingCache(temp_dir / "cache")
+    lease = cache.acquire(bids_root, ["sub-01"])
+    index_path = temp_dir / "cache" / "index.json"
+    index = json.loads(index_path.read_text())
+    # a pid that cannot exist
+    index[lease.key]["leases"][lease.lease_id] = 2**22 + 1
+    index_path.write_text(json.dumps(index))
+    cache.evict()
+    index = json.loads(index_path.read_text())
+    assert index[lease.key]["leases"] == {}
+
+
+def test_leftovers_are_removed_without_quota(bids_root, temp_dir):
+    cache = StagingCache(temp_dir / "cache")
+    incoming = temp_dir / "cache" / "incoming"
+    # half-staged by a pid that cannot exist, and by this process
+    dead = incoming / f"key.{2**22 + 1}.lease"
+    alive = incoming / f"key.{os.getpid()}.lease"
+    for path in (dead, alive):
+        (path / "sub-01").mkdir(parents=True)
+    assert cache.evict() == []
+    assert get_reaper().drain(timeout=30)
+    assert not dead.exists()
+    assert alive.exists()
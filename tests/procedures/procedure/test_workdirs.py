@@ -0,0 +1,100 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.reaper import get_reaper
+from yalab_procedures.procedures.base.workdirs import MARKER_FILE, WorkDirectories
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+def test_claim_is_stable_and_resumable(temp_dir):
+    work_directories = WorkDirectories(temp_dir)
+    path = work_directories.claim("qsiprep", "sub-01", "abc")
+    assert path == temp_dir / "qsiprep" / "sub-01" / "abc"
+    (path / "node.pklz").write_text("cached")
+    work_directories.release(path, succeeded=False, keep="on_failure")
+    marker = json.loads((path / MARKER_FILE).read_text())
+    assert marker["status"] == "failed"
+    # the retry gets the same directory back, with its cached results
+    assert work_directories.claim("qsiprep", "sub-01", "abc") == path
+    assert (path / "node.pklz").exists()
+
+
+def test_claim_busy_directory(temp_dir):
+    work_directories = WorkDirectories(temp_dir)
+    path = work_directories.path("qsiprep", "sub-01", "abc")
+    path.mkdir(parents=True)
+    # owned by a live process (our parent)
+    (path / MARKER_FILE).write_text(
+        json.dumps({"owner": os.getppid(), "status": "running"})
+    )
+    private = work_directories.claim("qsiprep", "sub-01", "abc")
+    assert private == path.with_name(f"abc.{os.getpid()}")
+
+
+def _claim(root, barrier, paths):
+    barrier.wait()
+    paths.put(str(WorkDirectories(root).claim("qsiprep", "sub-01", "abc")))
+    # stay alive until every process claimed its directory
+    barrier.wait()
+
+
+def test_concurrent_claims_get_different_directories(temp_dir):
+    n_processes = 4
+    barrier = multiprocessing.Barrier(n_processes)
+    paths = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_claim, args=(temp_dir, barrier, paths))
+        for _ in range(n_processes)
+    ]
+    for process in processes:
+        process.start()
+    claimed = [paths.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+    assert len(set(claimed)) == n_processes
+    assert str(temp_dir / "qsiprep" / "sub-01" / "abc") in claimed
+
+
+def test_release_removes_successful_runs(temp_dir):
+    work_directories = WorkDirectories(temp_dir)
+    path = work_directories.claim("qsiprep", "sub-01", "abc")
+    work_directories.release(path, succeeded=True, keep="on_failure")
+    assert not path.exists()
+    path = work_directories.claim("qsiprep", "sub-02", "abc")
+    work_directories.release(path, succeeded=True, keep="always")
+    assert path.exists()
+    assert get_reaper().drain(timeout=30)
+
+
+def test_collect_by_age_and_quota(temp_dir):
+    work_directories = WorkDirectories(temp_dir)
+    paths = []
+    for i, subject in enumerate(["sub-01", "sub-02", "sub-03"]):
+        path = work_directories.claim("qsiprep", subject, "abc")
+        (path / "data").write_bytes(b"x" * 1024)
+        work_directories.release(path, succeeded=False, keep="on_failure")
+        marker = json.loads((path / MARKER_FILE).read_text())
+        marker["last_used"] = time.time() - (3 - i) * 86400
+        (path / MARKER_FILE).write_text(json.dumps(marker))
+        paths.append(path)
+    running = work_directories.claim("qsiprep", "sub-04", "abc")
+    (running / "data").write_bytes(b"x" * 4096)
+
+    removed = WorkDirectories(temp_dir, max_age_days=2.5).collect()
+    assert removed == [paths[0]]
+    # keep the most recently used directory within the quota
+    removed = WorkDirectories(temp_dir, quota_gb=1500 / 1024**3).collect()
+    assert removed == [paths[1]]
+    assert paths[2].exists() and running.exists()
+    assert get_reaper().drain(timeout=30)
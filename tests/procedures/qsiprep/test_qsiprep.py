@@ -0,0 +1,93 @@
+import stat
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from yalab_procedures.procedures.base.cohort import CohortRunner
+from yalab_procedures.procedures.qsiprep.qsiprep import QsiprepProcedure
+
+# stands in for QSIPrep: writes the report of every participant it is given
+FAKE_QSIPREP = """#!{python}
+import sys
+from pathlib import Path
+
+out = Path(sys.argv[2]) / "qsiprep"
+out.mkdir(parents=True, exist_ok=True)
+labels = sys.argv[sys.argv.index("--participant-label") + 1].split(",")
+with open(out.parent / "runs.txt", "a") as f:
+    f.write(" ".join(labels) + "\\n")
+for label in labels:
+    (out / f"sub-{{label}}.html").touch()
+"""
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+        yield Path(temp_dir)
+
+
+@pytest.fixture
+def base_inputs(temp_dir):
+    input_dir = temp_dir / "input"
+    for participant in ["01", "02"]:
+        (input_dir / f"sub-{participant}").mkdir(parents=True)
+    for path in [
+        "dataset_description.json",
+        "participants.tsv",
+        "participants.json",
+        "README",
+    ]:
+        (input_dir / path).touch()
+    license_file = temp_dir / "license.txt"
+    license_file.touch()
+    executable = temp_dir / "qsiprep"
+    executable.write_text(FAKE_QSIPREP.format(python=sys.executable))
+    executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+    return {
+        "input_directory": str(input_dir),
+        "output_directory": str(temp_dir / "output"),
+        "work_directory": str(temp_dir / "work"),
+        "fs_license_file": str(license_file),
+        "container_runtime": "local",
+        "local_executable": str(executable),
+        "nprocs": 1,
+    }
+
+
+def test_cohort_runs_every_participant(temp_dir, base_inputs):
+    runner = CohortRunner(
+        QsiprepProcedure,
+        base_inputs=base_inputs,
+        participants=[("01", None), ("02", None)],
+        logging_root=temp_dir / "logs",
+        max_workers=1,
+    )
+    results = runner.run()
+    assert [r.status for r in results] == ["finished", "finished"]
+    # the outputs of the first participant do not skip the second
+    output_dir = temp_dir / "output"
+    assert (output_dir / "runs.txt").read_text().splitlines() == ["01", "02"]
+    for participant in ["01", "02"]:
+        assert (output_dir / "qsiprep" / f"sub-{participant}.html").exists()
+
+    results = runner.run()
+    assert [r.status for r in results] == ["skipped", "skipped"]
+    assert len((output_dir / "runs.txt").read_text().splitlines()) == 2
+
+
+def test_outputs_of_a_participant_skip_its_run(temp_dir, base_inputs):
+    report = temp_dir / "output" / "qsiprep" / "sub-01.html"
+    report.parent.mkdir(parents=True)
+    report.touch()
+    procedure = QsiprepProcedure(
+        participant_label=["01"],
+        logging_directory=str(temp_dir / "logs"),
+        **base_inputs,
+    )
+    procedure.run()
+    assert not (temp_dir / "output" / "runs.txt").exists()
+    assert procedure._participant_succeeded("01")
+    assert not procedure._participant_succeeded("02")